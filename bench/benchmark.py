@@ -0,0 +1,329 @@
+# bench/benchmark.py
+# Offline benchmark for Guardian's hot paths against the stand-ins in fakes.py.
+#
+#   python bench/benchmark.py --containers 10,100,1000 --images 20 --scenarios cycle,cleanup,containers
+#
+# The memory scenario rebuilds the dashboard payloads with caching disabled and
+# reports the web process's resident memory afterwards (rss MB) next to the peak.
+#
+# The startup scenario times CLI commands that need no Docker daemon and fails
+# when one takes longer than STARTUP_BUDGET_S. It also starts `web.py` and
+# fails unless it answers within SERVE_BUDGET_S and exits on SIGTERM within
+# SERVE_STOP_BUDGET_S.
+#
+# Each (scenario, size) runs in a fresh worker process so peak RSS is per run;
+# the fake engine and registry run in a child of that worker.
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+SCENARIOS = ('cycle', 'cleanup', 'containers', 'plan', 'memory', 'startup')
+# Dashboard rebuilds per memory run; RSS is read after them
+MEMORY_REBUILDS = 10
+STARTUP_COMMANDS = (('status', '--json'), ('--help',))
+STARTUP_BUDGET_S = 0.2
+SERVE_BUDGET_S = 5
+SERVE_STOP_BUDGET_S = 5
+REWRITTEN_HOSTS = ('https://hub.docker.com', 'https://registry-1.docker.io',
+                   'https://auth.docker.io', 'https://api.telegram.org')
+
+
+def _run_fakes(options, socket_path, ready):
+    import fakes
+    world = fakes.FakeWorld(
+        containers=options['containers'],
+        images=options['images'],
+        change_rate=options['change_rate'],
+        failure_rate=options['failure_rate'],
+        docker_latency=options['docker_latency_ms'] / 1000,
+        registry_latency=options['registry_latency_ms'] / 1000,
+        labels={'guardian.enable': 'true', 'guardian.rollback': 'true'} if options.get('discovery') else None,
+        compose_projects=options.get('compose', 0),
+    )
+    _, registry = fakes.serve(world, socket_path)
+    ready.put(registry.server_address[1])
+    while True:
+        time.sleep(3600)
+
+
+def _install_http_shim(registry_url, counter):
+    """Send Guardian's registry, Hub and Telegram traffic to the fake registry and count it"""
+    import requests
+
+    original = requests.sessions.Session.request
+
+    def request(self, method, url, *args, **kwargs):
+        if url.startswith(REWRITTEN_HOSTS):
+            counter['http_calls'] += 1
+            url = registry_url + '/' + url.split('/', 3)[3]
+        elif url.startswith(('http://', 'https://')):
+            counter['http_calls'] += 1
+        return original(self, method, url, *args, **kwargs)
+
+    requests.sessions.Session.request = request
+
+
+def _write_config(options):
+    containers = [{
+        'name': f"bench-{i}",
+        'image': f"bench/app{i % options['images']}:latest",
+        'auto_update': True,
+        'rollback_on_failure': True,
+    } for i in range(options['containers'])]
+    config = {
+        'telegram_bot_token': '',
+        'telegram_chat_id': '',
+        'global': {
+            'cleanup_unused_images': True,
+            'cleanup_keep_last_n': 3,
+            'dry_run': False,
+            'max_concurrent_pulls': 2,
+            'prefetch_workers': 8,
+            'rollout_workers': 4,
+        },
+        'containers': containers,
+    }
+    if options.get('discovery'):
+        # Containers are found by their guardian.enable label instead of being listed
+        config['global']['discovery'] = {'enabled': True}
+        config['containers'] = []
+    with open('config.json', 'w') as f:
+        json.dump(config, f)
+
+
+def _rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return round(int(line.split()[1]) / 1024, 1)
+    return None
+
+
+def _engine_stats(client, reset=False):
+    api = client.api
+    response = api._get(api._url('/bench/reset' if reset else '/bench/stats'))
+    return response.json()
+
+
+def _serve_times(env):
+    """Seconds until `web.py` answers /jobs, and until it exits after SIGTERM"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    env = dict(env, GUARDIAN_HOST='127.0.0.1', GUARDIAN_PORT=str(port))
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, 'web.py')], env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            if server.poll() is not None:
+                raise SystemExit(f"web.py exited with {server.returncode} before answering")
+            if time.perf_counter() - started > SERVE_BUDGET_S * 4:
+                raise SystemExit("web.py did not answer")
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/jobs", timeout=1).read()
+                break
+            except OSError:
+                time.sleep(0.05)
+        ready = time.perf_counter() - started
+        stopping = time.perf_counter()
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=SERVE_STOP_BUDGET_S * 4)
+        return ready, time.perf_counter() - stopping
+    finally:
+        if server.poll() is None:
+            server.kill()
+
+
+def _startup_row(options, scenario, wall):
+    return {
+        'scenario': scenario,
+        'containers': options['containers'],
+        'images': options['images'],
+        'wall_s': round(wall, 3),
+        'docker_calls': 0,
+        'registry_calls': 0,
+        'http_calls': 0,
+        'rss_mb': None,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        'top_calls': {},
+    }
+
+
+def startup(options):
+    """Time no-Docker CLI commands in fresh interpreters (best of `repeat`), failing over budget"""
+    results = []
+    # DOCKER_HOST points nowhere: these commands must not try to connect
+    env = dict(os.environ, DOCKER_HOST='unix:///nonexistent/docker.sock')
+    for command in STARTUP_COMMANDS:
+        best = None
+        for _ in range(max(options['repeat'], 3)):
+            started = time.perf_counter()
+            subprocess.run([sys.executable, os.path.join(REPO_DIR, 'guardian.py'), *command],
+                           env=env, capture_output=True, check=True)
+            wall = time.perf_counter() - started
+            best = wall if best is None else min(best, wall)
+        results.append(_startup_row(options, f"startup {' '.join(command)}", best))
+    ready, stop = _serve_times(env)
+    results.append(_startup_row(options, 'startup web.py', ready))
+    results.append(_startup_row(options, 'shutdown web.py', stop))
+    print(json.dumps(results))
+    budgets = {'startup web.py': SERVE_BUDGET_S, 'shutdown web.py': SERVE_STOP_BUDGET_S}
+    slow = [f"{r['scenario']} ({r['wall_s']}s)" for r in results
+            if r['wall_s'] > budgets.get(r['scenario'], STARTUP_BUDGET_S)]
+    if slow:
+        raise SystemExit(f"over the startup budget: {', '.join(slow)}")
+
+
+def worker(options):
+    """Run one scenario and print a JSON result line"""
+    workdir = tempfile.mkdtemp(prefix='guardian-bench-')
+    os.chdir(workdir)
+    socket_path = os.path.join(workdir, 'docker.sock')
+    _write_config(options)
+    if options['scenario'] == 'startup':
+        startup(options)
+        return
+    if options['scenario'] == 'memory':
+        with open('config.json') as f:
+            config = json.load(f)
+        config['global']['containers_cache_ttl'] = 0
+        with open('config.json', 'w') as f:
+            json.dump(config, f)
+
+    ready = multiprocessing.Queue()
+    fakes_process = multiprocessing.Process(target=_run_fakes, args=(options, socket_path, ready), daemon=True)
+    fakes_process.start()
+    registry_port = ready.get(timeout=60)
+
+    os.environ['DOCKER_HOST'] = f"unix://{socket_path}"
+    counter = {'http_calls': 0}
+    _install_http_shim(f"http://127.0.0.1:{registry_port}", counter)
+
+    import logging
+    sys.path.insert(0, REPO_DIR)
+    import guardian
+    logging.getLogger().setLevel(logging.WARNING)
+    client = guardian.get_client()
+    if client is None:
+        raise SystemExit('Guardian could not connect to the fake Docker engine')
+
+    scenario = options['scenario']
+    if scenario in ('containers', 'memory'):
+        import web
+        web.docker_client = client
+        http = web.app.test_client()
+        run = lambda: http.get('/containers')
+        if scenario == 'memory':
+            def run():
+                for _ in range(MEMORY_REBUILDS):
+                    http.get('/containers')
+                    http.get('/status')
+    elif scenario == 'cleanup':
+        run = guardian.cleanup_images
+    elif scenario == 'plan':
+        run = guardian.plan_updates
+    else:
+        run = guardian.run_updates
+
+    results = []
+    for attempt in range(options['repeat']):
+        _engine_stats(client, reset=True)
+        counter['http_calls'] = 0
+        started = time.perf_counter()
+        run()
+        wall = time.perf_counter() - started
+        stats = _engine_stats(client)
+        results.append({
+            'scenario': scenario + (' (warm)' if attempt else ''),
+            'containers': options['containers'],
+            'images': options['images'],
+            'wall_s': round(wall, 3),
+            'docker_calls': sum(v for k, v in stats.items() if not k.startswith('registry')),
+            'registry_calls': sum(v for k, v in stats.items() if k.startswith('registry')),
+            'http_calls': counter['http_calls'],
+            'rss_mb': _rss_mb(),
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'top_calls': dict(sorted(stats.items(), key=lambda kv: -kv[1])[:5]),
+        })
+
+    fakes_process.terminate()
+    print(json.dumps(results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Guardian against a fake Docker engine and registry')
+    parser.add_argument('--containers', default='10,100', help='comma-separated container counts (10-2000)')
+    parser.add_argument('--images', type=int, default=10, help='number of distinct image repositories')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"comma-separated: {', '.join(SCENARIOS)}")
+    parser.add_argument('--change-rate', type=float, default=0.3, help='fraction of repositories with a newer image')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of injected API/registry failures')
+    parser.add_argument('--docker-latency-ms', type=float, default=0.0)
+    parser.add_argument('--registry-latency-ms', type=float, default=20.0)
+    parser.add_argument('--repeat', type=int, default=1, help='runs per worker; later runs are reported as warm')
+    parser.add_argument('--discovery', action='store_true', help='label the containers instead of listing them in config')
+    parser.add_argument('--compose', type=int, default=0, metavar='N',
+                        help='make the containers services of N Compose projects')
+    parser.add_argument('--json', action='store_true', help='print JSON lines instead of a table')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(json.loads(args.worker))
+        return
+
+    rows = []
+    failed = False
+    for count in [int(c) for c in args.containers.split(',')]:
+        for scenario in args.scenarios.split(','):
+            options = {
+                'scenario': scenario,
+                'containers': count,
+                'images': max(1, min(args.images, count)),
+                'change_rate': args.change_rate,
+                'failure_rate': args.failure_rate,
+                'docker_latency_ms': args.docker_latency_ms,
+                'registry_latency_ms': args.registry_latency_ms,
+                'repeat': args.repeat,
+                'discovery': args.discovery,
+                'compose': args.compose,
+            }
+            result = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', json.dumps(options)],
+                                    capture_output=True, text=True)
+            if result.returncode != 0:
+                print(f"{scenario} x{count} failed:\n{result.stderr}", file=sys.stderr)
+                failed = True
+                continue
+            for row in json.loads(result.stdout.strip().splitlines()[-1]):
+                rows.append(row)
+                if args.json:
+                    print(json.dumps(row), flush=True)
+
+    if not args.json:
+        header = (f"{'scenario':<24}{'containers':>11}{'images':>8}{'wall s':>10}{'docker':>9}{'registry':>10}"
+                  f"{'http':>7}{'rss MB':>9}{'peak MB':>9}")
+        print(header)
+        print('-' * len(header))
+        for row in rows:
+            print(f"{row['scenario']:<24}{row['containers']:>11}{row['images']:>8}{row['wall_s']:>10.3f}"
+                  f"{row['docker_calls']:>9}{row['registry_calls']:>10}{row['http_calls']:>7}"
+                  f"{row['rss_mb'] if row['rss_mb'] is not None else '-':>9}{row['peak_rss_mb']:>9}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,520 @@
+# bench/fakes.py
+# Stand-in Docker Engine API (unix socket) and Docker Hub/registry (HTTP) for
+# benchmarking Guardian offline. Both serve one deterministic, in-memory model.
+import hashlib
+import json
+import os
+import platform
+import random
+import re
+import socketserver
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ARCHES = [('amd64', None), ('arm64', 'v8'), ('arm', 'v7')]
+LAYERS_PER_IMAGE = 3
+LAYER_SIZE = 8 * 1024 * 1024
+
+MANIFEST_LIST = 'application/vnd.docker.distribution.manifest.list.v2+json'
+MANIFEST = 'application/vnd.docker.distribution.manifest.v2+json'
+
+
+def _digest(*parts):
+    return 'sha256:' + hashlib.sha256(':'.join(str(p) for p in parts).encode()).hexdigest()
+
+
+def _arch_key(arch, variant):
+    return f"{arch}/{variant}" if variant else arch
+
+
+def _mounts(container):
+    # Mounted volumes, plus a new anonymous volume for each declared one that nothing is mounted on
+    mounts = [{'Type': 'volume', 'Name': m['Source'], 'Destination': m['Target'], 'RW': not m.get('ReadOnly')}
+              for m in container['HostConfig'].get('Mounts') or () if m.get('Type') == 'volume']
+    mounted = {m['Destination'] for m in mounts}
+    for target in container['Config'].get('Volumes') or {}:
+        if target not in mounted:
+            mounts.append({'Type': 'volume', 'Name': _digest('volume', container['Id'], target)[7:],
+                           'Destination': target, 'RW': True})
+    return mounts
+
+
+def _matches_filters(container, filters):
+    """Engine-style `status` and `label` (key or key=value) container list filters"""
+    if filters.get('status') and container['State']['Status'] not in filters['status']:
+        return False
+    labels = container['Config'].get('Labels') or {}
+    for label in filters.get('label', []):
+        key, _, value = label.partition('=')
+        if key not in labels or (value and labels[key] != value):
+            return False
+    return True
+
+
+class FakeWorld:
+    """Containers, local images and remote repositories shared by both fakes"""
+
+    def __init__(self, containers=100, images=10, change_rate=0.3, failure_rate=0.0,
+                 docker_latency=0.0, registry_latency=0.0, seed=1, labels=None, compose_projects=0):
+        self.lock = threading.Lock()
+        self.rng = random.Random(seed)
+        self.failure_rate = failure_rate
+        self.docker_latency = docker_latency
+        self.registry_latency = registry_latency
+        self.stats = Counter()
+        self.host_arch = self._host_arch()
+
+        self.repos = [f"bench/app{j}" for j in range(images)]
+        # Remote generation per repo; changed repos are one generation ahead of what runs locally
+        self.remote_gen = {repo: (1 if self.rng.random() < change_rate else 0) for repo in self.repos}
+
+        self.images = {}
+        for repo in self.repos:
+            self._add_image(repo, 'latest', 0)
+            self._add_image(repo, 'old', -1)
+
+        self.containers = {}
+        for i in range(containers):
+            repo = self.repos[i % len(self.repos)]
+            container = self._add_container(f"bench-{i}", f"{repo}:latest", labels=labels)
+            if compose_projects:
+                self._make_compose_service(container, f"stack{i % compose_projects}", f"svc{i // compose_projects}")
+
+    @staticmethod
+    def _host_arch():
+        machine = platform.machine().lower()
+        if machine in ('aarch64', 'arm64'):
+            return ('arm64', 'v8')
+        if machine.startswith('armv7'):
+            return ('arm', 'v7')
+        return ('amd64', None)
+
+    # Model helpers
+
+    def config_digest(self, repo, gen, arch=None):
+        return _digest(repo, gen, _arch_key(*(arch or self.host_arch)), 'config')
+
+    def manifest_digest(self, repo, gen, arch):
+        return _digest(repo, gen, _arch_key(*arch), 'manifest')
+
+    def list_digest(self, repo, gen):
+        return _digest(repo, gen, 'list')
+
+    def layers(self, repo, gen, arch):
+        # The first layer is a shared base so "already exists" paths are exercised
+        return [{'digest': _digest('base', _arch_key(*arch)) if n == 0 else _digest(repo, gen, _arch_key(*arch), n),
+                 'size': LAYER_SIZE} for n in range(LAYERS_PER_IMAGE)]
+
+    def _add_image(self, repo, tag, gen):
+        image_id = self.config_digest(repo, gen)
+        ref = f"{repo}:{tag}"
+        for image in self.images.values():
+            if ref in image['RepoTags']:
+                image['RepoTags'].remove(ref)
+        image = self.images.setdefault(image_id, {
+            'Id': image_id,
+            'RepoTags': [],
+            'RepoDigests': [f"{repo}@{self.list_digest(repo, gen)}"],
+            'Created': 1700000000 + gen,
+            'Size': LAYER_SIZE * LAYERS_PER_IMAGE,
+        })
+        image['RepoTags'].append(ref)
+        return image
+
+    def _add_container(self, name, ref, image_id=None, labels=None):
+        image = self.find_image(ref)
+        container_id = _digest('container', name, time.time(), self.rng.random())[7:]
+        self.containers[container_id] = {
+            'Id': container_id,
+            'Name': f"/{name}",
+            'Image': image_id or image['Id'],
+            'Created': '2026-01-01T00:00:00.000000000Z',
+            'Config': {'Image': ref, 'Env': ['PATH=/usr/bin'], 'ExposedPorts': {'80/tcp': {}},
+                       'Labels': dict(labels or {})},
+            'State': {'Status': 'running', 'Running': True},
+            'HostConfig': {'RestartPolicy': {'Name': 'unless-stopped'}},
+            'NetworkSettings': {'Ports': {'80/tcp': None}},
+            'Mounts': [],
+        }
+        return self.containers[container_id]
+
+    def _make_compose_service(self, container, project, service):
+        # svc0 plays the database every other service of the project depends on
+        container['Config']['Labels'].update({'com.docker.compose.project': project,
+                                              'com.docker.compose.service': service})
+        if service != 'svc0':
+            container['Config']['Labels']['com.docker.compose.depends_on'] = 'svc0:service_started:false'
+        else:
+            # The database keeps its data in an anonymous volume, declared by its image
+            container['Config']['Volumes'] = {'/data': {}}
+            container['Mounts'] = _mounts(container)
+        container['Config']['Env'].append(f"SERVICE={service}")
+        network = f"{project}_default"
+        container['HostConfig']['NetworkMode'] = network
+        container['NetworkSettings']['Networks'] = {network: {'Aliases': [service, container['Id'][:12]],
+                                                              'NetworkID': _digest('network', network)[7:]}}
+
+    def find_container(self, ref):
+        if ref in self.containers:
+            return self.containers[ref]
+        for container in self.containers.values():
+            if container['Name'] == f"/{ref}" or container['Id'].startswith(ref):
+                return container
+        return None
+
+    def find_image(self, ref):
+        if ref.startswith('sha256:') and ref in self.images:
+            return self.images[ref]
+        if ':' not in ref.rsplit('/', 1)[-1] and not re.fullmatch(r'[0-9a-f]{12,64}', ref):
+            ref = f"{ref}:latest"
+        for image in self.images.values():
+            if ref in image['RepoTags'] or image['Id'][7:].startswith(ref):
+                return image
+        return None
+
+    def fail(self):
+        return self.failure_rate and self.rng.random() < self.failure_rate
+
+
+# Docker Engine API
+
+class EngineHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    world = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=None, content_type='application/json'):
+        data = b'' if body is None else (body if isinstance(body, bytes) else json.dumps(body).encode())
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status, message):
+        self._send(status, {'message': message})
+
+    def _route(self, method):
+        world = self.world
+        url = urlparse(self.path)
+        path = re.sub(r'^/v[\d.]+', '', url.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'null') if length else None
+
+        endpoint = re.sub(r'^/containers/(?!json$|create$)[^/]+', '/containers/{id}', path)
+        endpoint = re.sub(r'^/images/(?!json$|create$|prune$).+?(/json)?$', r'/images/{id}\1', endpoint)
+        if not path.startswith('/bench/'):
+            with world.lock:
+                world.stats[f"{method} {endpoint}"] += 1
+            if world.docker_latency:
+                time.sleep(world.docker_latency)
+
+        if path == '/bench/stats':
+            return self._send(200, dict(world.stats))
+        if path == '/bench/reset':
+            world.stats.clear()
+            return self._send(200, {})
+        if path == '/_ping':
+            return self._send(200, b'OK', 'text/plain')
+        if path == '/version':
+            return self._send(200, {'ApiVersion': '1.41', 'MinAPIVersion': '1.12', 'Version': '24.0.0',
+                                    'Os': 'linux', 'Arch': world.host_arch[0]})
+        if path == '/info':
+            return self._send(200, {'Architecture': platform.machine(), 'Containers': len(world.containers),
+                                    'Images': len(world.images), 'DockerRootDir': '/var/lib/docker'})
+        if path == '/build/prune' and method == 'POST':
+            return self._send(200, {'CachesDeleted': [], 'SpaceReclaimed': 0})
+
+        if path == '/images/create' and method == 'POST':
+            return self._pull(query.get('fromImage'), query.get('tag') or 'latest')
+
+        with world.lock:
+            if path == '/containers/json':
+                show_all = query.get('all') in ('1', 'true', 'True')
+                filters = json.loads(query.get('filters') or '{}')
+                return self._send(200, [{
+                    'Id': c['Id'], 'Names': [c['Name']], 'Image': c['Config']['Image'], 'ImageID': c['Image'],
+                    'State': c['State']['Status'], 'Status': 'Up 2 hours', 'Ports': [], 'Created': 1767225600,
+                    'Labels': c['Config'].get('Labels', {}),
+                } for c in world.containers.values() if (show_all or c['State']['Running'])
+                    and _matches_filters(c, filters)])
+            if path == '/containers/create':
+                name = query.get('name')
+                if world.find_container(name):
+                    return self._error(409, f"Conflict. The container name \"/{name}\" is already in use")
+                image = world.find_image(body['Image'])
+                if image is None:
+                    return self._error(404, f"No such image: {body['Image']}")
+                container = world._add_container(name, body['Image'], image['Id'], body.get('Labels'))
+                container['Config'].update({k: v for k, v in body.items() if k not in ('HostConfig', 'NetworkingConfig')})
+                container['HostConfig'] = body.get('HostConfig') or container['HostConfig']
+                endpoints = (body.get('NetworkingConfig') or {}).get('EndpointsConfig')
+                if endpoints:
+                    container['NetworkSettings']['Networks'] = {n: dict(e) for n, e in endpoints.items()}
+                container['Mounts'] = _mounts(container)
+                container['State'] = {'Status': 'created', 'Running': False}
+                return self._send(201, {'Id': container['Id'], 'Warnings': []})
+            m = re.fullmatch(r'/networks/([^/]+)/connect', path)
+            if m and method == 'POST':
+                container = world.find_container(body['Container'])
+                if container is None:
+                    return self._error(404, f"No such container: {body['Container']}")
+                networks = container['NetworkSettings'].setdefault('Networks', {})
+                networks[m.group(1)] = dict(body.get('EndpointConfig') or {})
+                return self._send(200)
+
+            m = re.fullmatch(r'/containers/([^/]+)(/json|/start|/stop)?', path)
+            if m:
+                container = world.find_container(m.group(1))
+                if container is None:
+                    return self._error(404, f"No such container: {m.group(1)}")
+                action = m.group(2)
+                if method == 'GET' and action == '/json':
+                    return self._send(200, container)
+                if method == 'POST' and action == '/start':
+                    if world.fail():
+                        return self._error(500, 'injected start failure')
+                    container['State'] = {'Status': 'running', 'Running': True}
+                    return self._send(204)
+                if method == 'POST' and action == '/stop':
+                    container['State'] = {'Status': 'exited', 'Running': False}
+                    return self._send(204)
+                if method == 'DELETE' and action is None:
+                    del world.containers[container['Id']]
+                    return self._send(204)
+
+            if path == '/images/prune' and method == 'POST':
+                dangling = [i for i in world.images.values() if not i['RepoTags']
+                            and not any(c['Image'] == i['Id'] for c in world.containers.values())]
+                for image in dangling:
+                    del world.images[image['Id']]
+                return self._send(200, {'ImagesDeleted': [{'Deleted': i['Id']} for i in dangling],
+                                        'SpaceReclaimed': sum(i['Size'] for i in dangling)})
+            if path == '/system/df':
+                return self._send(200, {
+                    'LayersSize': sum(i['Size'] for i in world.images.values()),
+                    'Images': [dict(i, SharedSize=0, Containers=sum(c['Image'] == i['Id'] for c in world.containers.values()))
+                               for i in world.images.values()],
+                    'Containers': [{'Id': c['Id'], 'SizeRw': 0} for c in world.containers.values()],
+                    'BuildCache': [],
+                    'Volumes': [],
+                })
+            if path == '/images/json':
+                references = json.loads(query.get('filters') or '{}').get('reference', [])
+                return self._send(200, [dict(i) for i in world.images.values()
+                                        if not references or any(t.rsplit(':', 1)[0] in references
+                                                                 for t in i['RepoTags'])])
+
+            m = re.fullmatch(r'/images/(.+?)(/json|/tag)?', path)
+            if m:
+                ref = m.group(1)
+                image = world.find_image(ref)
+                if image is None:
+                    return self._error(404, f"No such image: {ref}")
+                if method == 'GET' and m.group(2) == '/json':
+                    return self._send(200, image)
+                if method == 'POST' and m.group(2) == '/tag':
+                    tag = f"{query['repo']}:{query.get('tag') or 'latest'}"
+                    for other in world.images.values():
+                        if tag in other['RepoTags']:
+                            other['RepoTags'].remove(tag)
+                    image['RepoTags'].append(tag)
+                    return self._send(201)
+                if method == 'DELETE':
+                    # Removing one of several tags only untags the image
+                    if ref in image['RepoTags'] and len(image['RepoTags']) > 1:
+                        image['RepoTags'].remove(ref)
+                        return self._send(200, [{'Untagged': ref}])
+                    in_use = any(c['Image'] == image['Id'] for c in world.containers.values())
+                    if in_use and query.get('force') not in ('1', 'true', 'True'):
+                        return self._error(409, f"conflict: unable to remove {ref} (image is being used)")
+                    del world.images[image['Id']]
+                    return self._send(200, [{'Untagged': t} for t in image['RepoTags']] + [{'Deleted': image['Id']}])
+
+        return self._error(404, f"page not found: {method} {path}")
+
+    def _pull(self, repo, tag):
+        world = self.world
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def emit(event):
+            data = (json.dumps(event) + '\r\n').encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b'\r\n')
+
+        emit({'status': f"Pulling from {repo}", 'id': tag})
+        with world.lock:
+            failed = world.fail()
+            local = {i['Id'] for i in world.images.values()}
+        if failed:
+            emit({'error': 'injected pull failure', 'errorDetail': {'message': 'injected pull failure'}})
+        elif repo not in world.remote_gen:
+            emit({'error': f"pull access denied for {repo}"})
+        else:
+            gen = world.remote_gen[repo]
+            for n, layer in enumerate(world.layers(repo, gen, world.host_arch)):
+                layer_id = layer['digest'][7:19]
+                if world.config_digest(repo, gen) in local or n == 0:
+                    emit({'status': 'Already exists', 'id': layer_id})
+                    continue
+                emit({'status': 'Pulling fs layer', 'id': layer_id})
+                for current in (layer['size'] // 2, layer['size']):
+                    emit({'status': 'Downloading', 'id': layer_id,
+                          'progressDetail': {'current': current, 'total': layer['size']}})
+                emit({'status': 'Download complete', 'id': layer_id})
+                emit({'status': 'Pull complete', 'id': layer_id})
+            with world.lock:
+                world._add_image(repo, tag, gen)
+            emit({'status': f"Digest: {world.list_digest(repo, gen)}"})
+            emit({'status': f"Status: Downloaded newer image for {repo}:{tag}"})
+        self.wfile.write(b'0\r\n\r\n')
+
+    def do_GET(self):
+        self._route('GET')
+
+    def do_POST(self):
+        self._route('POST')
+
+    def do_DELETE(self):
+        self._route('DELETE')
+
+
+class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        return request, ('local', 0)
+
+
+# Docker Hub and registry v2
+
+class RegistryHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    world = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    def do_GET(self):
+        world = self.world
+        path = urlparse(self.path).path
+        endpoint = re.sub(r'/(manifests|tags)/.*$', r'/\1/*', re.sub(r'/bench/app\d+', '/{repo}', path))
+        if self.command == 'HEAD':
+            endpoint = f"HEAD {endpoint}"
+        if not path.startswith('/bench/'):
+            with world.lock:
+                world.stats[f"registry {endpoint}"] += 1
+            if world.registry_latency:
+                time.sleep(world.registry_latency)
+
+        if path == '/bench/stats':
+            return self._send(200, dict(world.stats))
+        if world.fail():
+            return self._send(503, {'errors': [{'code': 'UNAVAILABLE'}]})
+
+        # Docker Hub tag listing
+        m = re.fullmatch(r'/v2/repositories/(.+)/tags/?', path)
+        if m:
+            repo = m.group(1)
+            if repo not in world.remote_gen:
+                return self._send(404, {'message': 'not found'})
+            gen = world.remote_gen[repo]
+            results = []
+            for tag, tag_gen in (('latest', gen), ('old', -1)):
+                results.append({
+                    'name': tag,
+                    'last_updated': f"2026-01-{10 + tag_gen:02d}T00:00:00Z",
+                    'full_size': LAYER_SIZE * LAYERS_PER_IMAGE,
+                    'images': [{'architecture': arch, 'variant': variant, 'os': 'linux',
+                                'digest': world.manifest_digest(repo, tag_gen, (arch, variant)),
+                                'size': LAYER_SIZE * LAYERS_PER_IMAGE,
+                                'last_pushed': f"2026-01-{10 + tag_gen:02d}T00:00:00Z"}
+                               for arch, variant in ARCHES],
+                })
+            return self._send(200, {'count': len(results), 'results': results})
+
+        # Registry manifests
+        m = re.fullmatch(r'/v2/(.+)/manifests/(.+)', path)
+        if m:
+            repo, reference = m.groups()
+            if repo not in world.remote_gen:
+                return self._send(404, {'errors': [{'code': 'MANIFEST_UNKNOWN'}]})
+            gen = world.remote_gen[repo] if reference != 'old' else -1
+            # Pulled images reference their manifest list by digest
+            list_gen = next((g for g in (world.remote_gen[repo], -1, 0)
+                             if world.list_digest(repo, g) == reference), None)
+            if list_gen is not None:
+                gen = list_gen
+            if not reference.startswith('sha256:') or list_gen is not None:
+                manifest = {
+                    'schemaVersion': 2,
+                    'mediaType': MANIFEST_LIST,
+                    'manifests': [{'mediaType': MANIFEST, 'size': 500,
+                                   'digest': world.manifest_digest(repo, gen, (arch, variant)),
+                                   'platform': dict({'architecture': arch, 'os': 'linux'},
+                                                    **({'variant': variant} if variant else {}))}
+                                  for arch, variant in ARCHES],
+                }
+                return self._send(200, manifest, {'Content-Type': MANIFEST_LIST,
+                                                  'Docker-Content-Digest': world.list_digest(repo, gen)})
+            for g in (world.remote_gen[repo], -1, 0):
+                for arch in ARCHES:
+                    if world.manifest_digest(repo, g, arch) == reference:
+                        manifest = {
+                            'schemaVersion': 2,
+                            'mediaType': MANIFEST,
+                            'config': {'mediaType': 'application/vnd.docker.container.image.v1+json',
+                                       'digest': world.config_digest(repo, g, arch), 'size': 1000},
+                            'layers': world.layers(repo, g, arch),
+                        }
+                        return self._send(200, manifest, {'Content-Type': MANIFEST,
+                                                          'Docker-Content-Digest': reference})
+            return self._send(404, {'errors': [{'code': 'MANIFEST_UNKNOWN'}]})
+
+        # Telegram and anything else Guardian may call
+        return self._send(200, {'ok': True})
+
+    # Same headers as GET, without the body
+    do_HEAD = do_GET
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        with self.world.lock:
+            self.world.stats['registry POST'] += 1
+        self._send(200, {'ok': True})
+
+
+def serve(world, socket_path, registry_port=0):
+    """Start both fakes on background threads; returns (engine server, registry server)"""
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    engine_handler = type('BoundEngineHandler', (EngineHandler,), {'world': world})
+    registry_handler = type('BoundRegistryHandler', (RegistryHandler,), {'world': world})
+
+    engine = UnixHTTPServer(socket_path, engine_handler)
+    registry = ThreadingHTTPServer(('127.0.0.1', registry_port), registry_handler)
+    registry.daemon_threads = True
+    for server in (engine, registry):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return engine, registry
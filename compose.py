@@ -0,0 +1,137 @@
+# compose.py
+import logging
+
+PROJECT_LABEL = 'com.docker.compose.project'
+SERVICE_LABEL = 'com.docker.compose.service'
+# Written by Compose v2.21+: "db:service_started:false,cache:service_healthy:true"
+DEPENDS_ON_LABEL = 'com.docker.compose.depends_on'
+GROUP_PREFIX = 'compose:'
+
+# Endpoint settings defined by the compose file; IPs, MACs and IDs are assigned by the engine
+ENDPOINT_FIELDS = ('Aliases', 'IPAMConfig', 'Links', 'DriverOpts')
+# Config values a container inherits from its image unless the compose file overrides them
+IMAGE_DEFAULT_FIELDS = ('Cmd', 'Entrypoint', 'WorkingDir', 'User', 'Healthcheck', 'StopSignal')
+
+
+def service_info(labels):
+    """Project, service and service dependencies of a Compose-created container; None for other containers"""
+    labels = labels or {}
+    if not labels.get(PROJECT_LABEL) or not labels.get(SERVICE_LABEL):
+        return None
+    depends_on = [part.split(':')[0].strip() for part in labels.get(DEPENDS_ON_LABEL, '').split(',') if part.strip()]
+    return {'project': labels[PROJECT_LABEL], 'service': labels[SERVICE_LABEL], 'depends_on': depends_on}
+
+
+def create_body(attrs):
+    """The container create request that reproduces an inspected container (Config + HostConfig + networks).
+
+    Values the engine derived from the container ID (default hostname, ID
+    alias) are dropped so the recreated container gets its own; its
+    anonymous volumes are mounted by name.
+    """
+    short_id = attrs['Id'][:12]
+    body = dict(attrs['Config'])
+    if body.get('Hostname') == short_id:
+        del body['Hostname']
+    body['HostConfig'] = dict(attrs.get('HostConfig') or {})
+    anonymous = anonymous_volumes(attrs)
+    if anonymous:
+        body['HostConfig']['Mounts'] = list(body['HostConfig'].get('Mounts') or []) + anonymous
+    endpoints = {}
+    for network, endpoint in ((attrs.get('NetworkSettings') or {}).get('Networks') or {}).items():
+        kept = {key: (endpoint or {})[key] for key in ENDPOINT_FIELDS if (endpoint or {}).get(key)}
+        if kept.get('Aliases'):
+            kept['Aliases'] = [alias for alias in kept['Aliases'] if alias != short_id]
+        endpoints[network] = kept
+    body['NetworkingConfig'] = {'EndpointsConfig': endpoints}
+    return body
+
+
+def anonymous_volumes(attrs):
+    """Volume mounts the engine created for a container (image VOLUMEs, `-v /path`), as HostConfig.Mounts.
+
+    They appear in neither Binds nor HostConfig.Mounts, where named and Compose
+    volumes are, so a container created from the config alone would get new,
+    empty ones; reattaching them by name keeps their data like Compose does.
+    """
+    host_config = attrs.get('HostConfig') or {}
+    declared = {bind.split(':')[1] for bind in host_config.get('Binds') or () if ':' in bind}
+    declared |= {mount.get('Target') for mount in host_config.get('Mounts') or ()}
+    return [{'Type': 'volume', 'Source': mount['Name'], 'Target': mount['Destination'],
+             'ReadOnly': not mount.get('RW', True)}
+            for mount in attrs.get('Mounts') or ()
+            if mount.get('Type') == 'volume' and mount.get('Name') and mount.get('Destination') not in declared]
+
+
+def for_image(body, image, image_config=None):
+    """Point a create body at a new image, dropping what it only inherited from the old image (image_config)"""
+    body = dict(body, Image=image)
+    if not image_config:
+        return body
+    inherited_env = set(image_config.get('Env') or ())
+    body['Env'] = [e for e in body.get('Env') or () if e not in inherited_env]
+    image_labels = image_config.get('Labels') or {}
+    body['Labels'] = {k: v for k, v in (body.get('Labels') or {}).items() if image_labels.get(k) != v}
+    for key in ('ExposedPorts', 'Volumes'):
+        inherited = image_config.get(key) or {}
+        body[key] = {k: v for k, v in (body.get(key) or {}).items() if k not in inherited}
+    for key in IMAGE_DEFAULT_FIELDS:
+        if key in body and body[key] == image_config.get(key):
+            del body[key]
+    return body
+
+
+def recreate(client, name, body):
+    """Create and start a container from a create body, attaching every network it was on; returns its ID.
+
+    The create call carries one endpoint (older engines accept no more); the
+    other networks are connected before the container starts.
+    """
+    body = dict(body)
+    endpoints = dict((body.pop('NetworkingConfig', None) or {}).get('EndpointsConfig') or {})
+    primary = (body.get('HostConfig') or {}).get('NetworkMode')
+    first = primary if primary in endpoints else next(iter(endpoints), None)
+    if first is not None:
+        body['NetworkingConfig'] = {'EndpointsConfig': {first: endpoints.pop(first)}}
+    container_id = client.api.create_container_from_config(body, name)['Id']
+    for network, endpoint in endpoints.items():
+        ipam = endpoint.get('IPAMConfig') or {}
+        links = dict(link.split(':', 1) if ':' in link else (link, None) for link in endpoint.get('Links') or ())
+        client.api.connect_container_to_network(container_id, network, aliases=endpoint.get('Aliases'),
+                                                ipv4_address=ipam.get('IPv4Address'),
+                                                ipv6_address=ipam.get('IPv6Address'),
+                                                links=links or None, driver_opt=endpoint.get('DriverOpts'))
+    client.api.start(container_id)
+    return container_id
+
+
+def group_projects(ready, outcomes):
+    """Turn the ready Compose services of each project into one rollout group.
+
+    Each service joins the group `compose:<project>` (unless it has a group)
+    and depends on the project services its depends_on label names. A project
+    with a failed or deferred pull is held back whole, so a stack never runs a
+    mix of updated and stale services because of one missing image.
+    """
+    failed = {o['compose']['project'] for o in outcomes.values() if o['status'] in ('failed', 'deferred') and o.get('compose')}
+    services = {}
+    for name, outcome in outcomes.items():
+        if outcome.get('compose'):
+            services.setdefault((outcome['compose']['project'], outcome['compose']['service']), []).append(name)
+    grouped, held = [], []
+    for container_config in ready:
+        info = outcomes[container_config['name']].get('compose')
+        if info is None:
+            grouped.append(container_config)
+            continue
+        if info['project'] in failed:
+            held.append(container_config['name'])
+            continue
+        depends_on = list(container_config.get('depends_on', []))
+        for service in info['depends_on']:
+            depends_on += services.get((info['project'], service), [])
+        grouped.append(dict(container_config, group=container_config.get('group') or GROUP_PREFIX + info['project'],
+                            depends_on=depends_on, compose_project=info['project']))
+    if held:
+        logging.warning(f"🧩 Holding back {', '.join(held)}: another service of their Compose project was not pulled")
+    return grouped
@@ -88,6 +88,7 @@ docker run -d \
   -v $(pwd)/state:/app/state \
   -v $(pwd)/logs:/app/logs \
   --restart unless-stopped \
+  --stop-timeout 310 \
   ${IMAGE_NAME}
 
 if [ $? -eq 0 ]; then
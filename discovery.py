@@ -0,0 +1,190 @@
+# discovery.py
+import logging
+import threading
+import time
+
+import fleet
+
+LABEL_PREFIX = 'guardian.'
+ENABLE_LABEL = 'guardian.enable'
+# Image reference to track, for containers created from an image ID (e.g. by a rollback)
+IMAGE_LABEL = 'guardian.image'
+DEFAULTS = {'enabled': False, 'refresh_seconds': 60}
+
+
+def _bool(value):
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _list(value):
+    return [part.strip() for part in value.split(',') if part.strip()]
+
+
+# guardian.<suffix> label -> (container config key, parser)
+LABEL_FIELDS = {
+    'auto_update': ('auto_update', _bool),
+    'health_url': ('health_check_url', str),
+    'rollback': ('rollback_on_failure', _bool),
+    'stage': ('stage', int),
+    'group': ('group', str),
+    'depends_on': ('depends_on', _list),
+    'retain_images': ('retain_images', int),
+    'urgent': ('urgent', _bool),
+}
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def settings(config):
+    return dict(DEFAULTS, **config.get('global', {}).get('discovery', {}))
+
+
+def guardian_labels(labels):
+    """The guardian.* labels of a container, which must survive recreating it"""
+    return {k: v for k, v in (labels or {}).items() if k.startswith(LABEL_PREFIX)}
+
+
+def container_config(name, image, labels):
+    """Build a container config entry from a labelled container (auto_update defaults to on)"""
+    entry = {'name': name, 'image': image, 'enabled': True, 'auto_update': True, 'discovered': True,
+             'labels': guardian_labels(labels)}
+    for suffix, (key, parse) in LABEL_FIELDS.items():
+        value = labels.get(LABEL_PREFIX + suffix)
+        if value is None:
+            continue
+        try:
+            entry[key] = parse(value)
+        except ValueError:
+            logging.warning(f"🏷️ {name}: ignoring invalid label {LABEL_PREFIX}{suffix}={value!r}")
+    return entry
+
+
+class Index:
+    """Labelled containers of one host, keyed by name, with a secondary index by image.
+
+    sync() costs one filtered container list call; only containers whose ID,
+    image or labels changed since the last sync are rebuilt.
+    """
+
+    def __init__(self):
+        self.by_name = {}
+        self.by_image = {}
+        self.synced = 0
+        self.generation = 0
+        self._fingerprints = {}
+        self._lock = threading.Lock()
+
+    def _remove(self, name):
+        self._fingerprints.pop(name, None)
+        entry = self.by_name.pop(name, None)
+        if entry is None:
+            return
+        names = self.by_image.get(entry['image'])
+        if names:
+            names.discard(name)
+            if not names:
+                del self.by_image[entry['image']]
+
+    def _put(self, entry, fingerprint):
+        if entry['name'] in self.by_name:
+            self._remove(entry['name'])
+        self.by_name[entry['name']] = entry
+        self.by_image.setdefault(entry['image'], set()).add(entry['name'])
+        self._fingerprints[entry['name']] = fingerprint
+
+    def sync(self, client):
+        """Apply additions, removals and label/image changes since the last sync; returns the number applied"""
+        # The low-level summary list already carries names, images and labels: one API call per sync
+        listed = client.api.containers(all=True, filters={'label': f"{ENABLE_LABEL}=true"})
+        changes = 0
+        with self._lock:
+            seen = set()
+            for summary in listed:
+                name = summary['Names'][0].lstrip('/')
+                labels = summary.get('Labels') or {}
+                image = labels.get(IMAGE_LABEL) or summary.get('Image')
+                seen.add(name)
+                fingerprint = (summary['Id'], image, tuple(sorted(guardian_labels(labels).items())))
+                if self._fingerprints.get(name) == fingerprint:
+                    continue
+                if not image or image.startswith('sha256:'):
+                    logging.warning(f"🏷️ {name}: labelled for Guardian but not created from an image reference "
+                                    f"(set {IMAGE_LABEL}); skipping")
+                    changes += name in self.by_name
+                    self._remove(name)
+                    self._fingerprints[name] = fingerprint
+                    continue
+                self._put(container_config(name, image, labels), fingerprint)
+                changes += 1
+            for name in set(self._fingerprints) - seen:
+                changes += name in self.by_name
+                self._remove(name)
+            if changes:
+                self.generation += 1
+            self.synced = time.time()
+        return changes
+
+    def containers(self):
+        with self._lock:
+            return list(self.by_name.values())
+
+    def find_image(self, image):
+        with self._lock:
+            return [self.by_name[name] for name in self.by_image.get(image, ())]
+
+
+def index(host_name):
+    with _indexes_lock:
+        if host_name not in _indexes:
+            _indexes[host_name] = Index()
+        return _indexes[host_name]
+
+
+def generation():
+    """Changes whenever any host's index changes (for caches keyed on the managed container set)"""
+    with _indexes_lock:
+        return sum(i.generation for i in _indexes.values())
+
+
+def sizes():
+    """Number of indexed containers per host"""
+    with _indexes_lock:
+        return {name: len(idx.by_name) for name, idx in _indexes.items()}
+
+
+def discovered(host, client, discovery_settings, force=False):
+    """Container configs discovered on a host, re-synced at most every refresh_seconds"""
+    idx = index(host['name'])
+    if client is not None and (force or time.time() - idx.synced >= discovery_settings['refresh_seconds']):
+        try:
+            changes = idx.sync(client)
+            if changes:
+                logging.info(f"🏷️ Discovery on {host['name']}: {len(idx.by_name)} labelled containers "
+                             f"({changes} changed)")
+        except Exception as e:
+            logging.warning(f"🏷️ Discovery on {host['name']} failed; using the last known containers: {e}")
+    return idx.containers()
+
+
+def merge(explicit, found):
+    """Explicit config entries first; discovered containers fill in names the config does not list"""
+    names = {c['name'] for c in explicit}
+    return list(explicit) + [c for c in found if c['name'] not in names]
+
+
+def apply(config, client_for, force=False):
+    """Return config with each host's discovered containers merged in (config itself when disabled)"""
+    discovery_settings = settings(config)
+    if not discovery_settings['enabled']:
+        return config
+    merged = dict(config)
+    if fleet.is_fleet(config):
+        merged['hosts'] = [dict(host, containers=merge(host.get('containers', []),
+                                                       discovered(host, client_for(host), discovery_settings, force)))
+                           for host in config['hosts']]
+    else:
+        local = fleet.get_hosts(config)[0]
+        merged['containers'] = merge(config.get('containers', []),
+                                     discovered(local, client_for(None), discovery_settings, force))
+    return merged
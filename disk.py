@@ -0,0 +1,103 @@
+# disk.py
+import logging
+import os
+
+import fleet
+
+MB = 1024 * 1024
+DEFAULTS = {'min_free_mb': 2048, 'min_free_percent': 10, 'path': None}
+
+# Layers are stored extracted; budget roughly twice their compressed download size
+EXTRACT_FACTOR = 2
+
+MANAGED_LABEL = 'guardian.managed'
+
+
+def settings(config):
+    return dict(DEFAULTS, **config['global'].get('disk', {}))
+
+
+def filesystem(path):
+    """Free and total bytes of the filesystem holding path, or None when it is not visible from here"""
+    if not path:
+        return None
+    try:
+        st = os.statvfs(path)
+    except (OSError, AttributeError):
+        return None
+    return {'path': path, 'free': st.f_bavail * st.f_frsize, 'total': st.f_blocks * st.f_frsize}
+
+
+def docker_filesystem(client, disk_settings):
+    """Filesystem of the Docker data root: the configured path, else DockerRootDir if it is mounted here.
+
+    None for remote fleet hosts, whose filesystems cannot be measured from here.
+    """
+    if fleet.is_remote(fleet.current_host()):
+        return None
+    path = disk_settings.get('path')
+    if not path and client is not None:
+        try:
+            path = client.info().get('DockerRootDir')
+        except Exception as e:
+            logging.debug(f"Could not read DockerRootDir: {e}")
+    return filesystem(path)
+
+
+def min_free(fs, disk_settings):
+    return max(int(disk_settings['min_free_mb'] * MB), int(fs['total'] * disk_settings['min_free_percent'] / 100))
+
+
+def under_pressure(fs, disk_settings, needed=0):
+    """Whether free space (after needing `needed` more bytes) falls below the threshold"""
+    return fs is not None and fs['free'] - needed < min_free(fs, disk_settings)
+
+
+def docker_usage(client):
+    """Summarize `docker system df`: image, container, build cache and volume bytes and what is reclaimable"""
+    df = client.df()
+    images = df.get('Images') or []
+    containers = df.get('Containers') or []
+    cache = df.get('BuildCache') or []
+    volumes = df.get('Volumes') or []
+    dangling = [i for i in images if not i.get('RepoTags') or i['RepoTags'] == ['<none>:<none>']]
+    return {
+        'layers_bytes': df.get('LayersSize', 0),
+        'images': len(images),
+        'unused_image_bytes': sum(i.get('Size', 0) - max(i.get('SharedSize', 0), 0)
+                                  for i in images if i.get('Containers', 0) == 0),
+        'dangling_image_bytes': sum(i.get('Size', 0) for i in dangling),
+        'containers': len(containers),
+        'container_rw_bytes': sum(c.get('SizeRw', 0) or 0 for c in containers),
+        'build_cache_bytes': sum(b.get('Size', 0) for b in cache if not b.get('InUse')),
+        'volume_bytes': sum((v.get('UsageData') or {}).get('Size', 0) for v in volumes
+                            if (v.get('UsageData') or {}).get('Size', 0) > 0),
+    }
+
+
+def reclaim(client, orphaned_containers=(), build_cache=True):
+    """Targeted cleanup: dangling images, unused build cache and the given stopped containers.
+
+    Returns reclaimed bytes per category.
+    """
+    reclaimed = {'dangling_images': 0, 'build_cache': 0, 'containers': 0}
+    try:
+        result = client.images.prune(filters={'dangling': True})
+        reclaimed['dangling_images'] = result.get('SpaceReclaimed') or 0
+    except Exception as e:
+        logging.warning(f"Dangling image prune failed: {e}")
+    if build_cache:
+        try:
+            result = client.api.prune_builds()
+            reclaimed['build_cache'] = result.get('SpaceReclaimed') or 0
+        except Exception as e:
+            logging.debug(f"Build cache prune failed: {e}")
+    for container in orphaned_containers:
+        try:
+            size = container.attrs.get('SizeRw') or 0
+            container.remove()
+            reclaimed['containers'] += size
+            logging.info(f"🧹 Removed stopped container {container.name}")
+        except Exception as e:
+            logging.warning(f"Could not remove stopped container {container.name}: {e}")
+    return reclaimed
@@ -0,0 +1,113 @@
+# fleet.py
+import contextvars
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import registry
+
+LOCAL_HOST = 'local'
+
+_current_host = contextvars.ContextVar('guardian_host', default=None)
+_clients = {}
+_platforms = {}
+_clients_lock = threading.Lock()
+
+
+def is_fleet(config):
+    return bool(config.get('hosts'))
+
+
+def get_hosts(config):
+    """Return the configured hosts, or a single local host holding the top-level containers"""
+    hosts = config.get('hosts')
+    if not hosts:
+        return [{'name': LOCAL_HOST, 'url': None, 'containers': config.get('containers', [])}]
+    return hosts
+
+
+def find_host(config, name):
+    return next((h for h in get_hosts(config) if h['name'] == name), None)
+
+
+def find_container_host(config, container_name):
+    """Return the first host whose container set includes container_name"""
+    for host in get_hosts(config):
+        if any(c['name'] == container_name for c in host.get('containers', [])):
+            return host
+    return None
+
+
+def current_host():
+    return _current_host.get()
+
+
+def is_remote(host):
+    return bool(host and host.get('url'))
+
+
+def get_host_client(host):
+    """Return the pooled Docker client for a remote host, or None for the local host"""
+    if not is_remote(host):
+        return None
+    with _clients_lock:
+        client = _clients.get(host['name'])
+        if client is None:
+            import docker
+            url = host['url']
+            client = docker.DockerClient(
+                base_url=url,
+                timeout=host.get('timeout', 60),
+                max_pool_size=host.get('pool_size', 4),
+                use_ssh_client=url.startswith('ssh://')
+            )
+            _clients[host['name']] = client
+            logging.info(f"Docker client created for host {host['name']} ({url})")
+        return client
+
+
+def get_host_platform(host, client):
+    """Platform of a host: explicit `platform` in its config, else the daemon's architecture"""
+    if host.get('platform'):
+        return registry.get_host_platform(host['platform'])
+    if host['name'] not in _platforms:
+        machine = client.info().get('Architecture', '').lower()
+        arch, variant = registry.MACHINE_PLATFORMS.get(machine, (machine, None))
+        _platforms[host['name']] = {'os': 'linux', 'architecture': arch, 'variant': variant}
+    return _platforms[host['name']]
+
+
+def host_key(name):
+    """Namespace a container or image name by the current remote host"""
+    host = current_host()
+    return f"{host['name']}/{name}" if is_remote(host) else name
+
+
+@contextmanager
+def using_host(host):
+    token = _current_host.set(host)
+    try:
+        yield host
+    finally:
+        _current_host.reset(token)
+
+
+def map_in_context(pool, fn, items):
+    """pool.map() that carries the caller's host binding into the worker threads"""
+    ctx = contextvars.copy_context()
+    return pool.map(lambda item: ctx.copy().run(fn, item), items)
+
+
+def for_each_host(hosts, fn, workers=8):
+    """Run fn(host) on every host concurrently, in the caller's context; returns {host name: result or exception}"""
+    def run(host):
+        with using_host(host):
+            try:
+                return fn(host)
+            except Exception as e:
+                logging.error(f"Host {host['name']} failed: {e}")
+                return e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(hosts)))) as pool:
+        return dict(zip([h['name'] for h in hosts], map_in_context(pool, run, hosts)))
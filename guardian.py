@@ -1,57 +1,123 @@
 # guardian.py
-import docker
+# `docker` and `requests` are imported where they are used, and the Docker
+# client is connected on first use, so commands that never talk to Docker
+# (status, check, --help) start quickly.
 import json
 import os
+import re
+import shlex
+import socket
 import subprocess
+import sys
 import time
-import requests
+import threading
 import logging
-from datetime import datetime
+import argparse
+import contextvars
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import compose
+import discovery
+import disk
+import fleet
+import hostload
+import jobs
+import lru
+import profiling
+import ratelimit
+import registry
+import store
 
 # Load config
 CONFIG_PATH = 'config.json'
 STATE_DIR = 'state'
 LOG_FILE = 'logs/guardian.log'
+PULL_PROGRESS_FILE = f"{STATE_DIR}/pulls.json"
+PULL_PROGRESS_INTERVAL = 2
+PULL_LOG_INTERVAL = 10
+# Seconds of recent download volume the bandwidth budget is measured over
+PULL_RATE_WINDOW = 10
+RETAIN_REPO = 'guardian-retain'
+JOURNAL_PHASES = ('pulled', 'backup', 'stopping', 'starting', 'health_check')
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+ADAPTIVE_CHECK_DEFAULTS = {'enabled': False, 'min_minutes': 60, 'max_minutes': 7 * 24 * 60, 'factor': 2}
+
+class HostLogFilter(logging.Filter):
+    """Prefix log lines with the remote host a fleet worker is acting on"""
+    def filter(self, record):
+        host = fleet.current_host()
+        if fleet.is_remote(host) and not getattr(record, 'host', None):
+            record.host = host['name']
+            record.msg = f"[{host['name']}] {record.msg}"
+        return True
 
-os.makedirs(STATE_DIR, exist_ok=True)
-os.makedirs('logs', exist_ok=True)
+class PullError(Exception):
+    """A pull the daemon reported as failed in its progress stream"""
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(LOG_FILE),
-        logging.StreamHandler()
-    ]
-)
+_logging_configured = False
 
-# Initialize Docker client with multiple fallback methods
-client = None
-docker_methods = [
+def configure_logging(level=logging.INFO):
+    """Log to logs/guardian.log and stderr (stdout stays clean for --json output)"""
+    global _logging_configured
+    if _logging_configured:
+        return
+    os.makedirs(STATE_DIR, exist_ok=True)
+    os.makedirs('logs', exist_ok=True)
+    logging.basicConfig(
+        level=level,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(LOG_FILE),
+            logging.StreamHandler()
+        ]
+    )
+    logging.getLogger().addFilter(HostLogFilter())
+    _logging_configured = True
+
+# Docker client fallback methods, tried in order on first use
+DOCKER_METHODS = [
     {'method': 'unix_socket', 'url': 'unix://var/run/docker.sock'},
     {'method': 'from_env', 'url': None},
     {'method': 'tcp_localhost', 'url': 'tcp://localhost:2375'},
     {'method': 'tcp_localhost_secure', 'url': 'tcp://localhost:2376'}
 ]
 
-for method_info in docker_methods:
-    try:
-        if method_info['url']:
-            client = docker.DockerClient(base_url=method_info['url'])
-        else:
-            client = docker.from_env()
-        
-        # Test the connection
-        client.ping()
-        logging.info(f"Docker client initialized successfully via {method_info['method']}")
-        break
-    except Exception as e:
-        logging.debug(f"Docker method {method_info['method']} failed: {e}")
-        client = None
-        continue
+client = None
+_client_probed = False
+_client_lock = threading.Lock()
 
-if client is None:
-    logging.warning("All Docker client initialization methods failed. Using subprocess fallback.")
+def local_client():
+    """Docker client for the local daemon, connected on first call (None: use the docker CLI)"""
+    global client, _client_probed
+    with _client_lock:
+        if _client_probed:
+            return client
+        import docker
+        for method_info in DOCKER_METHODS:
+            try:
+                if method_info['url']:
+                    client = docker.DockerClient(base_url=method_info['url'])
+                else:
+                    client = docker.from_env()
+                
+                # Test the connection
+                client.ping()
+                logging.info(f"Docker client initialized successfully via {method_info['method']}")
+                break
+            except Exception as e:
+                logging.debug(f"Docker method {method_info['method']} failed: {e}")
+                client = None
+                continue
+        
+        if client is None:
+            logging.warning("All Docker client initialization methods failed. Using subprocess fallback.")
+        _client_probed = True
+        return client
 
 def load_config():
     with open(CONFIG_PATH, 'r') as f:
@@ -61,7 +127,24 @@ def save_config(config):
     with open(CONFIG_PATH, 'w') as f:
         json.dump(config, f, indent=2)
 
+def managed_config(force_discovery=False):
+    """config.json with the containers discovered by label merged into each host (when discovery is on)"""
+    return discovery.apply(load_config(), lambda host: fleet.get_host_client(host) or local_client(),
+                           force_discovery)
+
+def get_client():
+    """Docker client for the host being worked on (the local client outside fleet mode)"""
+    return fleet.get_host_client(fleet.current_host()) or local_client()
+
+def get_platform():
+    host = fleet.current_host()
+    if fleet.is_remote(host):
+        return fleet.get_host_platform(host, get_client())
+    config = load_config()
+    return registry.get_host_platform(config.get('global', {}).get('platform'))
+
 def send_telegram(msg):
+    import requests
     config = load_config()
     token = config.get('telegram_bot_token', '')
     chat_id = config.get('telegram_chat_id', '')
@@ -78,44 +161,173 @@ def send_telegram(msg):
         logging.error(f"Telegram failed: {e}")
 
 def backup_container(name):
+    """Snapshot the container's create request (config, host config and networks); returns the generation"""
+    client = get_client()
+    keep = load_config()['global'].get('snapshot_generations', 10)
     try:
         if client:
             container = client.containers.get(name)
-            config = container.attrs['Config']
-            with open(f"{STATE_DIR}/{name}.json", 'w') as f:
-                json.dump(config, f, indent=2)
-            logging.info(f"Backed up config for {name}")
+            config = compose.create_body(container.attrs)
+            image_id = container.attrs.get('Image')
+            generation = store.save_snapshot(fleet.host_key(name), config, image_id, keep=keep)
+            logging.info(f"Backed up config for {name} (generation {generation})")
         else:
             # Fallback to subprocess for backup
-            result = subprocess.run(['docker', 'inspect', name, '--format', '{{json .Config}}'], 
+            result = subprocess.run(['docker', 'inspect', name, '--format', '{{json .}}'], 
                                   capture_output=True, text=True)
             if result.returncode == 0:
-                config = json.loads(result.stdout)
-                with open(f"{STATE_DIR}/{name}.json", 'w') as f:
-                    json.dump(config, f, indent=2)
-                logging.info(f"Backed up config for {name} (subprocess)")
+                attrs = json.loads(result.stdout)
+                config = compose.create_body(attrs)
+                image_id = attrs.get('Image')
+                generation = store.save_snapshot(fleet.host_key(name), config, image_id, keep=keep)
+                logging.info(f"Backed up config for {name} (generation {generation}, subprocess)")
             else:
                 raise Exception(f"docker inspect failed: {result.stderr}")
     except Exception as e:
         logging.error(f"Backup failed for {name}: {e}")
+        return None
+    retain_image(name, image_id, generation)
+    return generation
+
+# Retention tags: the image a container ran before each update is tagged
+# guardian-retain/<name>:gen-<generation> so cleanup keeps it and rollback
+# can recreate from it without a pull
+def _retain_repo(name):
+    return f"{RETAIN_REPO}/{re.sub(r'[^a-z0-9._-]', '-', name.lower())}"
+
+def _host_containers(config):
+    """Containers configured, or discovered by label, for the host being worked on"""
+    host = fleet.current_host()
+    containers = host.get('containers', []) if host else config.get('containers', [])
+    discovery_settings = discovery.settings(config)
+    if not discovery_settings['enabled']:
+        return containers
+    found = discovery.discovered(host or {'name': fleet.LOCAL_HOST}, get_client(), discovery_settings)
+    return discovery.merge(containers, found)
+
+def _retention_depth(container_config, config):
+    return int(container_config.get('retain_images', config['global'].get('retain_images', 2)))
+
+def retain_image(name, image_id, generation):
+    """Tag the image a container is about to leave so it survives the update and cleanup"""
+    client = get_client()
+    config = load_config()
+    container_config = next((c for c in _host_containers(config) if c['name'] == name), {})
+    if not image_id or _retention_depth(container_config, config) <= 0:
+        return
+    repo = _retain_repo(name)
+    try:
+        if client:
+            client.images.get(image_id).tag(repo, tag=f"gen-{generation}")
+            _prune_retention_tags(client.images.list(name=repo), config)
+        else:
+            subprocess.run(['docker', 'tag', image_id, f"{repo}:gen-{generation}"], capture_output=True)
+        logging.info(f"📌 Retained {image_id[:19]} for {name} as {repo}:gen-{generation}")
+    except Exception as e:
+        logging.warning(f"Could not retain previous image of {name}: {e}")
+
+def _prune_retention_tags(images, config):
+    """Untag retained images beyond each container's depth; returns (retained IDs, tags removed)"""
+    client = get_client()
+    by_repo = {}
+    for image in images:
+        for tag in image.tags:
+            if tag.startswith(f"{RETAIN_REPO}/"):
+                repo, _, gen = tag.rpartition(':')
+                number = int(gen[len('gen-'):]) if gen[len('gen-'):].isdigit() else 0
+                by_repo.setdefault(repo, []).append((number, tag, image.id))
 
-def rollback_container(name):
-    path = f"{STATE_DIR}/{name}.json"
-    if not os.path.exists(path):
-        logging.error(f"No backup found for {name}")
+    # Containers no longer in the config keep the global depth until removed by hand
+    default_depth = int(config['global'].get('retain_images', 2))
+    depths = {_retain_repo(c['name']): _retention_depth(c, config) for c in _host_containers(config)}
+    retained = set()
+    removed = 0
+    for repo, entries in by_repo.items():
+        entries.sort(reverse=True)
+        depth = depths.get(repo, default_depth)
+        for number, tag, image_id in entries:
+            if depth > 0:
+                retained.add(image_id)
+                depth -= 1
+                continue
+            try:
+                client.images.remove(tag)
+                removed += 1
+                logging.info(f"🧹 Released retained image {tag}")
+            except Exception as e:
+                logging.debug(f"Could not release {tag}: {e}")
+    return retained, removed
+
+def _image_present(image_id):
+    client = get_client()
+    try:
+        if client:
+            client.images.get(image_id)
+            return True
+        return subprocess.run(['docker', 'image', 'inspect', image_id], capture_output=True).returncode == 0
+    except Exception:
         return False
+
+def _remove_existing(name):
+    import docker
+    client = get_client()
     try:
-        with open(path, 'r') as f:
-            config = json.load(f)
-        
-        # Simple recreate — assumes image is still available
         if client:
+            client.containers.get(name).remove(force=True)
+        else:
+            subprocess.run(['docker', 'rm', '-f', name], capture_output=True)
+    except docker.errors.NotFound:
+        pass
+
+def rollback_container(name, generation=None):
+    client = get_client()
+    snapshot = store.get_snapshot(fleet.host_key(name), generation)
+    if snapshot is None:
+        logging.error(f"No backup found for {name}" + (f" generation {generation}" if generation else ""))
+        return False
+    jobs.report_phase('rollback', name)
+    try:
+        config = snapshot['config']
+
+        # Recreate from the exact image the snapshot ran (kept local by its retention tag). The
+        # configured reference is no substitute: after an update it names the image being rolled back
+        image = config['Image']
+        if snapshot.get('image_id'):
+            if not _image_present(snapshot['image_id']):
+                msg = (f"❌ Cannot roll back `{name}`: its previous image {snapshot['image_id'][:19]} "
+                       f"(generation {snapshot['generation']}) is no longer on the host")
+                logging.error(msg)
+                send_telegram(msg)
+                return False
+            image = snapshot['image_id']
+        else:
+            logging.warning(f"Backup of {name} does not record its image ID; rolling back to {image}")
+
+        # Keep discovery labels; a container recreated from an image ID records the reference to track
+        labels = discovery.guardian_labels(config.get('Labels'))
+        if labels and image != config['Image']:
+            labels.setdefault(discovery.IMAGE_LABEL, config['Image'])
+        labels[disk.MANAGED_LABEL] = 'true'
+
+        # The failed (or current) container still holds the name
+        _remove_existing(name)
+        
+        if client and 'HostConfig' in config:
+            # The snapshot is the full create request: same env, volumes, ports, networks and restart policy
+            body_labels = dict(config.get('Labels') or {})
+            if discovery.IMAGE_LABEL in labels:
+                body_labels[discovery.IMAGE_LABEL] = labels[discovery.IMAGE_LABEL]
+            if not compose.service_info(body_labels):
+                body_labels[disk.MANAGED_LABEL] = 'true'
+            compose.recreate(client, name, dict(config, Image=image, Labels=body_labels))
+        elif client:
+            # Snapshots taken before backups held the full create request only have the config
             client.containers.run(
-                image=config['Image'],
+                image=image,
                 name=name,
                 detach=True,
-                ports=config.get('ExposedPorts', {}),
                 environment=config.get('Env', []),
+                labels=labels,
                 restart_policy={"Name": "unless-stopped"}
             )
         else:
@@ -124,12 +336,13 @@ def rollback_container(name):
             if name == "nginx-old":
                 port_mapping = "-p 8082:80"
             
-            cmd = f"docker run -d --name {name} --restart unless-stopped {port_mapping} {config['Image']}"
+            label_args = ''.join(f" --label {shlex.quote(f'{k}={v}')}" for k, v in labels.items())
+            cmd = f"docker run -d --name {name}{label_args} --restart unless-stopped {port_mapping} {image}"
             result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
             if result.returncode != 0:
                 raise Exception(f"docker run failed: {result.stderr}")
         
-        logging.info(f"Rolled back {name}")
+        logging.info(f"Rolled back {name} to generation {snapshot['generation']}")
         send_telegram(f"↩️ Rolled back `{name}` due to failure.")
         return True
     except Exception as e:
@@ -139,6 +352,7 @@ def rollback_container(name):
 def health_check(url, timeout=10):
     if not url:
         return True
+    import requests
     try:
         # Add a small delay to allow container to fully start
         time.sleep(2)
@@ -161,29 +375,25 @@ def health_check(url, timeout=10):
         logging.debug(f"Health check error: {e}")
         return False
 
-def cleanup_images():
+# Pre-pull cleanups of concurrent pulls must not race each other or the cycle's cleanup
+_cleanup_lock = threading.Lock()
+
+def cleanup_images(keep_image_ids=(), needed=0, reason='cycle'):
+    """Free disk space: targeted cleanup first, then unused images.
+
+    When the Docker data root is visible from here, nothing is removed unless
+    free space (less `needed` bytes) is below the disk threshold. Returns the
+    reclaimed bytes per category.
+    """
+    with _cleanup_lock:
+        return _cleanup_images(keep_image_ids, needed, reason)
+
+def _cleanup_images(keep_image_ids, needed, reason):
+    client = get_client()
     config = load_config()
-    if not config['global'].get('cleanup_unused_images', False):
-        return
-    keep_last_n = config['global'].get('cleanup_keep_last_n', 3)
-    try:
-        if client:
-            images = client.images.list()
-            for image in images:
-                if not image.tags:
-                    continue
-                # Get containers using this image
-                used = False
-                for container in client.containers.list(all=True):
-                    if container.image.id == image.id:
-                        used = True
-                        break
-                if not used:
-                    # Optional: keep last N tags per repo
-                    # Simplified: just prune unused
-                    client.images.remove(image.id, force=True)
-                    logging.info(f"🧹 Removed unused image: {image.tags[0]}")
-        else:
+    reclaimed = {}
+    if not client:
+        if config['global'].get('cleanup_unused_images', False):
             # Fallback to subprocess for cleanup
             logging.info("🧹 Running docker image prune (subprocess fallback)")
             result = subprocess.run(['docker', 'image', 'prune', '-f'], 
@@ -192,19 +402,324 @@ def cleanup_images():
                 logging.info("🧹 Cleaned up unused images (subprocess)")
             else:
                 logging.warning(f"Docker image prune failed: {result.stderr}")
+        return reclaimed
+
+    disk_settings = disk.settings(config)
+    before = disk.docker_filesystem(client, disk_settings)
+    if before is not None and not disk.under_pressure(before, disk_settings, needed):
+        logging.info(f"💾 {before['free'] / disk.MB:.0f} MB free on {before['path']}; no cleanup needed")
+        return reclaimed
+
+    try:
+        # Build cache is only pruned when there is measured pressure
+        reclaimed.update(disk.reclaim(client, _orphaned_containers(client, config), build_cache=before is not None))
+        after = disk.docker_filesystem(client, disk_settings)
+        if config['global'].get('cleanup_unused_images', False) and \
+                (after is None or disk.under_pressure(after, disk_settings, needed)):
+            reclaimed['unused_images'] = _remove_unused_images(client, config, keep_image_ids)
     except Exception as e:
         logging.error(f"Cleanup failed: {e}")
 
-def update_container(container_config):
+    after = disk.docker_filesystem(client, disk_settings)
+    details = ', '.join(f"{k} {v / disk.MB:.1f} MB" for k, v in reclaimed.items() if v)
+    logging.info(f"🧹 Reclaimed {sum(reclaimed.values()) / disk.MB:.1f} MB ({reason})" + (f": {details}" if details else ""))
+    store.record_cleanup(_current_host_name(), reason, reclaimed,
+                         before['free'] if before else None, after['free'] if after else None)
+    return reclaimed
+
+def _orphaned_containers(client, config):
+    """Stopped containers Guardian created that are no longer in the config"""
+    configured = {c['name'] for c in _host_containers(config)}
+    return [c for c in client.containers.list(all=True, filters={'status': 'exited', 'label': disk.MANAGED_LABEL})
+            if c.name not in configured and c.labels.get(discovery.ENABLE_LABEL) != 'true']
+
+def _image_reference(ref):
+    return ref if ':' in ref.rsplit('/', 1)[-1] else f"{ref}:latest"
+
+def _remove_unused_images(client, config, keep_image_ids=()):
+    images = client.images.list()
+    retained, released = _prune_retention_tags(images, config)
+    if released:
+        images = client.images.list()
+    used = {c.attrs.get('Image') for c in client.containers.list(all=True)}
+    # Images the config points at (e.g. pre-fetched but not yet restarted) are never unused
+    referenced = {_image_reference(c['image']) for c in _host_containers(config) if c.get('image')}
+    removed_bytes = 0
+    for image in images:
+        if not image.tags or image.id in retained or image.id in used or image.id in keep_image_ids:
+            continue
+        if referenced.intersection(image.tags):
+            continue
+        client.images.remove(image.id, force=True)
+        removed_bytes += image.attrs.get('Size', 0)
+        logging.info(f"🧹 Removed unused image: {image.tags[0]}")
+    return removed_bytes
+
+def _estimate_pull_bytes(image):
+    """Compressed bytes a pull of image would download, from its manifest and the layers already local"""
+    client = get_client()
+    plat = get_platform()
+    remote = registry.resolve_platform_manifest(image, plat)
+    if not remote:
+        return 0
+    present = None
+    try:
+        local = client.images.get(image)
+        present = _local_layer_digests(local.id, local.attrs.get('RepoDigests', []), plat)
+    except Exception:
+        pass
+    return sum(layer['size'] for layer in remote['layers'] if layer['digest'] not in (present or ()))
+
+def ensure_space(image):
+    """Before a pull: clean up if the pull would cross the disk threshold, and refuse it if it cannot fit"""
+    client = get_client()
+    disk_settings = disk.settings(load_config())
+    fs = disk.docker_filesystem(client, disk_settings)
+    if fs is None:
+        return
+    needed = _estimate_pull_bytes(image) * disk.EXTRACT_FACTOR
+    if not disk.under_pressure(fs, disk_settings, needed):
+        return
+    logging.warning(f"💾 {image} needs ~{needed / disk.MB:.0f} MB with {fs['free'] / disk.MB:.0f} MB free; cleaning up first")
+    cleanup_images(needed=needed, reason=f"pre-pull {image}")
+    fs = disk.docker_filesystem(client, disk_settings)
+    if fs['free'] < needed:
+        raise Exception(f"not enough disk space: ~{needed / disk.MB:.0f} MB needed, {fs['free'] / disk.MB:.0f} MB free")
+
+# Pull scheduling: one pull per image per cycle, bounded concurrency and an
+# aggregate bandwidth budget shared by every pull in this process
+_pull_lock = threading.Lock()
+# Pulls of the current cycle or job; worker threads inherit it through their context
+_pull_results = contextvars.ContextVar('guardian_pull_results', default=None)
+_pull_progress = {}
+_pull_slots = {}
+# (time, bytes) downloaded per host over the last PULL_RATE_WINDOW seconds
+_pull_bytes = {}
+
+def _get_pull_slots():
+    host = _current_host_name()
+    with _pull_lock:
+        if host not in _pull_slots:
+            config = load_config()
+            limit = max(1, int(config['global'].get('max_concurrent_pulls', 1)))
+            _pull_slots[host] = threading.BoundedSemaphore(limit)
+        return _pull_slots[host]
+
+def reset_pull_cycle():
+    """Start a new pull cycle in this context; concurrent cycles and jobs keep their own"""
+    _pull_results.set({})
+
+def _pull_key(image):
+    registry_name, repository, tag = registry.parse_image_ref(image)
+    return fleet.host_key(f"{registry_name}/{repository}:{tag}")
+
+def _write_pull_progress():
+    # Several pulls report concurrently; serialize a consistent copy
+    with _pull_lock:
+        progress = {key: dict(p) for key, p in _pull_progress.items()}
+    try:
+        with open(PULL_PROGRESS_FILE, 'w') as f:
+            json.dump(progress, f)
+    except Exception as e:
+        logging.debug(f"Could not write pull progress: {e}")
+
+def _current_host_name():
+    host = fleet.current_host()
+    return host['name'] if host else fleet.LOCAL_HOST
+
+def _note_pull_bytes(nbytes):
+    if nbytes <= 0:
+        return
+    with _pull_lock:
+        _pull_bytes.setdefault(_current_host_name(), deque()).append((time.time(), nbytes))
+
+def _active_pull_rate():
+    """Bytes/s this host's pulls downloaded over the last PULL_RATE_WINDOW seconds"""
+    cutoff = time.time() - PULL_RATE_WINDOW
+    with _pull_lock:
+        window = _pull_bytes.get(_current_host_name())
+        if not window:
+            return 0
+        while window and window[0][0] < cutoff:
+            window.popleft()
+        return sum(nbytes for _, nbytes in window) / PULL_RATE_WINDOW
+
+def _wait_for_bandwidth():
+    """Hold a new pull while the host's recent download rate is at the budget"""
+    config = load_config()
+    limit_mbps = config['global'].get('pull_bandwidth_limit_mbps', 0)
+    if not limit_mbps:
+        return
+    limit = limit_mbps * 1024 * 1024 / 8
+    waited = 0
+    while _active_pull_rate() >= limit and waited < 300:
+        time.sleep(1)
+        waited += 1
+
+def _record_pull_progress(image, layers, started, status='pulling'):
+    total = sum(l['total'] for l in layers.values())
+    current = sum(min(l['current'], l['total']) for l in layers.values())
+    elapsed = max(time.time() - started, 0.001)
+    progress = {
+        'host': _current_host_name(),
+        'status': status,
+        'layers': len(layers),
+        'layers_done': sum(1 for l in layers.values() if l['done']),
+        'bytes': current,
+        'total_bytes': total,
+        'rate': current / elapsed if status == 'pulling' else 0,
+        'updated': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    }
+    with _pull_lock:
+        _pull_progress[fleet.host_key(image)] = progress
+    _write_pull_progress()
+    return progress
+
+def _stream_pull(image):
+    import docker
+    client = get_client()
+    repository, tag = docker.utils.parse_repository_tag(image)
+    layers = {}
+    started = time.time()
+    last_write = last_log = started
+    counted = 0
+
+    for event in client.api.pull(repository, tag=tag or 'latest', stream=True, decode=True):
+        if 'error' in event:
+            raise PullError(event['error'], (event.get('errorDetail') or {}).get('code'))
+        layer_id = event.get('id')
+        status = event.get('status', '')
+        if not layer_id or layer_id == tag:
+            continue
+        detail = event.get('progressDetail') or {}
+        layer = layers.setdefault(layer_id, {'current': 0, 'total': 0, 'done': False})
+        if status == 'Downloading' and detail.get('total'):
+            layer['current'] = detail.get('current', 0)
+            layer['total'] = detail['total']
+        elif status in ('Download complete', 'Pull complete', 'Already exists'):
+            layer['current'] = layer['total']
+            layer['done'] = True
+
+        now = time.time()
+        if now - last_write >= PULL_PROGRESS_INTERVAL:
+            progress = _record_pull_progress(image, layers, started)
+            _note_pull_bytes(progress['bytes'] - counted)
+            counted = progress['bytes']
+            last_write = now
+            if now - last_log >= PULL_LOG_INTERVAL and progress['total_bytes']:
+                pct = progress['bytes'] * 100 // progress['total_bytes']
+                logging.info(f"⬇️ {image}: {pct}% ({progress['bytes'] / 1048576:.1f}/"
+                             f"{progress['total_bytes'] / 1048576:.1f} MB, "
+                             f"{progress['layers_done']}/{progress['layers']} layers)")
+                last_log = now
+
+    progress = _record_pull_progress(image, layers, started, status='done')
+    _note_pull_bytes(progress['bytes'] - counted)
+    logging.info(f"⬇️ Pulled {image} ({progress['bytes'] / 1048576:.1f} MB in {time.time() - started:.0f}s)")
+
+def pull_image(image):
+    """Pull an image at most once per cycle, within the global concurrency and bandwidth budget"""
+    client = get_client()
+    key = _pull_key(image)
+    results = _pull_results.get()
+    if results is None:
+        # Outside a cycle every pull is its own
+        results = {}
+    with _pull_lock:
+        entry = results.get(key)
+        owner = entry is None
+        if owner:
+            entry = {'done': threading.Event(), 'error': None}
+            results[key] = entry
+
+    if not owner:
+        logging.info(f"⬇️ {image} already pulled this cycle, sharing result")
+        entry['done'].wait()
+        if entry['error']:
+            raise entry['error']
+        return
+
+    # Pulls from a remote host count against that host's own registry quota
+    budget_key = registry.image_registry_host(image)
+    if fleet.is_remote(fleet.current_host()):
+        budget_key += f" via {_current_host_name()}"
+    acquired = False
+    try:
+        slots = _get_pull_slots()
+        # Wait for bandwidth before taking a slot, so a throttled pull does not hold one; pulls
+        # queued behind the same slot re-check it, since the window still holds the previous pull
+        _wait_for_bandwidth()
+        with slots:
+            _wait_for_bandwidth()
+            ratelimit.acquire(budget_key)
+            acquired = True
+            logging.info(f"⬇️ Pulling latest {image}...")
+            if client:
+                ensure_space(image)
+                _stream_pull(image)
+            else:
+                # Fallback to subprocess
+                result = subprocess.run(['docker', 'pull', image], 
+                                      capture_output=True, text=True)
+                if result.returncode != 0:
+                    raise Exception(f"docker pull failed: {result.stderr}")
+        ratelimit.record_success(budget_key)
+    except Exception as e:
+        entry['error'] = e
+        if _pull_rate_limited(e):
+            ratelimit.record_failure(budget_key, f"pull of {image} rate limited (HTTP 429)", rate_limited=True)
+        elif acquired:
+            # Other failures (unknown tag, disk space, ...) say nothing about the registry's health
+            ratelimit.release(budget_key)
+        with _pull_lock:
+            progress = _pull_progress.get(fleet.host_key(image))
+            if progress:
+                progress['status'] = 'failed'
+        _write_pull_progress()
+        raise
+    finally:
+        entry['done'].set()
+
+def _pull_rate_limited(error):
+    """Whether a pull failed on the registry's rate limit: HTTP 429 or its `toomanyrequests` error code"""
+    if getattr(error, 'status_code', None) == 429:
+        return True
+    # The daemon passes registry errors on as "<code>: <message>", e.g. in a 500 or on the CLI's stderr
+    return re.search(r'(?:^|[\s:])toomanyrequests:', str(error)) is not None
+
+def prefetch_container(container_config, gate=None):
+    """Pre-fetch phase: pull the image if it changed, without touching the running container.
+
+    gate(container_config) is asked before pulling; when it says no the pull is
+    deferred and the container stays due for its next check.
+    """
+    outcome = _prefetch_container(container_config, gate)
+    if outcome['status'] == 'deferred':
+        return outcome
+    try:
+        record_check(container_config, outcome)
+    except Exception as e:
+        logging.warning(f"Could not update check schedule for {container_config['name']}: {e}")
+    return outcome
+
+def _prefetch_container(container_config, gate=None):
+    client = get_client()
     name = container_config['name']
     image = container_config['image']
+    outcome = {'name': name, 'image': image, 'status': 'failed', 'image_id': None, 'remote_digest': None,
+               'compose': None}
+    logging.info(f"🔄 Checking {name}...")
+    jobs.report_phase('checking', name)
 
     # Get current container's image ID using subprocess fallback
     current_container_image = None
+    current_repo_digests = []
     try:
         if client:
             container = client.containers.get(name)
             current_container_image = container.image.id
+            current_repo_digests = container.image.attrs.get('RepoDigests', [])
+            outcome['compose'] = compose.service_info(container.attrs['Config'].get('Labels'))
         else:
             # Fallback to subprocess - get container's image
             result = subprocess.run(['docker', 'inspect', name, '--format', '{{.Image}}'], 
@@ -214,22 +729,43 @@ def update_container(container_config):
     except Exception as e:
         logging.warning(f"Could not get current container image: {e}")
 
-    # Pull latest using subprocess fallback
-    logging.info(f"⬇️ Pulling latest {image}...")
+    # Compare against the registry's manifest for this host's platform so a
+    # push of another architecture doesn't trigger a pull
+    remote = None
+    if current_container_image:
+        remote = registry.resolve_platform_manifest(image, get_platform())
+        if remote:
+            store.record_digest(image, remote['platform'], remote['digest'], remote['config_digest'])
+            outcome['remote_digest'] = remote['digest']
+        if registry.image_matches_remote(remote, current_container_image, current_repo_digests):
+            logging.info(f"✅ {name} already up to date ({remote['platform']} digest unchanged).")
+            outcome.update(status='up_to_date', image_id=current_container_image)
+            store.journal_clear(fleet.host_key(name))
+            return outcome
+
+    # A pull journaled before a crash (or before a deferred restart) is not repeated
+    entry = store.journal_get(fleet.host_key(name))
+    if entry and entry['phase'] == 'pulled' and entry['image'] == image and entry['image_id'] \
+            and (remote is None or entry['remote_digest'] == remote['digest']) \
+            and entry['image_id'] != current_container_image and _image_present(entry['image_id']):
+        logging.info(f"⏭️ {name}: {image} already pulled as {entry['image_id'][:19]}, skipping pull")
+        outcome.update(status='ready', image_id=entry['image_id'])
+        return outcome
+
+    if gate and not gate(container_config):
+        outcome['status'] = 'deferred'
+        return outcome
+
+    # Pull latest (deduplicated and scheduled across the cycle)
+    jobs.report_phase('pulling', image)
     try:
-        if client:
-            client.images.pull(image)
-        else:
-            # Fallback to subprocess
-            result = subprocess.run(['docker', 'pull', image], 
-                                  capture_output=True, text=True)
-            if result.returncode != 0:
-                raise Exception(f"docker pull failed: {result.stderr}")
+        pull_image(image)
     except Exception as e:
         msg = f"❌ Pull failed for `{name}`: `{e}`"
         logging.error(msg)
         send_telegram(msg)
-        return False
+        store.record_update_result(store.record_update_start(fleet.host_key(name), image), 'pull_failed', str(e))
+        return outcome
 
     # Get new image ID
     new_image_id = None
@@ -250,83 +786,883 @@ def update_container(container_config):
     # Compare container's current image with the new image
     if current_container_image == new_image_id:
         logging.info(f"✅ {name} already up to date.")
-        return True
+        outcome.update(status='up_to_date', image_id=new_image_id)
+        store.journal_clear(fleet.host_key(name))
+        return outcome
 
-    # Backup before update
-    backup_container(name)
+    _journal(name, 'pulled', image=image, image_id=new_image_id, remote_digest=outcome['remote_digest'])
+    outcome.update(status='ready', image_id=new_image_id)
+    return outcome
 
-    # Stop & remove old container using subprocess fallback
+def restart_container(container_config, resume=None):
+    """Restart phase: swap the container onto its already-local image and health check it.
+
+    Every phase is journaled before it starts. `resume` is the journal entry of
+    a restart interrupted by a crash; the phases it completed are skipped.
+    """
+    key = fleet.host_key(container_config['name'])
     try:
-        if client:
-            old_container = client.containers.get(name)
-            old_container.stop(timeout=10)
-            old_container.remove()
-        else:
-            # Fallback to subprocess
-            subprocess.run(['docker', 'stop', name], capture_output=True)
-            subprocess.run(['docker', 'rm', name], capture_output=True)
-    except Exception as e:
-        logging.warning(f"Could not stop/remove old container: {e}")
+        return _restart_container(container_config, resume)
+    finally:
+        store.journal_clear(key)
 
-    # Start new container using subprocess fallback
+def _restart_container(container_config, resume):
+    client = get_client()
+    name = container_config['name']
+    image = container_config['image']
+    reached = JOURNAL_PHASES.index(resume['phase']) if resume else 0
+    update_id = (resume or {}).get('update_id') or store.record_update_start(fleet.host_key(name), image)
+    generation = (resume or {}).get('generation')
+
+    # Backup before update (redone after a crash mid-backup; the container was still intact)
+    if reached <= JOURNAL_PHASES.index('backup'):
+        _journal(name, 'backup', image=image, update_id=update_id)
+        jobs.report_phase('backup', name)
+        generation = backup_container(name)
+
+    # The container is recreated from its full backed-up create request
     try:
-        if client:
-            client.containers.run(
-                image=image,
-                name=name,
-                detach=True,
-                restart_policy={"Name": "unless-stopped"}
-            )
-        else:
-            # Fallback to subprocess - get port mapping from config
-            port_mapping = ""
-            ports = container_config.get('ports', [])
-            if ports:
-                for port in ports:
-                    if ':' in port:
-                        port_mapping += f" -p {port}"
-            
-            cmd = f"docker run -d --name {name} --restart unless-stopped {port_mapping} {image}"
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-            if result.returncode != 0:
-                raise Exception(f"docker run failed: {result.stderr}")
-        
-        logging.info(f"✅ Started updated {name}")
+        spec = _recreate_spec(name, generation)
     except Exception as e:
-        msg = f"❌ Start failed for `{name}`: `{e}`"
+        msg = f"❌ Not updating `{name}`: {e}"
         logging.error(msg)
         send_telegram(msg)
-        if container_config.get('rollback_on_failure', False):
-            rollback_container(name)
+        store.record_update_result(update_id, 'failed', str(e))
         return False
 
+    # Stop & remove old container using subprocess fallback
+    if reached <= JOURNAL_PHASES.index('stopping'):
+        _journal(name, 'stopping', generation=generation)
+        jobs.report_phase('stopping', name)
+        try:
+            if client:
+                old_container = client.containers.get(name)
+                old_container.stop(timeout=10)
+                old_container.remove()
+            else:
+                # Fallback to subprocess
+                subprocess.run(['docker', 'stop', name], capture_output=True)
+                subprocess.run(['docker', 'rm', name], capture_output=True)
+        except Exception as e:
+            logging.warning(f"Could not stop/remove old container: {e}")
+
+    # Start new container using subprocess fallback
+    if reached <= JOURNAL_PHASES.index('starting'):
+        _journal(name, 'starting')
+        jobs.report_phase('starting', name)
+        try:
+            if resume:
+                # A crash mid-start may have left a created (or half-stopped) container holding the name
+                _remove_existing(name)
+            # Discovered containers keep their guardian.* labels so they stay discovered
+            labels = dict(container_config.get('labels', {}), **{disk.MANAGED_LABEL: 'true'})
+            if spec:
+                # Same env, volumes, ports, networks and restart policy, on the new image
+                body, image_config = spec
+                body = compose.for_image(body, image, image_config)
+                if not compose.service_info(body.get('Labels')):
+                    # Compose owns its services; other containers are marked as recreated by Guardian
+                    body['Labels'] = dict(body.get('Labels') or {}, **labels)
+                compose.recreate(client, name, body)
+            else:
+                # Fallback to subprocess - get port mapping from config
+                port_mapping = ""
+                ports = container_config.get('ports', [])
+                if ports:
+                    for port in ports:
+                        if ':' in port:
+                            port_mapping += f" -p {port}"
+                
+                label_args = ''.join(f" --label {shlex.quote(f'{k}={v}')}" for k, v in labels.items())
+                cmd = f"docker run -d --name {name}{label_args} --restart unless-stopped {port_mapping} {image}"
+                result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+                if result.returncode != 0:
+                    raise Exception(f"docker run failed: {result.stderr}")
+            
+            logging.info(f"✅ Started updated {name}")
+        except Exception as e:
+            msg = f"❌ Start failed for `{name}`: `{e}`"
+            logging.error(msg)
+            send_telegram(msg)
+            rolled_back = container_config.get('rollback_on_failure', False) and rollback_container(name, generation)
+            store.record_update_result(update_id, 'start_failed', str(e) + (' (rolled back)' if rolled_back else ''))
+            return False
+
     # Health check
+    _journal(name, 'health_check')
     health_url = container_config.get('health_check_url', '')
     if health_url:
         logging.info(f"🩺 Health checking {name} at {health_url}...")
+        jobs.report_phase('health_check', name)
         healthy = health_check(health_url)
         if not healthy:
             msg = f"💔 Health check failed for `{name}`"
             logging.error(msg)
             send_telegram(msg)
-            if container_config.get('rollback_on_failure', False):
-                rollback_container(name)
+            rolled_back = container_config.get('rollback_on_failure', False) and rollback_container(name, generation)
+            store.record_update_result(update_id, 'health_failed', 'rolled back' if rolled_back else '')
             return False
 
     send_telegram(f"🎉 Successfully updated `{name}`")
+    store.record_update_result(update_id, 'success')
     return True
 
-def run_updates():
-    config = load_config()
-    containers = config.get('containers', [])
+def _recreate_spec(name, generation):
+    """Backed-up create request and previous image config to recreate a container from.
+
+    Returns None when only the `docker` CLI is available (plain containers are
+    then recreated from their Guardian config). Raises when the container could
+    not be recreated with its own config (no usable backup, or a Compose service
+    without the Docker API), so it is left running instead.
+    """
+    client = get_client()
+    snapshot = store.get_snapshot(fleet.host_key(name), generation) if generation else None
+    body = snapshot['config'] if snapshot else None
+    if not client:
+        if body and compose.service_info(body.get('Labels')):
+            raise Exception("Compose services are recreated through the Docker API, which is unavailable")
+        return None
+    if snapshot is None:
+        raise Exception("its configuration could not be backed up")
+    if 'HostConfig' not in body:
+        raise Exception(f"backup generation {snapshot['generation']} has no host config to recreate it from")
+    image_config = None
+    try:
+        image_config = client.images.get(snapshot['image_id']).attrs.get('Config')
+    except Exception as e:
+        logging.warning(f"Previous image of {name} is gone; keeping the config it inherited: {e}")
+    return body, image_config
+
+# Crash recovery: restarts journaled by a process that is no longer running
+# are finished (or rolled back) on startup
+def _process_token(pid):
+    """Start time of a process from /proc, so a reused PID is not mistaken for the original"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(')', 1)[1].split()[19]
+    except (OSError, IndexError):
+        return None
+
+JOURNAL_OWNER = f"{socket.gethostname()}:{os.getpid()}:{_process_token(os.getpid())}"
+
+def _owner_alive(owner):
+    hostname, pid, token = owner.split(':', 2)
+    if hostname != socket.gethostname() or not pid.isdigit():
+        return False
+    if token != 'None':
+        return _process_token(int(pid)) == token
+    try:
+        os.kill(int(pid), 0)
+        return True
+    except OSError:
+        return False
+
+def _journal(name, phase, **fields):
+    """Write-ahead: record the phase a container's update is about to enter"""
+    store.journal_write(fleet.host_key(name), phase, host=_current_host_name(), name=name,
+                        owner=JOURNAL_OWNER, **fields)
+
+def _recover_entry(host, entry, mode):
+    name = entry['name']
+    container_config = next((c for c in host.get('containers', []) if c['name'] == name), None)
+    if entry['phase'] == 'backup':
+        # Interrupted before the old container was touched; the next cycle retries
+        logging.info(f"🩹 {name}: update interrupted during backup; container untouched")
+        store.record_update_result(entry['update_id'], 'interrupted', 'crashed during backup')
+        store.journal_clear(entry['container'])
+        return True
+    if mode == 'rollback' or container_config is None or container_config['image'] != entry['image']:
+        logging.warning(f"🩹 {name}: rolling back update interrupted at {entry['phase']}")
+        ok = rollback_container(name, entry['generation'])
+        store.record_update_result(entry['update_id'], 'interrupted',
+                                   f"crashed at {entry['phase']}; " + ('rolled back' if ok else 'rollback failed'))
+        store.journal_clear(entry['container'])
+        return ok
+    logging.warning(f"🩹 {name}: resuming update interrupted at {entry['phase']}")
+    return restart_container(container_config, resume=entry)
+
+def recover_journal():
+    """Finish or roll back restarts left in flight by a crashed Guardian process; returns (ok, message).
+
+    Each entry is claimed for this process first, so a cycle or another
+    process recovering at the same time never handles the same one twice.
+    """
+    entries = [e for e in store.journal_list() if e['phase'] != 'pulled' and not _owner_alive(e['owner'])]
+    if not entries:
+        return True, "nothing to recover"
+    config = managed_config()
+    mode = config['global'].get('journal_recovery', 'resume')
+    if config['global'].get('dry_run', False):
+        for entry in entries:
+            logging.warning(f"📝 Dry run: {entry['container']} was interrupted at {entry['phase']}; not recovering")
+        return True, f"dry run: {len(entries)} interrupted update(s) left alone"
+
+    by_host = {}
+    for entry in entries:
+        if store.journal_claim(entry['container'], entry['owner'], JOURNAL_OWNER):
+            by_host.setdefault(entry['host'], []).append(entry)
+    if not by_host:
+        return True, "nothing to recover"
+    hosts = [h for h in fleet.get_hosts(config) if h['name'] in by_host]
+    for name in set(by_host) - {h['name'] for h in hosts}:
+        logging.error(f"🩹 Host {name} is no longer configured; leaving its interrupted updates alone")
+
+    results = fleet.for_each_host(hosts, lambda host: {e['name']: _recover_entry(host, e, mode)
+                                                       for e in by_host[host['name']]},
+                                  workers=config['global'].get('fleet_workers', 8))
+    attempted = sum(len(by_host[h['name']]) for h in hosts)
+    failed = sum(len(by_host[name]) if isinstance(result, Exception) else sum(1 for ok in result.values() if not ok)
+                 for name, result in results.items())
+    message = f"Recovered {attempted - failed} of {attempted} interrupted update(s)"
+    send_telegram(f"🩹 {message}" + (f"; {failed} failed" if failed else ""))
+    return not failed, message
+
+def update_container(container_config):
+    prefetched = prefetch_container(container_config)
+    if prefetched['status'] == 'failed':
+        return False
+    if prefetched['status'] == 'up_to_date':
+        return True
+    return restart_container(container_config)
+
+def prefetch_images(containers, workers=None, load_settings=None, load_budget=None):
+    """Pull every candidate image up front, in parallel"""
+    if not containers:
+        return {}
+    if workers is None:
+        workers = max(1, int(load_config()['global'].get('prefetch_workers', 4)))
+    gate = None
+    if load_settings and load_settings['enabled']:
+        load_budget = load_budget or new_load_budget(load_settings)
+        gate = _load_gate('pull', load_settings, load_budget)
+    with ThreadPoolExecutor(max_workers=min(workers, len(containers))) as pool:
+        results = list(fleet.map_in_context(pool, lambda c: prefetch_container(c, gate), containers))
+    deferred = [r['name'] for r in results if r['status'] == 'deferred']
+    if deferred:
+        # One decision for every pull the overloaded host held back
+        sample, level, reasons, waited = load_budget['overloaded']
+        logging.warning(f"🐢 Host still overloaded after {waited}s ({'; '.join(reasons)}); deferred "
+                        f"{len(deferred)} non-urgent pull(s): {', '.join(deferred)}")
+        try:
+            store.record_load_decision(_current_host_name(), 'pull', level, 'defer', None, waited,
+                                       deferred, reasons, sample)
+        except Exception as e:
+            logging.debug(f"Could not record load decision: {e}")
+    return {r['name']: r for r in results}
+
+def new_load_budget(load_settings):
+    """Wait allowance shared by the load decisions of one host's cycle"""
+    return {'wait_left': load_settings['max_wait_seconds'], 'deferring': False, 'overloaded': None,
+            'lock': threading.Lock()}
+
+def _load_gate(phase, load_settings, load_budget):
+    """Admission check run before each non-urgent pull: returns gate(container_config) -> go ahead?
+
+    The pulls of a phase share one decision: while the host is overloaded the
+    first caller waits out what is left of the budget and the others queue
+    behind it for the verdict. Once the host stayed overloaded, every later
+    non-urgent pull is deferred without waiting again.
+    """
+    def gate(container_config):
+        if container_config.get('urgent', False):
+            return True
+        if load_budget['deferring']:
+            return False
+        # Fast path without the lock: pulls only queue up behind a wait while the host is overloaded
+        if hostload.assess(hostload.host_sample(), load_settings)[0] != hostload.OVERLOADED:
+            return True
+        with load_budget['lock']:
+            if load_budget['deferring']:
+                return False
+            sample, level, reasons, waited = hostload.wait_until_not_overloaded(
+                dict(load_settings, max_wait_seconds=load_budget['wait_left']))
+            load_budget['wait_left'] = max(0, load_budget['wait_left'] - waited)
+            if level == hostload.OVERLOADED:
+                # Recorded once for all deferred pulls when the phase ends
+                load_budget.update(deferring=True, overloaded=(sample, level, reasons, waited))
+                return False
+            if waited:
+                logging.info(f"🐢 Host load settled after {waited}s; continuing {phase}s")
+                try:
+                    store.record_load_decision(_current_host_name(), phase, level, 'wait', None, waited,
+                                               [container_config['name']], reasons, sample)
+                except Exception as e:
+                    logging.debug(f"Could not record load decision: {e}")
+            return True
+    return gate
+
+def throttle_for_load(phase, containers, workers, load_settings, load_budget=None):
+    """Sample host load before a phase and decide how to run it: returns (workers, containers to run now).
+
+    A busy host runs the phase one container at a time. An overloaded host is
+    given what is left of load_budget (max_wait_seconds by default) to settle;
+    if it does not, non-urgent containers are deferred to a later cycle and
+    urgent ones go ahead one at a time. Every decision is logged and recorded
+    for /load.
+    """
+    if not load_settings['enabled'] or not containers:
+        return workers, containers
+    sample = hostload.host_sample()
+    if sample is None:
+        return workers, containers
+    if load_budget is None:
+        load_budget = new_load_budget(load_settings)
+    level, reasons = hostload.assess(sample, load_settings)
+    waited = 0
+    if level == hostload.OVERLOADED:
+        with load_budget['lock']:
+            logging.info(f"⏳ Host overloaded ({'; '.join(reasons)}); waiting up to "
+                         f"{load_budget['wait_left']}s before {phase}")
+            sample, level, reasons, waited = hostload.wait_until_not_overloaded(
+                dict(load_settings, max_wait_seconds=load_budget['wait_left']))
+            load_budget['wait_left'] = max(0, load_budget['wait_left'] - waited)
+
+    names = [c['name'] for c in containers]
+    deferred = []
+    if level == hostload.OK:
+        action = 'wait' if waited else 'proceed'
+    elif level == hostload.BUSY or all(c.get('urgent', False) for c in containers):
+        action, workers = 'throttle', 1
+    else:
+        deferred = [c for c in containers if not c.get('urgent', False)]
+        containers = [c for c in containers if c.get('urgent', False)]
+        action, workers = 'defer', 1
+        names = [c['name'] for c in deferred]
+        load_budget['deferring'] = True
+
+    detail = '; '.join(reasons) or 'within thresholds'
+    if action == 'defer':
+        logging.warning(f"🐢 Host still overloaded after {waited}s ({detail}); deferring {phase} of "
+                        f"{len(deferred)} non-urgent container(s): {', '.join(names)}")
+    elif action == 'throttle':
+        logging.info(f"🐢 Host {level} ({detail}); {phase} with 1 worker")
+    elif action == 'wait':
+        logging.info(f"🐢 Host load settled after {waited}s; continuing {phase}")
+    else:
+        logging.debug(f"Host load OK for {phase} ({detail})")
+    try:
+        store.record_load_decision(_current_host_name(), phase, level, action, workers, waited, names, reasons, sample)
+    except Exception as e:
+        logging.debug(f"Could not record load decision: {e}")
+    return workers, containers
+
+def plan_rollout(containers):
+    """Order containers into stages of parallel waves that respect depends_on.
+
+    `depends_on` may name containers or groups. A container never runs in an
+    earlier stage than its dependencies; dependency cycles are left out.
+    """
+    by_name = {c['name']: c for c in containers}
+    groups = {}
     for c in containers:
-        if not c.get('enabled', True) or not c.get('auto_update', False):
+        if c.get('group'):
+            groups.setdefault(c['group'], []).append(c['name'])
+
+    deps = {}
+    for c in containers:
+        names = set()
+        for dep in c.get('depends_on', []):
+            names.update(groups.get(dep, [dep]))
+        names.discard(c['name'])
+        # Dependencies not being updated this cycle are already satisfied
+        deps[c['name']] = {d for d in names if d in by_name}
+
+    # Topological order (Kahn's algorithm)
+    dependents = {name: [] for name in by_name}
+    indegree = {name: len(d) for name, d in deps.items()}
+    for name, d in deps.items():
+        for dep in d:
+            dependents[dep].append(name)
+    queue = [name for name in by_name if indegree[name] == 0]
+    order = []
+    while queue:
+        name = queue.pop(0)
+        order.append(name)
+        for child in dependents[name]:
+            indegree[child] -= 1
+            if indegree[child] == 0:
+                queue.append(child)
+
+    cyclic = [name for name in by_name if name not in order]
+    if cyclic:
+        logging.error(f"❌ Dependency cycle between {', '.join(cyclic)}; skipping them this cycle")
+
+    stage = {}
+    level = {}
+    for name in order:
+        stage[name] = max([int(by_name[name].get('stage', 0))] + [stage[d] for d in deps[name]])
+        level[name] = max([level[d] + 1 for d in deps[name] if stage[d] == stage[name]], default=0)
+
+    plan = []
+    for stage_no in sorted(set(stage.values())):
+        members = [n for n in order if stage[n] == stage_no]
+        waves = [[n for n in members if level[n] == lvl] for lvl in sorted({level[n] for n in members})]
+        plan.append((stage_no, waves))
+    return plan
+
+def run_rollout(containers):
+    """Restart containers stage by stage, halting on the first failed wave.
+
+    Containers deferred because of host load are left out of the results.
+    """
+    config = load_config()
+    workers = max(1, int(config['global'].get('rollout_workers', 2)))
+    # Upper bound for restarting a Compose project's services together; never below rollout_workers
+    project_workers = max(workers, int(config['global'].get('compose_rollout_workers', 8)))
+    load_settings = hostload.settings(config)
+    by_name = {c['name']: c for c in containers}
+    results = {}
+    # One wait allowance for the whole rollout, not one per wave
+    load_budget = new_load_budget(load_settings)
+
+    for stage_no, waves in plan_rollout(containers):
+        for wave in waves:
+            if load_budget['deferring']:
+                # Once the host stayed overloaded, only urgent updates go ahead this cycle
+                wave = [n for n in wave if by_name[n].get('urgent', False)]
+                if not wave:
+                    continue
+            # The services of one Compose project in a wave restart together, in one short window
+            project_size = max(Counter(by_name[n]['compose_project'] for n in wave
+                                       if by_name[n].get('compose_project')).values(), default=0)
+            wave_workers, members = throttle_for_load(f"stage {stage_no} restart", [by_name[n] for n in wave],
+                                                      min(max(workers, project_size), project_workers),
+                                                      load_settings, load_budget)
+            if len(members) < len(wave):
+                wave = [c['name'] for c in members]
+                if not wave:
+                    continue
+            logging.info(f"🔁 Stage {stage_no}: restarting {', '.join(wave)}...")
+            with ThreadPoolExecutor(max_workers=min(wave_workers, len(wave))) as pool:
+                outcomes = list(fleet.map_in_context(pool, lambda n: restart_container(by_name[n]), wave))
+            results.update(zip(wave, outcomes))
+
+            failed = [n for n, ok in zip(wave, outcomes) if not ok]
+            if failed:
+                skipped = [n for n in by_name if n not in results]
+                msg = f"🛑 Rollout halted at stage {stage_no}: `{', '.join(failed)}` failed"
+                if skipped:
+                    msg += f", skipped `{', '.join(skipped)}`"
+                logging.error(msg)
+                send_telegram(msg)
+                return results
+    return results
+
+def in_maintenance_window(config, now=None):
+    window = config.get('maintenance_window', {})
+    if not window.get('enabled', False):
+        return True
+    now = (now or datetime.now()).strftime('%H:%M')
+    start = window.get('start', '00:00')
+    end = window.get('end', '23:59')
+    if start <= end:
+        return start <= now < end
+    # Window wraps past midnight, e.g. 23:00-04:00
+    return now >= start or now < end
+
+def adaptive_check_settings(config):
+    return dict(ADAPTIVE_CHECK_DEFAULTS, **config['global'].get('adaptive_checks', {}))
+
+def check_due(container_config, now=None):
+    """Whether the adaptive schedule wants this container checked (always true for new images)"""
+    schedule = store.get_check_schedule(fleet.host_key(container_config['name']))
+    if schedule is None or schedule['image'] != container_config['image']:
+        return True
+    return (now or datetime.now()).strftime(TIME_FORMAT) >= schedule['next_check']
+
+def record_check(container_config, outcome):
+    """Grow the check interval while the remote digest stays put, reset it when it changes"""
+    settings = adaptive_check_settings(load_config())
+    minimum = int(settings['min_minutes'] * 60)
+    maximum = max(minimum, int(settings['max_minutes'] * 60))
+    key = fleet.host_key(container_config['name'])
+    image = container_config['image']
+    previous = store.get_check_schedule(key)
+    if previous and previous['image'] != image:
+        previous = None
+    now = datetime.now()
+    digest = outcome.get('remote_digest') or (previous or {}).get('digest')
+    unchanged = 0
+    last_changed = (previous or {}).get('last_changed')
+    if outcome.get('remote_digest') and previous and previous['digest']:
+        changed = outcome['remote_digest'] != previous['digest']
+    else:
+        # No registry answer to compare; a pulled image that differs counts as a change
+        changed = outcome['status'] == 'ready'
+
+    if outcome['status'] == 'failed':
+        interval = previous['interval'] if previous else minimum
+        unchanged = previous['unchanged_checks'] if previous else 0
+        reason = 'check failed; retrying after the minimum interval'
+    elif previous is None:
+        interval = minimum
+        reason = 'first check'
+    elif changed:
+        interval = minimum
+        last_changed = now.strftime(TIME_FORMAT)
+        reason = 'digest changed; interval reset to minimum'
+    else:
+        unchanged = previous['unchanged_checks'] + 1
+        interval = min(maximum, max(minimum, int(previous['interval'] * settings['factor'])))
+        reason = f"digest unchanged for {unchanged} check(s); interval x{settings['factor']}"
+        if interval == maximum:
+            reason += ' (at maximum)'
+
+    next_check = now + timedelta(seconds=minimum if outcome['status'] == 'failed' else interval)
+    if outcome['status'] == 'ready':
+        # The restart may be deferred to the maintenance window; keep it due until applied
+        next_check = now
+        reason += '; restart pending'
+    store.save_check_schedule(key, image, digest, interval, unchanged, last_changed,
+                              next_check.strftime(TIME_FORMAT), reason)
+
+def run_host_updates(containers):
+    """Run the pre-fetch, restart and cleanup phases for one host's containers"""
+    config = load_config()
+    candidates = [c for c in containers if c.get('enabled', True) and c.get('auto_update', False)]
+    if adaptive_check_settings(config)['enabled']:
+        due = [c for c in candidates if check_due(c)]
+        if len(due) < len(candidates):
+            logging.info(f"⏭️ {len(candidates) - len(due)} container(s) not due for a check yet (adaptive schedule)")
+        candidates = due
+
+    # Phase 1: pre-fetch every changed image; this may run well before the window.
+    # Containers deferred for host load are not checked, so they stay due for the next cycle
+    load_settings = hostload.settings(config)
+    load_budget = new_load_budget(load_settings)
+    workers, candidates = throttle_for_load('prefetch', candidates,
+                                            max(1, int(config['global'].get('prefetch_workers', 4))),
+                                            load_settings, load_budget)
+    jobs.report_phase('prefetch', f"{len(candidates)} containers")
+    prefetched = prefetch_images(candidates, workers, load_settings, load_budget)
+    ready = [c for c in candidates if prefetched[c['name']]['status'] == 'ready']
+    pending_ids = {prefetched[c['name']]['image_id'] for c in ready}
+
+    # Phase 2: swap containers whose images are already local
+    if ready and not in_maintenance_window(config):
+        logging.info(f"⏸️ Outside maintenance window; {len(ready)} update(s) pre-fetched, restart deferred.")
+    else:
+        jobs.report_phase('rollout', f"{len(ready)} containers")
+        results = run_rollout(compose.group_projects(ready, prefetched))
+        # Keep the images of restarts that were deferred or skipped; the next cycle reuses them
+        pending_ids = {prefetched[c['name']]['image_id'] for c in ready if c['name'] not in results}
+
+    jobs.report_phase('cleanup')
+    cleanup_images(keep_image_ids=pending_ids)
+
+# Compressed layer digests of local images, keyed by (image ID, platform); image IDs never change content
+# Image IDs are immutable, so entries never go stale; the bound keeps a long-running web process small
+_local_layers = lru.cache('local_layers', 512)
+
+def _local_layer_digests(image_id, repo_digests, plat):
+    """Layer blobs a local image was pulled with, looked up through its repo digests"""
+    key = (image_id, registry.platform_string(plat))
+    layers = _local_layers.get(key)
+    if layers is None:
+        for ref in repo_digests:
+            remote = registry.resolve_platform_manifest(ref, plat)
+            if remote:
+                layers = frozenset(layer['digest'] for layer in remote['layers'])
+                _local_layers.put(key, layers)
+                break
+    return layers
+
+def plan_container(container_config):
+    """Work out what an update cycle would do to one container, without pulling or restarting"""
+    client = get_client()
+    name = container_config['name']
+    image = container_config['image']
+    plat = get_platform()
+    entry = {
+        'name': name,
+        'image': image,
+        'host': _current_host_name(),
+        'platform': registry.platform_string(plat),
+        'action': 'unknown',
+        'current_image_id': None,
+        'remote_digest': None,
+        'download_bytes': None,
+        'layers_to_download': None,
+        'estimate': None,
+        'missing_layers': {},
+    }
+
+    repo_digests = []
+    try:
+        if client:
+            container = client.containers.get(name)
+            entry['current_image_id'] = container.attrs.get('Image')
+            repo_digests = container.image.attrs.get('RepoDigests', [])
+        else:
+            result = subprocess.run(['docker', 'inspect', name, '--format', '{{.Image}}'],
+                                  capture_output=True, text=True)
+            if result.returncode == 0 and result.stdout.strip():
+                entry['current_image_id'] = result.stdout.strip()
+    except Exception as e:
+        logging.debug(f"Plan: could not inspect {name}: {e}")
+
+    remote = registry.resolve_platform_manifest(image, plat)
+    if not remote:
+        # The cycle would pull to find out
+        return entry
+    entry['remote_digest'] = remote['digest']
+
+    if registry.image_matches_remote(remote, entry['current_image_id'], repo_digests):
+        entry.update(action='up_to_date', download_bytes=0, layers_to_download=0)
+        return entry
+
+    present = _local_layer_digests(entry['current_image_id'], repo_digests, plat) if entry['current_image_id'] else None
+    missing = {layer['digest']: layer['size'] for layer in remote['layers'] if layer['digest'] not in (present or ())}
+    entry.update(
+        action='update',
+        download_bytes=sum(missing.values()),
+        layers_to_download=len(missing),
+        estimate='delta' if present is not None else 'full',
+        missing_layers=missing,
+    )
+    return entry
+
+def plan_host_updates(containers):
+    """Dry-run counterpart of run_host_updates for one host"""
+    config = load_config()
+    candidates = [c for c in containers if c.get('enabled', True) and c.get('auto_update', False)]
+    entries = []
+    if candidates:
+        workers = max(1, int(config['global'].get('prefetch_workers', 4)))
+        with ThreadPoolExecutor(max_workers=min(workers, len(candidates))) as pool:
+            entries = list(fleet.map_in_context(pool, plan_container, candidates))
+
+    # Containers sharing images or base layers download them once
+    layers = {}
+    for entry in entries:
+        layers.update(entry.pop('missing_layers'))
+    changing = [c for c, entry in zip(candidates, entries) if entry['action'] != 'up_to_date']
+    return {
+        'host': _current_host_name(),
+        'containers': entries,
+        'rollout': [{'stage': stage_no, 'waves': waves} for stage_no, waves in plan_rollout(changing)],
+        'download_bytes': sum(layers.values()),
+        'restart_deferred': bool(changing) and not in_maintenance_window(config),
+    }
+
+def plan_updates():
+    """Compute the update plan for every host: what would change, how much to download, and in which order"""
+    config = managed_config()
+    if fleet.is_fleet(config):
+        hosts = fleet.get_hosts(config)
+        results = fleet.for_each_host(hosts, lambda host: plan_host_updates(host.get('containers', [])),
+                                      workers=config['global'].get('fleet_workers', 8))
+        host_plans = [{'host': name, 'error': str(result)} if isinstance(result, Exception) else result
+                      for name, result in results.items()]
+    else:
+        host_plans = [plan_host_updates(config.get('containers', []))]
+
+    return {
+        'generated': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'dry_run': config['global'].get('dry_run', False),
+        'in_maintenance_window': in_maintenance_window(config),
+        'download_bytes': sum(p.get('download_bytes', 0) for p in host_plans),
+        'hosts': host_plans,
+    }
+
+def _log_plan(plan):
+    for host_plan in plan['hosts']:
+        if 'error' in host_plan:
+            logging.error(f"📝 Plan for {host_plan['host']} failed: {host_plan['error']}")
             continue
-        logging.info(f"🔄 Checking {c['name']}...")
-        update_container(c)
+        for entry in host_plan['containers']:
+            if entry['action'] == 'update':
+                logging.info(f"📝 {entry['name']} would update to {entry['remote_digest'][:19]} "
+                             f"({entry['download_bytes'] / 1048576:.1f} MB, {entry['layers_to_download']} layers)")
+            elif entry['action'] == 'unknown':
+                logging.info(f"📝 {entry['name']} could not be checked against the registry; the cycle would pull it")
+    logging.info(f"📝 Plan: {plan['download_bytes'] / 1048576:.1f} MB to download")
+
+def run_updates():
+    config = managed_config(force_discovery=True)
+    with profiling.profile('run_updates', profiling.settings(config)):
+        _run_updates(config)
 
-    cleanup_images()
+def _run_updates(config):
+    recover_journal()
+    if config['global'].get('dry_run', False):
+        logging.info("📝 Dry run enabled; computing plan without pulling or restarting.")
+        _log_plan(plan_updates())
+        return
+    reset_pull_cycle()
+    if fleet.is_fleet(config):
+        hosts = fleet.get_hosts(config)
+        logging.info(f"🌐 Running update cycle on {len(hosts)} hosts...")
+        fleet.for_each_host(hosts, lambda host: run_host_updates(host.get('containers', [])),
+                            workers=config['global'].get('fleet_workers', 8))
+    else:
+        run_host_updates(config.get('containers', []))
     logging.info("✅ Update cycle completed.")
 
+def check_images(names=()):
+    """Registry-only check: has each configured image moved since the last cycle looked at it?
+
+    Needs no Docker daemon: the registry's digest for the host's platform is
+    compared with the digest the last cycle recorded. Remote hosts without a
+    `platform` in their config are checked for the local (or global) platform.
+    """
+    config = load_config()
+    default_platform = registry.get_host_platform(config['global'].get('platform'))
+    targets = [(host, c) for host in fleet.get_hosts(config) for c in host.get('containers', [])
+               if c.get('image') and (not names or c['name'] in names)]
+
+    def check(target):
+        host, container_config = target
+        with fleet.using_host(host):
+            key = fleet.host_key(container_config['name'])
+        plat = registry.get_host_platform(host['platform']) if host.get('platform') else default_platform
+        schedule = store.get_check_schedule(key)
+        known = schedule['digest'] if schedule and schedule['image'] == container_config['image'] else None
+        entry = store.journal_get(key)
+        result = {'name': container_config['name'], 'host': host['name'], 'image': container_config['image'],
+                  'platform': registry.platform_string(plat), 'known_digest': known, 'remote_digest': None,
+                  'last_checked': schedule['last_checked'] if schedule else None}
+        remote = registry.resolve_platform_manifest(container_config['image'], plat)
+        if remote is None:
+            result['status'] = 'error'
+        else:
+            result['remote_digest'] = remote['digest']
+            if entry and entry['phase'] == 'pulled' and entry['remote_digest'] == remote['digest']:
+                result['status'] = 'restart_pending'
+            elif known is None:
+                result['status'] = 'unknown'
+            else:
+                result['status'] = 'changed' if remote['digest'] != known else 'unchanged'
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, config['global'].get('prefetch_workers', 4))) as pool:
+        return list(pool.map(check, targets))
+
+def status():
+    """Guardian's state from config.json and the state store, without contacting Docker"""
+    config = load_config()
+    hosts = fleet.get_hosts(config)
+    now = datetime.now().strftime(TIME_FORMAT)
+    schedules = store.list_check_schedules()
+    return {
+        'hosts': [{'name': h['name'], 'url': h.get('url'), 'containers': len(h.get('containers', []))} for h in hosts],
+        'dry_run': config['global'].get('dry_run', False),
+        'in_maintenance_window': in_maintenance_window(config),
+        'adaptive_checks': adaptive_check_settings(config)['enabled'],
+        'discovery': discovery.settings(config)['enabled'],
+        'checks_due': sum(1 for s in schedules if s['next_check'] <= now),
+        'journal': [dict(e, orphaned=not _owner_alive(e['owner'])) for e in store.journal_list()],
+        'recent_updates': store.list_updates(limit=10),
+        'recent_cleanups': store.list_cleanups(limit=5),
+    }
+
+def update_named(names):
+    """Update the named containers now, on whichever host runs them; returns {name: result}"""
+    config = managed_config()
+    results = {}
+    for name in names:
+        host = fleet.find_container_host(config, name)
+        if host is None:
+            results[name] = 'not configured'
+            continue
+        container_config = next(c for c in host.get('containers', []) if c['name'] == name)
+        with fleet.using_host(host):
+            if config['global'].get('dry_run', False):
+                results[name] = plan_container(container_config)
+                continue
+            reset_pull_cycle()
+            results[name] = 'updated' if update_container(container_config) else 'failed'
+    return results
+
+def _cli_rollback(name, generation=None, host_name=None):
+    config = managed_config()
+    host = fleet.find_host(config, host_name) if host_name else fleet.find_container_host(config, name)
+    with fleet.using_host(host):
+        return {'name': name, 'rolled_back': rollback_container(name, generation)}
+
+def _cli_cleanup():
+    config = load_config()
+    results = fleet.for_each_host(fleet.get_hosts(config), lambda host: cleanup_images(reason='manual'),
+                                  workers=config['global'].get('fleet_workers', 8))
+    return {name: {'error': str(r)} if isinstance(r, Exception) else r for name, r in results.items()}
+
+def _print_human(command, result):
+    if command == 'check':
+        for r in result:
+            digest = (r['remote_digest'] or '')[:19]
+            print(f"{r['status']:<16} {r['host'] + '/' if r['host'] != fleet.LOCAL_HOST else ''}{r['name']:<30} "
+                  f"{r['image']} {digest}")
+    elif command == 'plan':
+        for host_plan in result['hosts']:
+            if 'error' in host_plan:
+                print(f"{'error':<16} {host_plan['host']}: {host_plan['error']}")
+                continue
+            for entry in host_plan['containers']:
+                prefix = entry['host'] + '/' if entry['host'] != fleet.LOCAL_HOST else ''
+                size = f"{entry['download_bytes'] / 1048576:.1f} MB" if entry.get('download_bytes') else ''
+                print(f"{entry['action']:<16} {prefix}{entry['name']:<30} {entry['image']} {size}")
+        print(f"{result['download_bytes'] / 1048576:.1f} MB to download" +
+              ('' if result['in_maintenance_window'] else '; restarts wait for the maintenance window'))
+    elif command == 'status':
+        for host in result['hosts']:
+            print(f"host {host['name']}: {host['containers']} containers" + (f" ({host['url']})" if host['url'] else ''))
+        print(f"dry run: {result['dry_run']}, in maintenance window: {result['in_maintenance_window']}, "
+              f"checks due: {result['checks_due']}")
+        for entry in result['journal']:
+            print(f"in flight: {entry['container']} at {entry['phase']}" + (' (orphaned)' if entry['orphaned'] else ''))
+        for update in result['recent_updates']:
+            print(f"{update['started']}  {update['container']:<30} {update['status']} {update['message'] or ''}")
+    else:
+        print(json.dumps(result, indent=2, default=str))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='guardian.py', description='Keep Docker containers up to date. '
+                                     'Without a command, runs one update cycle.')
+    parser.add_argument('--json', action='store_true', help='print machine-readable JSON on stdout')
+    parser.add_argument('--plan', action='store_true', help=argparse.SUPPRESS)
+    # --json is accepted after the command too
+    json_flag = argparse.ArgumentParser(add_help=False)
+    json_flag.add_argument('--json', action='store_true', default=argparse.SUPPRESS, help=argparse.SUPPRESS)
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    check_parser = commands.add_parser('check', parents=[json_flag], help='ask the registry which images moved since the last cycle (no Docker)')
+    check_parser.add_argument('names', nargs='*', help='containers to check (default: all)')
+    commands.add_parser('plan', parents=[json_flag], help='print what an update cycle would do, without changing anything')
+    update_parser = commands.add_parser('update', parents=[json_flag], help='update the named containers now (default: run a full cycle)')
+    update_parser.add_argument('names', nargs='*')
+    rollback_parser = commands.add_parser('rollback', parents=[json_flag], help='recreate a container from a stored generation')
+    rollback_parser.add_argument('name')
+    rollback_parser.add_argument('--generation', type=int, help='generation to restore (default: latest)')
+    rollback_parser.add_argument('--host', help='fleet host running the container')
+    commands.add_parser('cleanup', parents=[json_flag], help='free disk space on every host if it is under pressure')
+    commands.add_parser('status', parents=[json_flag], help='show hosts, in-flight updates and recent history (no Docker)')
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    command = 'plan' if args.plan and not args.command else args.command
+    if command == 'check':
+        result = check_images(args.names)
+    elif command == 'plan':
+        result = plan_updates()
+    elif command == 'update' and args.names:
+        result = update_named(args.names)
+    elif command == 'rollback':
+        result = _cli_rollback(args.name, args.generation, args.host)
+    elif command == 'cleanup':
+        result = _cli_cleanup()
+    elif command == 'status':
+        result = status()
+    else:
+        run_updates()
+        return 0
+
+    if args.json or (args.plan and not args.command):
+        print(json.dumps(result, indent=2, default=str))
+    else:
+        _print_human(command, result)
+    failed = (command == 'rollback' and not result['rolled_back']) or \
+        (command == 'update' and any(r in ('failed', 'not configured') for r in result.values())) or \
+        (command == 'check' and any(r['status'] == 'error' for r in result))
+    return 1 if failed else 0
+
 if __name__ == "__main__":
-    run_updates()
+    sys.exit(main())
@@ -0,0 +1,121 @@
+# hostload.py
+import os
+import time
+
+import fleet
+
+PROC_ROOT = '/proc'
+DEFAULTS = {
+    'enabled': False,
+    'max_load_per_cpu': 1.5,
+    'min_memory_available_percent': 10,
+    # Pressure stall information: share of the last 10s some task was stalled, in percent
+    'max_cpu_pressure': 60,
+    'max_memory_pressure': 10,
+    'max_io_pressure': 30,
+    # Past threshold * critical_factor the host counts as overloaded rather than busy
+    'critical_factor': 1.5,
+    'poll_seconds': 5,
+    'max_wait_seconds': 300,
+}
+OK, BUSY, OVERLOADED = 'ok', 'busy', 'overloaded'
+PSI_RESOURCES = ('cpu', 'memory', 'io')
+
+
+def settings(config):
+    return dict(DEFAULTS, **config.get('global', {}).get('host_load', {}))
+
+
+def _meminfo():
+    fields = {}
+    with open(os.path.join(PROC_ROOT, 'meminfo')) as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            fields[key] = int(value.split()[0]) * 1024
+    return fields
+
+
+def _pressure(resource):
+    """`some avg10` of /proc/pressure/<resource>, or None without PSI (kernel < 4.20 or psi=0)"""
+    try:
+        with open(os.path.join(PROC_ROOT, 'pressure', resource)) as f:
+            for line in f:
+                if line.startswith('some '):
+                    return float(dict(part.split('=') for part in line.split()[1:])['avg10'])
+    except (OSError, KeyError, ValueError):
+        pass
+    return None
+
+
+def sample():
+    """Load average, available memory and pressure stall percentages of this machine.
+
+    Containers see the host's /proc/loadavg and /proc/pressure, so this reads
+    the Docker host when Guardian runs next to its workloads. Metrics that
+    cannot be read are None.
+    """
+    cpus = os.cpu_count() or 1
+    result = {'time': time.time(), 'cpus': cpus, 'load1': None, 'load_per_cpu': None,
+              'memory_total': None, 'memory_available': None, 'memory_available_percent': None}
+    try:
+        load1, _, _ = os.getloadavg()
+        result.update(load1=round(load1, 2), load_per_cpu=round(load1 / cpus, 2))
+    except (OSError, AttributeError):
+        pass
+    try:
+        meminfo = _meminfo()
+        total, available = meminfo['MemTotal'], meminfo.get('MemAvailable', meminfo.get('MemFree'))
+        result.update(memory_total=total, memory_available=available,
+                      memory_available_percent=round(100 * available / total, 1) if total else None)
+    except (OSError, KeyError, ValueError, IndexError):
+        pass
+    result['pressure'] = {resource: _pressure(resource) for resource in PSI_RESOURCES}
+    return result
+
+
+def host_sample():
+    """sample() for the current host; None for remote fleet hosts, whose load cannot be read from here"""
+    if fleet.is_remote(fleet.current_host()):
+        return None
+    return sample()
+
+
+def assess(host_sample, load_settings):
+    """Classify a sample as OK, BUSY or OVERLOADED; returns (level, reasons)"""
+    if host_sample is None:
+        return OK, []
+    # (metric, value, threshold, higher is worse)
+    checks = [('load/cpu', host_sample['load_per_cpu'], load_settings['max_load_per_cpu'], True),
+              ('memory available %', host_sample['memory_available_percent'],
+               load_settings['min_memory_available_percent'], False)]
+    checks += [(f"{resource} pressure %", host_sample['pressure'][resource],
+                load_settings[f"max_{resource}_pressure"], True) for resource in PSI_RESOURCES]
+    level, reasons = OK, []
+    for metric, value, threshold, higher_is_worse in checks:
+        if value is None or not threshold:
+            continue
+        ratio = value / threshold if higher_is_worse else threshold / max(value, 0.01)
+        if ratio <= 1:
+            continue
+        reasons.append(f"{metric} {value} {'>' if higher_is_worse else '<'} {threshold}")
+        if ratio > load_settings['critical_factor']:
+            level = OVERLOADED
+        elif level == OK:
+            level = BUSY
+    return level, reasons
+
+
+def wait_until_not_overloaded(load_settings):
+    """Poll until the host is no longer overloaded or max_wait_seconds pass.
+
+    Returns the last sample, its level and reasons, and the seconds waited.
+    """
+    waited = 0
+    current = host_sample()
+    level, reasons = assess(current, load_settings)
+    while level == OVERLOADED and waited < load_settings['max_wait_seconds']:
+        time.sleep(load_settings['poll_seconds'])
+        waited += load_settings['poll_seconds']
+        current = host_sample()
+        level, reasons = assess(current, load_settings)
+    return current, level, reasons, waited
@@ -0,0 +1,185 @@
+# jobs.py
+import contextvars
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+MAX_QUEUED = 50
+
+_current_job = contextvars.ContextVar('guardian_job', default=None)
+_lock = threading.Lock()
+_jobs = OrderedDict()
+_active = {}
+_executor = None
+_history_size = 100
+# Cleared while a job submitted with holds_others runs; every other job waits for it
+_others_may_run = threading.Event()
+_others_may_run.set()
+_stopping = False
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Conflict(Exception):
+    pass
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def configure(workers=2, history_size=100):
+    """Size the worker pool and the job history ring buffer (first call wins for workers)"""
+    global _executor, _history_size
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='guardian-job')
+        _history_size = max(1, history_size)
+
+
+def submit(key, kind, fn, *args, target=None, variant=None, holds_others=False):
+    """Queue fn(*args) as a job, or return the queued/running job with the same key.
+
+    A request with a variant (e.g. the tag an update goes to) only joins a job
+    with the same variant; a different one raises Conflict rather than being
+    dropped. Requests without one join any job with their key. With
+    holds_others, other jobs stay queued until this one has finished.
+    Returns (job, coalesced).
+    """
+    if _executor is None:
+        configure()
+    with _lock:
+        existing = _active.get(key)
+        if existing is not None:
+            if variant is not None and existing['variant'] != variant:
+                what = f"{existing['kind']} to {existing['variant']}" if existing['variant'] else existing['kind']
+                raise Conflict(f"job {existing['id']} ({what}) is already {existing['status']}")
+            existing['coalesced'] += 1
+            return _snapshot(existing), True
+        queued = sum(1 for job in _active.values() if job['status'] == 'queued')
+        if queued >= MAX_QUEUED:
+            raise QueueFull(f"{queued} jobs already queued")
+
+        job = {
+            'id': uuid.uuid4().hex[:12],
+            'key': key,
+            'kind': kind,
+            'target': target,
+            'variant': variant,
+            'holds_others': holds_others,
+            'status': 'queued',
+            'phase': 'queued',
+            'phases': [{'phase': 'queued', 'message': '', 'at': _now()}],
+            'created': _now(),
+            'started': None,
+            'finished': None,
+            'message': '',
+            'coalesced': 0,
+        }
+        _jobs[job['id']] = job
+        _active[key] = job
+        _trim_history()
+        if holds_others:
+            _others_may_run.clear()
+
+    ctx = contextvars.copy_context()
+    _executor.submit(ctx.run, _run, job, fn, args)
+    return _snapshot(job), False
+
+
+def _run(job, fn, args):
+    _current_job.set(job)
+    if not job['holds_others']:
+        _others_may_run.wait()
+    with _lock:
+        dropped = _stopping
+        if not dropped:
+            job['status'] = 'running'
+            job['started'] = _now()
+    if dropped:
+        status, message = 'failed', 'dropped at shutdown'
+    else:
+        try:
+            result = fn(*args)
+            ok, message = result if isinstance(result, tuple) else (bool(result), '')
+            status = 'succeeded' if ok else 'failed'
+        except Exception as e:
+            logging.error(f"Job {job['id']} ({job['kind']}) failed: {e}")
+            status, message = 'failed', str(e)
+        finally:
+            if job['holds_others']:
+                _others_may_run.set()
+    with _lock:
+        job['status'] = status
+        job['message'] = message
+        job['finished'] = _now()
+        job['phase'] = 'done'
+        job['phases'].append({'phase': 'done', 'message': message, 'at': job['finished']})
+        if _active.get(job['key']) is job:
+            del _active[job['key']]
+        _trim_history()
+
+
+def _trim_history():
+    # Drop the oldest finished jobs; queued and running ones are always kept
+    excess = len(_jobs) - _history_size
+    for job_id in list(_jobs):
+        if excess <= 0:
+            break
+        if _jobs[job_id]['status'] in ('succeeded', 'failed'):
+            del _jobs[job_id]
+            excess -= 1
+
+
+def _snapshot(job):
+    return dict(job, phases=list(job['phases']))
+
+
+def report_phase(phase, message=''):
+    """Record a phase transition for the job running in this context (no-op outside jobs)"""
+    job = _current_job.get()
+    if job is None:
+        return
+    with _lock:
+        job['phase'] = phase
+        job['phases'].append({'phase': phase, 'message': message, 'at': _now()})
+
+
+def get_job(job_id):
+    with _lock:
+        job = _jobs.get(job_id)
+        return _snapshot(job) if job else None
+
+
+def list_jobs():
+    with _lock:
+        return [_snapshot(job) for job in reversed(_jobs.values())]
+
+
+
+def shutdown(timeout=None):
+    """Stop taking jobs, drop the queued ones and wait for running ones; returns False on timeout.
+
+    Workers are not daemon threads, so the interpreter would still wait for
+    them at exit; callers must exit hard when this times out.
+    """
+    global _stopping
+    with _lock:
+        executor = _executor
+        _stopping = True
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+        with _lock:
+            if not any(job['status'] == 'running' for job in _active.values()):
+                return True
+        if deadline is not None and time.time() >= deadline:
+            return False
+        time.sleep(0.5)
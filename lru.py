@@ -0,0 +1,90 @@
+# lru.py
+import threading
+import time
+from collections import OrderedDict
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Size-bounded mapping that evicts the least recently used entry.
+
+    With a ttl, entries older than ttl seconds are treated as missing (and
+    dropped) on lookup. Safe to share between threads.
+    """
+
+    def __init__(self, name, maxsize, ttl=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING and self.ttl is not None and time.time() - item[0] >= self.ttl:
+                del self._data[key]
+                item = _MISSING
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.time(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+            return default if item is _MISSING else item[1]
+
+    def discard_where(self, predicate):
+        """Drop every entry whose key satisfies predicate(key); returns how many were dropped"""
+        with self._lock:
+            stale = [key for key in self._data if predicate(key)]
+            for key in stale:
+                del self._data[key]
+            return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {'size': len(self._data), 'maxsize': self.maxsize, 'ttl': self.ttl,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+def cache(name, maxsize, ttl=None):
+    """Return the named cache, creating it on first use"""
+    with _caches_lock:
+        if name not in _caches:
+            _caches[name] = LRUCache(name, maxsize, ttl)
+        return _caches[name]
+
+
+def stats():
+    """Size and hit/miss/eviction counters for every cache"""
+    with _caches_lock:
+        caches = list(_caches.values())
+    return {c.name: c.stats() for c in caches}
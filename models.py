@@ -0,0 +1,102 @@
+# models.py
+# Compact records the long-running web process keeps instead of Docker SDK
+# objects (which carry the full inspect `attrs`) and raw API payloads.
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+
+
+@dataclass(slots=True, frozen=True)
+class ImageRecord:
+    id: str
+    tags: tuple
+    repo_digests: tuple
+
+    @classmethod
+    def from_summary(cls, summary):
+        """From an entry of the engine's image list (GET /images/json)"""
+        tags = tuple(t for t in summary.get('RepoTags') or () if t != '<none>:<none>')
+        return cls(summary['Id'], tags, tuple(summary.get('RepoDigests') or ()))
+
+    @property
+    def short_id(self):
+        # Same form as docker-py's Image.short_id
+        return self.id[:17] if self.id.startswith('sha256:') else self.id[:10]
+
+
+@dataclass(slots=True, frozen=True)
+class ContainerRecord:
+    id: str
+    name: str
+    image: str
+    image_id: str
+    status: str
+    ports: tuple
+    created: str
+
+    @classmethod
+    def from_summary(cls, summary):
+        """From an entry of the engine's container list (GET /containers/json)"""
+        ports = tuple(f"{p.get('IP', '0.0.0.0')}:{p['PublicPort']}->{p['PrivatePort']}/{p.get('Type', 'tcp')}"
+                      for p in summary.get('Ports') or () if p.get('PublicPort'))
+        created = summary.get('Created')
+        if isinstance(created, (int, float)):
+            created = datetime.fromtimestamp(created, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+        return cls(summary['Id'][:12], summary['Names'][0].lstrip('/'), summary.get('Image', ''),
+                   summary.get('ImageID', ''), summary.get('State', ''), ports, (created or '')[:19])
+
+
+@dataclass(slots=True, frozen=True)
+class PlatformImage:
+    os: str
+    architecture: str
+    variant: str
+    digest: str
+    size: int
+    last_pushed: str
+
+    def as_platform(self):
+        """The dict shape registry.matches_platform() expects"""
+        return {'os': self.os, 'architecture': self.architecture, 'variant': self.variant}
+
+
+@dataclass(slots=True, frozen=True)
+class HubTag:
+    name: str
+    last_updated: str
+    full_size: int
+    images: tuple
+
+    @classmethod
+    def from_result(cls, result):
+        """From one entry of a Docker Hub tag listing, keeping only what update checks read"""
+        images = tuple(PlatformImage(i.get('os', 'linux'), i.get('architecture'), i.get('variant'), i.get('digest'),
+                                     i.get('size'), i.get('last_pushed'))
+                       for i in result.get('images') or ())
+        return cls(result.get('name', ''), result.get('last_updated') or '', result.get('full_size', 0), images)
+
+
+@dataclass(slots=True, frozen=True)
+class TagInfo:
+    name: str
+    last_updated: str
+    size: int
+    digest: str
+    is_latest: bool
+
+    def to_dict(self):
+        return asdict(self)
+
+
+@dataclass(slots=True, frozen=True)
+class LogEntry:
+    file: str
+    content: str
+    timestamp: str
+
+    @classmethod
+    def from_line(cls, file, line):
+        line = line.strip()
+        return cls(file, line, line.split(' - ')[0] if ' - ' in line else '')
+
+    def to_dict(self):
+        return asdict(self)
@@ -0,0 +1,193 @@
+# profiling.py
+import cProfile
+import io
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+# GUARDIAN_PROFILE=1 (or =sample / =cprofile) enables profiling without editing the config
+ENV_TOGGLE = 'GUARDIAN_PROFILE'
+MODES = ('sample', 'cprofile')
+DEFAULTS = {
+    'enabled': False,
+    'mode': 'sample',
+    'dir': 'profiles',
+    'keep': 20,
+    'interval_ms': 5,
+    'min_ms': 0,
+    'routes': ['/containers', '/plan', '/disk', '/schedule'],
+}
+EXTENSIONS = {'sample': '.folded', 'cprofile': '.prof'}
+FILE_PATTERN = re.compile(r'^[\w.-]+\.(folded|prof)$')
+
+# cProfile hooks the interpreter's profiling slot, so only one deterministic profile runs at a time
+_cprofile_lock = threading.Lock()
+
+
+def settings(config):
+    merged = dict(DEFAULTS, **config.get('global', {}).get('profiling', {}))
+    toggle = os.environ.get(ENV_TOGGLE, '').strip().lower()
+    if toggle in MODES:
+        merged.update(enabled=True, mode=toggle)
+    elif toggle in ('1', 'true', 'yes', 'on'):
+        merged['enabled'] = True
+    elif toggle in ('0', 'false', 'no', 'off'):
+        merged['enabled'] = False
+    if merged['mode'] not in MODES:
+        merged['mode'] = DEFAULTS['mode']
+    return merged
+
+
+class Sampler:
+    """Statistical profiler: samples the stacks of the profiled thread and of threads started while it runs.
+
+    Unlike cProfile it sees the prefetch/rollout worker pools, and its cost
+    does not grow with the number of calls. Stacks are aggregated in the
+    "folded" format read by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._ignored = set()
+
+    def start(self):
+        self._ignored = {t.ident for t in threading.enumerate()} - {threading.get_ident()}
+        self._thread = threading.Thread(target=self._run, name='guardian-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own or ident in self._ignored:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _slug(name):
+    return re.sub(r'[^\w.-]+', '_', name).strip('_') or 'root'
+
+
+def _rotate(directory, keep):
+    for stale in list_profiles(directory)[keep:]:
+        try:
+            os.remove(os.path.join(directory, stale['name']))
+        except OSError as e:
+            logging.debug(f"Could not remove old profile {stale['name']}: {e}")
+
+
+@contextmanager
+def profile(name, profiling_settings):
+    """Profile the enclosed block and write it to the profile directory when enabled.
+
+    Yields the path the profile will be written to (None when not profiling).
+    Runs shorter than min_ms are discarded.
+    """
+    if not profiling_settings['enabled']:
+        yield None
+        return
+    mode = profiling_settings['mode']
+    if mode == 'cprofile' and not _cprofile_lock.acquire(blocking=False):
+        logging.debug(f"Skipping profile of {name}: another deterministic profile is running")
+        yield None
+        return
+
+    directory = profiling_settings['dir']
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    path = os.path.join(directory, f"{stamp}-{_slug(name)}{EXTENSIONS[mode]}")
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+    else:
+        profiler = Sampler(profiling_settings['interval_ms'] / 1000)
+        profiler.start()
+    started = time.perf_counter()
+    try:
+        yield path
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if mode == 'cprofile':
+            profiler.disable()
+            _cprofile_lock.release()
+        else:
+            profiler.stop()
+        if elapsed_ms >= profiling_settings['min_ms']:
+            try:
+                os.makedirs(directory, exist_ok=True)
+                if mode == 'cprofile':
+                    profiler.dump_stats(path)
+                else:
+                    profiler.write(path)
+                _rotate(directory, profiling_settings['keep'])
+                logging.info(f"🔬 Profiled {name} ({elapsed_ms:.0f} ms) to {path}")
+            except OSError as e:
+                logging.warning(f"Could not write profile for {name}: {e}")
+
+
+def list_profiles(directory):
+    """Profile files in directory, newest first"""
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and FILE_PATTERN.match(entry.name):
+            st = entry.stat()
+            profiles.append({
+                'name': entry.name,
+                'mode': 'cprofile' if entry.name.endswith('.prof') else 'sample',
+                'size': st.st_size,
+                'created': datetime.fromtimestamp(st.st_mtime).strftime('%Y-%m-%d %H:%M:%S'),
+            })
+    return sorted(profiles, key=lambda p: p['name'], reverse=True)
+
+
+def summary(path, limit=40):
+    """Human-readable top functions of a profile file"""
+    if path.endswith('.prof'):
+        out = io.StringIO()
+        stats = pstats.Stats(path, stream=out)
+        stats.strip_dirs().sort_stats('cumulative').print_stats(limit)
+        return out.getvalue()
+
+    own, total, samples = Counter(), Counter(), 0
+    with open(path) as f:
+        for line in f:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            frames = stack.split(';')
+            count = int(count)
+            samples += count
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+    if not samples:
+        return '0 samples\n'
+    lines = [f"{samples} samples", '', f"{'self %':>8}{'total %':>9}  function"]
+    for frame, count in total.most_common(limit):
+        lines.append(f"{100 * own[frame] / samples:>8.1f}{100 * count / samples:>9.1f}  {frame}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,205 @@
+# ratelimit.py
+import contextvars
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+CYCLE = 'cycle'
+DASHBOARD = 'dashboard'
+
+# Dashboard lookups stop once the known budget falls to this share of the limit
+DASHBOARD_RESERVE = 0.2
+DASHBOARD_RESERVE_MIN = 10
+BACKOFF_INITIAL = 30
+BACKOFF_MAX = 1800
+# Consecutive server errors before the breaker opens; a 429 opens it straight away
+FAILURE_THRESHOLD = 3
+# A half-open trial request that never reported back frees the slot for another after this long
+PROBE_TIMEOUT = 60
+
+_priority = contextvars.ContextVar('guardian_priority', default=CYCLE)
+_lock = threading.Lock()
+_budgets = {}
+
+
+class RateLimited(Exception):
+    """Raised instead of sending a request the budget or circuit breaker does not allow"""
+    pass
+
+
+def current_priority():
+    return _priority.get()
+
+
+@contextmanager
+def priority(level):
+    """Run the enclosed registry traffic at CYCLE or DASHBOARD priority"""
+    token = _priority.set(level)
+    try:
+        yield level
+    finally:
+        _priority.reset(token)
+
+
+def _budget(key):
+    if key not in _budgets:
+        _budgets[key] = {
+            'key': key,
+            'limit': None,
+            'remaining': None,
+            'window': None,
+            'reset_at': None,
+            'source': None,
+            'updated': None,
+            'state': 'closed',
+            'failures': 0,
+            'open_until': 0,
+            'probe_started': None,
+            'last_error': None,
+            'sent': 0,
+            'denied': 0,
+        }
+    return _budgets[key]
+
+
+def _parse_limit(value):
+    # Docker Hub sends "100;w=21600": 100 requests per 21600 second window
+    match = re.match(r'\s*(\d+)(?:\s*;\s*w=(\d+))?', value or '')
+    if not match:
+        return None, None
+    return int(match.group(1)), int(match.group(2)) if match.group(2) else None
+
+
+def _reserve(budget):
+    if budget['limit']:
+        return max(DASHBOARD_RESERVE_MIN, int(budget['limit'] * DASHBOARD_RESERVE))
+    return DASHBOARD_RESERVE_MIN
+
+
+def acquire(key, cost=1):
+    """Account for a request against key's budget, raising RateLimited if it may not be sent now.
+
+    Once an open circuit's backoff ends, a single trial request is let
+    through; its outcome (record_response, record_success, record_failure or
+    release) decides whether the circuit closes again.
+    """
+    now = time.time()
+    with _lock:
+        budget = _budget(key)
+        if budget['state'] == 'open':
+            if now < budget['open_until']:
+                budget['denied'] += 1
+                raise RateLimited(f"{key}: circuit open for another {int(budget['open_until'] - now)}s "
+                                  f"({budget['last_error']})")
+            budget['state'] = 'half_open'
+        if budget['state'] == 'half_open' and budget['probe_started'] and \
+                now - budget['probe_started'] < PROBE_TIMEOUT:
+            budget['denied'] += 1
+            raise RateLimited(f"{key}: waiting for the trial request after {budget['last_error']}")
+
+        # Forget budgets older than their window (or the advertised reset time)
+        expired = (budget['reset_at'] and now >= budget['reset_at']) or \
+            (budget['window'] and budget['updated'] and now - budget['updated'] >= budget['window'])
+        if expired:
+            budget.update(remaining=None, reset_at=None)
+
+        if budget['remaining'] is not None:
+            if _priority.get() == DASHBOARD and budget['remaining'] - cost < _reserve(budget):
+                budget['denied'] += 1
+                raise RateLimited(f"{key}: {budget['remaining']} requests left, reserved for update cycles")
+            budget['remaining'] = max(0, budget['remaining'] - cost)
+        if budget['state'] == 'half_open':
+            budget['probe_started'] = now
+        budget['sent'] += 1
+
+
+def record_response(key, response):
+    """Update key's budget from rate-limit headers and trip the breaker on 429 or repeated 5xx"""
+    headers = response.headers
+    with _lock:
+        budget = _budget(key)
+        limit, window = _parse_limit(headers.get('RateLimit-Limit') or headers.get('X-RateLimit-Limit'))
+        remaining, remaining_window = _parse_limit(headers.get('RateLimit-Remaining') or
+                                                   headers.get('X-RateLimit-Remaining'))
+        if limit is not None:
+            budget['limit'] = limit
+        if remaining is not None:
+            budget['remaining'] = remaining
+            budget['window'] = window or remaining_window or budget['window']
+            budget['updated'] = time.time()
+        reset = headers.get('X-RateLimit-Reset')
+        if reset and reset.isdigit():
+            budget['reset_at'] = int(reset)
+        budget['source'] = headers.get('Docker-RateLimit-Source') or budget['source']
+
+        if response.status_code == 429 or response.status_code >= 500:
+            retry_after = headers.get('Retry-After')
+            _trip(budget, f"HTTP {response.status_code}",
+                  int(retry_after) if retry_after and retry_after.isdigit() else None,
+                  rate_limited=response.status_code == 429)
+        else:
+            budget.update(state='closed', failures=0, probe_started=None)
+
+
+def record_success(key):
+    """Close key's breaker after a request seen outside record_response (e.g. a pull) succeeded"""
+    with _lock:
+        _budget(key).update(state='closed', failures=0, probe_started=None)
+
+
+def record_failure(key, error, retry_after=None, rate_limited=False):
+    """Count a failure seen outside record_response (e.g. a pull); rate_limited trips the breaker at once"""
+    with _lock:
+        _trip(_budget(key), error, retry_after, rate_limited)
+
+
+def release(key):
+    """End a request that said nothing about the registry's health, freeing a half-open trial slot"""
+    with _lock:
+        _budget(key)['probe_started'] = None
+
+
+def _trip(budget, error, retry_after=None, rate_limited=False):
+    budget['failures'] += 1
+    budget.update(last_error=error, probe_started=None)
+    if rate_limited:
+        budget['remaining'] = 0
+        budget['updated'] = time.time()
+    elif budget['state'] != 'half_open' and budget['failures'] < FAILURE_THRESHOLD:
+        logging.info(f"⚠️ {budget['key']}: {error} ({budget['failures']}/{FAILURE_THRESHOLD} failures "
+                     f"before pausing requests)")
+        return
+    backoff = min(BACKOFF_MAX, BACKOFF_INITIAL * 2 ** max(0, budget['failures'] - FAILURE_THRESHOLD))
+    if retry_after:
+        backoff = max(backoff, retry_after)
+    budget.update(state='open', open_until=time.time() + backoff)
+    logging.warning(f"⛔ {budget['key']}: {error}; pausing requests for {backoff}s")
+
+
+def request(method, url, **kwargs):
+    """requests.request() with per-host budgeting and circuit breaking"""
+    import requests
+    key = urlparse(url).hostname
+    acquire(key)
+    try:
+        response = requests.request(method, url, **kwargs)
+    except requests.RequestException as e:
+        record_failure(key, f"{type(e).__name__}: {e}")
+        raise
+    record_response(key, response)
+    return response
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def status():
+    """Budget and breaker state per registry host"""
+    now = time.time()
+    with _lock:
+        return [dict(b, reserve=_reserve(b), retry_in=max(0, int(b['open_until'] - now)) if b['state'] == 'open' else 0)
+                for b in _budgets.values()]
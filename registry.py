@@ -0,0 +1,271 @@
+# registry.py
+import logging
+import platform
+
+import lru
+import ratelimit
+import singleflight
+import store
+
+DOCKER_HUB = 'docker.io'
+DOCKER_HUB_REGISTRY = 'registry-1.docker.io'
+
+MANIFEST_LIST_TYPES = (
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    'application/vnd.oci.image.index.v1+json',
+)
+MANIFEST_TYPES = (
+    'application/vnd.docker.distribution.manifest.v2+json',
+    'application/vnd.oci.image.manifest.v1+json',
+)
+
+# uname machine -> (architecture, variant) as used in manifest lists
+MACHINE_PLATFORMS = {
+    'x86_64': ('amd64', None),
+    'amd64': ('amd64', None),
+    'aarch64': ('arm64', 'v8'),
+    'arm64': ('arm64', 'v8'),
+    'armv7l': ('arm', 'v7'),
+    'armv6l': ('arm', 'v6'),
+    'i386': ('386', None),
+    'i686': ('386', None),
+}
+
+MANIFEST_CACHE_TTL = 300
+MANIFEST_CACHE_SIZE = 512
+TOKEN_CACHE_SIZE = 256
+
+# Expired tokens are refreshed on the registry's 401, so only the count needs a bound
+_tokens = lru.cache('registry_tokens', TOKEN_CACHE_SIZE)
+_manifest_cache = lru.cache('manifests', MANIFEST_CACHE_SIZE, MANIFEST_CACHE_TTL)
+# Platform manifests by the tag's top-level digest; content-addressed, so they never go stale
+_resolved = lru.cache('resolved_manifests', MANIFEST_CACHE_SIZE)
+
+
+def parse_image_ref(image):
+    """Split an image reference into (registry, repository, tag)"""
+    ref = image
+    digest = None
+    if '@' in ref:
+        ref, digest = ref.split('@', 1)
+
+    parts = ref.split('/')
+    if len(parts) > 1 and ('.' in parts[0] or ':' in parts[0] or parts[0] == 'localhost'):
+        registry = parts[0]
+        remainder = '/'.join(parts[1:])
+    else:
+        registry = DOCKER_HUB
+        remainder = ref
+
+    tag = 'latest'
+    last = remainder.rsplit('/', 1)[-1]
+    if ':' in last:
+        remainder, tag = remainder.rsplit(':', 1)
+
+    if registry == DOCKER_HUB and '/' not in remainder:
+        remainder = f"library/{remainder}"
+
+    return registry, remainder, digest or tag
+
+
+def get_host_platform(override=None):
+    """Return the host platform as {'os', 'architecture', 'variant'}"""
+    if override:
+        parts = override.strip('/').split('/')
+        return {
+            'os': parts[0] if len(parts) > 0 else 'linux',
+            'architecture': parts[1] if len(parts) > 1 else 'amd64',
+            'variant': parts[2] if len(parts) > 2 else None,
+        }
+    arch, variant = MACHINE_PLATFORMS.get(platform.machine().lower(), (platform.machine().lower(), None))
+    return {'os': 'linux', 'architecture': arch, 'variant': variant}
+
+
+def platform_string(plat):
+    """Format a platform dict as os/arch[/variant]"""
+    parts = [plat.get('os', 'linux'), plat.get('architecture', '')]
+    if plat.get('variant'):
+        parts.append(plat['variant'])
+    return '/'.join(parts)
+
+
+def matches_platform(candidate, plat):
+    """Check whether a manifest list platform entry matches the host platform"""
+    if candidate.get('os', 'linux') != plat.get('os', 'linux'):
+        return False
+    if candidate.get('architecture') != plat.get('architecture'):
+        return False
+    # arm64 images frequently omit the v8 variant, so only enforce variants for 32-bit arm
+    if plat.get('architecture') == 'arm' and plat.get('variant'):
+        return candidate.get('variant') in (None, plat['variant'])
+    return True
+
+
+def _registry_host(registry):
+    return DOCKER_HUB_REGISTRY if registry == DOCKER_HUB else registry
+
+
+def image_registry_host(image):
+    """Host that serves an image's manifests and blobs"""
+    return _registry_host(parse_image_ref(image)[0])
+
+
+def _fetch_token(challenge, repository):
+    """Request a bearer token for the realm advertised in a 401 challenge"""
+    params = {}
+    for item in challenge[len('Bearer '):].split(','):
+        if '=' in item:
+            key, value = item.split('=', 1)
+            params[key.strip()] = value.strip().strip('"')
+    realm = params.pop('realm', None)
+    if not realm:
+        return None
+    params.setdefault('scope', f"repository:{repository}:pull")
+    response = ratelimit.get(realm, params=params, timeout=10)
+    if response.status_code != 200:
+        return None
+    data = response.json()
+    return data.get('token') or data.get('access_token')
+
+
+def _registry_get(registry, repository, path, accept, method='GET'):
+    """GET a registry v2 path, negotiating an anonymous bearer token if required"""
+    url = f"https://{_registry_host(registry)}/v2/{repository}/{path}"
+    headers = {'Accept': ', '.join(accept)}
+    token = _tokens.get((registry, repository))
+    if token:
+        headers['Authorization'] = f"Bearer {token}"
+
+    response = ratelimit.request(method, url, headers=headers, timeout=10)
+    challenge = response.headers.get('WWW-Authenticate', '')
+    if response.status_code == 401 and challenge.startswith('Bearer '):
+        token = _fetch_token(challenge, repository)
+        if not token:
+            return response
+        _tokens.put((registry, repository), token)
+        headers['Authorization'] = f"Bearer {token}"
+        response = ratelimit.request(method, url, headers=headers, timeout=10)
+    return response
+
+
+def resolve_platform_manifest(image, plat=None):
+    """Resolve the manifest of an image for the given platform.
+
+    Returns a dict with the platform-specific manifest digest, its config
+    digest (the image ID once pulled), the manifest list digest and the
+    layer list, or None when the registry could not be queried.
+    """
+    plat = plat or get_host_platform()
+    key = (image, platform_string(plat))
+    cached = _manifest_cache.get(key)
+    if cached:
+        return cached
+    # Concurrent lookups of one image share a request; dashboard lookups never stand in for the
+    # cycle's, since they may be refused when the rate-limit budget runs low
+    return singleflight.group('manifest').do((key, ratelimit.current_priority()),
+                                             lambda: _fetch_platform_manifest(image, plat, key))
+
+
+def _head_digest(registry, repository, reference):
+    """Return the digest a tag points at without downloading its manifest, or None"""
+    if reference.startswith('sha256:'):
+        return reference
+    # Docker Hub counts manifest GETs against the pull quota but not HEADs
+    response = _registry_get(registry, repository, f"manifests/{reference}",
+                             MANIFEST_LIST_TYPES + MANIFEST_TYPES, method='HEAD')
+    if response.status_code != 200:
+        return None
+    return response.headers.get('Docker-Content-Digest')
+
+
+def _lookup_resolved(top_digest, plat_str):
+    resolved = _resolved.get((top_digest, plat_str))
+    if resolved is None:
+        try:
+            resolved = store.get_resolved_manifest(top_digest, plat_str)
+        except Exception as e:
+            logging.debug(f"Could not read resolved manifest {top_digest}: {e}")
+        if resolved is not None:
+            _resolved.put((top_digest, plat_str), resolved)
+    return resolved
+
+
+def _remember_resolved(top_digest, plat_str, result):
+    resolved = {k: v for k, v in result.items() if k != 'image'}
+    _resolved.put((top_digest, plat_str), resolved)
+    try:
+        store.save_resolved_manifest(top_digest, plat_str, resolved)
+    except Exception as e:
+        logging.debug(f"Could not save resolved manifest {top_digest}: {e}")
+
+
+def _fetch_platform_manifest(image, plat, key):
+    registry, repository, reference = parse_image_ref(image)
+    plat_str = platform_string(plat)
+    try:
+        # Only download the manifests when the tag has moved to a digest not resolved before
+        top_digest = _head_digest(registry, repository, reference)
+        resolved = _lookup_resolved(top_digest, plat_str) if top_digest else None
+        if resolved is not None:
+            result = dict(resolved, image=image)
+            _manifest_cache.put(key, result)
+            return result
+
+        response = _registry_get(registry, repository, f"manifests/{reference}",
+                                 MANIFEST_LIST_TYPES + MANIFEST_TYPES)
+        if response.status_code != 200:
+            logging.debug(f"Manifest lookup for {image} returned HTTP {response.status_code}")
+            return None
+
+        manifest = response.json()
+        media_type = manifest.get('mediaType') or response.headers.get('Content-Type', '')
+        list_digest = response.headers.get('Docker-Content-Digest')
+        digest = list_digest
+
+        if media_type in MANIFEST_LIST_TYPES or 'manifests' in manifest:
+            entry = next((m for m in manifest.get('manifests', [])
+                          if matches_platform(m.get('platform', {}), plat)), None)
+            if entry is None:
+                logging.warning(f"{image} has no manifest for {plat_str}")
+                return None
+            digest = entry['digest']
+            response = _registry_get(registry, repository, f"manifests/{digest}", MANIFEST_TYPES)
+            if response.status_code != 200:
+                return None
+            manifest = response.json()
+
+        result = {
+            'image': image,
+            'platform': plat_str,
+            'digest': digest,
+            'list_digest': list_digest,
+            'config_digest': manifest.get('config', {}).get('digest'),
+            'layers': [{'digest': layer.get('digest'), 'size': layer.get('size', 0)}
+                       for layer in manifest.get('layers', [])],
+        }
+        _manifest_cache.put(key, result)
+        if list_digest:
+            _remember_resolved(list_digest, plat_str, result)
+        return result
+    except Exception as e:
+        logging.debug(f"Manifest lookup failed for {image}: {e}")
+        return None
+
+
+def forget_manifest(image):
+    """Drop cached manifests for an image, e.g. after the registry reports a push"""
+    _manifest_cache.discard_where(lambda key: key[0] == image)
+
+
+def image_matches_remote(remote, image_id, repo_digests=()):
+    """Check whether a local image is the same as the remote platform manifest"""
+    if not remote or not image_id:
+        return False
+    known = {remote.get('config_digest'), remote.get('digest'), remote.get('list_digest')}
+    known.discard(None)
+    if image_id in known:
+        return True
+    for repo_digest in repo_digests or ():
+        if repo_digest.split('@', 1)[-1] in known:
+            return True
+    return False
@@ -0,0 +1,78 @@
+# singleflight.py
+import threading
+from collections import Counter
+
+_groups = {}
+_groups_lock = threading.Lock()
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Group:
+    """Collapse concurrent calls with the same key into one execution.
+
+    The first caller runs fn(); callers arriving while it is in flight wait
+    and receive the same result (or exception). Nothing is cached once the
+    call completes.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.stats = Counter()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.stats['executed'] += 1
+            else:
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
+def group(name):
+    """Return the named group, creating it on first use"""
+    with _groups_lock:
+        if name not in _groups:
+            _groups[name] = Group(name)
+        return _groups[name]
+
+
+def stats():
+    """Executed/coalesced counters for every group"""
+    with _groups_lock:
+        groups = list(_groups.values())
+    return {g.name: {'executed': g.stats['executed'], 'coalesced': g.stats['coalesced'],
+                     'in_flight': g.in_flight()} for g in groups}
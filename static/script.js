@@ -9,6 +9,7 @@ class Guardian {
     init() {
         this.setupNavigation();
         this.loadContainers();
+        this.loadRateLimits();
         this.setupEventListeners();
         this.startPolling();
         this.updateStats();
@@ -144,20 +145,44 @@ class Guardian {
                 body: JSON.stringify({ name: name, target_tag: targetTag })
             });
 
-            if (response.ok) {
-                this.showNotification(`Successfully updated ${name} to ${targetTag}`, 'success');
-                // Reload containers to show updated information
-                setTimeout(() => this.loadContainers(), 2000);
-            } else {
-                const error = await response.json();
-                throw new Error(error.message || 'Update failed');
+            const data = await response.json();
+            if (!response.ok || !data.job_id) {
+                throw new Error(data.message || 'Update failed');
             }
+
+            const job = await this.waitForJob(data.job_id);
+            if (job.status !== 'succeeded') {
+                throw new Error(job.message || 'Update failed');
+            }
+            this.showNotification(`Successfully updated ${name} to ${targetTag}`, 'success');
+            // Reload containers to show updated information
+            this.loadContainers();
         } catch (error) {
             console.error('Failed to update container:', error);
             this.showNotification(`Failed to update ${name}: ${error.message}`, 'error');
         }
     }
 
+    async waitForJob(jobId) {
+        // Poll the job until it finishes, surfacing phase changes
+        let lastPhase = null;
+        while (true) {
+            const response = await fetch(`/jobs/${jobId}`);
+            const job = await response.json();
+            if (!response.ok) {
+                throw new Error(job.message || 'Job not found');
+            }
+            if (job.phase !== lastPhase) {
+                lastPhase = job.phase;
+                this.showNotification(`Job ${jobId}: ${job.phase}`, 'info');
+            }
+            if (job.status === 'succeeded' || job.status === 'failed') {
+                return job;
+            }
+            await new Promise(resolve => setTimeout(resolve, 2000));
+        }
+    }
+
     editVersion(name, currentImage) {
         const currentTag = currentImage.split(':')[1] || 'latest';
         const newVersion = prompt(`Edit version for ${name}:\n\nCurrent: ${currentTag}\n\nEnter new version (e.g., v1.1.1):`, currentTag);
@@ -318,9 +343,13 @@ class Guardian {
     async runUpdate() {
         try {
             const response = await fetch('/run-now', { method: 'POST' });
-            if (response.ok) {
-                this.showNotification('Update started', 'success');
+            const data = await response.json();
+            if (response.ok && data.job_id) {
+                this.showNotification(data.coalesced ? 'Update already running' : 'Update started', 'success');
                 this.loadLogs();
+                const job = await this.waitForJob(data.job_id);
+                this.showNotification(`Update ${job.status}`, job.status === 'succeeded' ? 'success' : 'error');
+                this.loadContainers();
             }
         } catch (error) {
             this.showNotification('Failed to start update', 'error');
@@ -369,6 +398,30 @@ class Guardian {
         }
     }
 
+    async loadRateLimits() {
+        try {
+            const response = await fetch('/ratelimit');
+            const data = await response.json();
+            const valueEl = document.getElementById('registry-budget');
+            const labelEl = document.getElementById('registry-budget-label');
+            if (!valueEl || !data.budgets || !data.budgets.length) return;
+
+            // Show the most constrained registry: an open breaker first, then the lowest budget
+            const budget = data.budgets.slice().sort((a, b) =>
+                (b.retry_in - a.retry_in) || ((a.remaining ?? Infinity) - (b.remaining ?? Infinity)))[0];
+            if (budget.retry_in > 0) {
+                valueEl.textContent = `Paused ${budget.retry_in}s`;
+            } else if (budget.remaining !== null) {
+                valueEl.textContent = budget.limit ? `${budget.remaining}/${budget.limit}` : `${budget.remaining}`;
+            } else {
+                valueEl.textContent = 'OK';
+            }
+            labelEl.textContent = `Registry Budget (${budget.key})`;
+        } catch (error) {
+            console.error('Failed to load registry budget:', error);
+        }
+    }
+
     updateStats() {
         document.getElementById('total-containers').textContent = this.containers.length;
         document.getElementById('monitored-containers').textContent = this.selectedContainers.size;
@@ -387,8 +440,9 @@ class Guardian {
         // Refresh logs every 5 seconds
         setInterval(() => this.loadLogs(), 5000);
         
-        // Refresh containers every 30 seconds
+        // Refresh containers and the registry budget every 30 seconds
         setInterval(() => this.loadContainers(), 30000);
+        setInterval(() => this.loadRateLimits(), 30000);
     }
 }
 
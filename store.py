@@ -0,0 +1,463 @@
+# store.py
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import zlib
+from datetime import datetime
+
+DB_PATH = 'state/guardian.db'
+STATE_DIR = 'state'
+VERSION_OVERRIDES_PATH = 'version_overrides.json'
+
+# Snapshot configs are stored once per distinct content: generations of every
+# container point at a blob keyed by the SHA-256 of the canonical JSON
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshot_blobs (
+    hash TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS snapshot_generations (
+    container TEXT NOT NULL,
+    generation INTEGER NOT NULL,
+    image TEXT,
+    image_id TEXT,
+    config_hash TEXT NOT NULL REFERENCES snapshot_blobs (hash),
+    created TEXT NOT NULL,
+    PRIMARY KEY (container, generation)
+);
+CREATE INDEX IF NOT EXISTS idx_snapshot_generations_hash ON snapshot_generations (config_hash);
+CREATE TABLE IF NOT EXISTS image_digests (
+    image TEXT NOT NULL,
+    platform TEXT NOT NULL,
+    digest TEXT,
+    config_digest TEXT,
+    checked TEXT NOT NULL,
+    PRIMARY KEY (image, platform)
+);
+CREATE TABLE IF NOT EXISTS resolved_manifests (
+    digest TEXT NOT NULL,
+    platform TEXT NOT NULL,
+    manifest TEXT NOT NULL,
+    resolved TEXT NOT NULL,
+    PRIMARY KEY (digest, platform)
+);
+CREATE TABLE IF NOT EXISTS updates (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    container TEXT NOT NULL,
+    image TEXT,
+    started TEXT NOT NULL,
+    finished TEXT,
+    status TEXT NOT NULL,
+    message TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_updates_container ON updates (container, started);
+CREATE INDEX IF NOT EXISTS idx_updates_started ON updates (started);
+CREATE TABLE IF NOT EXISTS check_schedule (
+    container TEXT PRIMARY KEY,
+    image TEXT NOT NULL,
+    digest TEXT,
+    interval INTEGER NOT NULL,
+    unchanged_checks INTEGER NOT NULL DEFAULT 0,
+    last_checked TEXT NOT NULL,
+    last_changed TEXT,
+    next_check TEXT NOT NULL,
+    reason TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_check_schedule_checked ON check_schedule (last_checked);
+CREATE TABLE IF NOT EXISTS journal (
+    container TEXT PRIMARY KEY,
+    host TEXT NOT NULL,
+    name TEXT NOT NULL,
+    image TEXT,
+    image_id TEXT,
+    remote_digest TEXT,
+    generation INTEGER,
+    update_id INTEGER,
+    phase TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    started TEXT NOT NULL,
+    updated TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cleanups (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    host TEXT NOT NULL,
+    reason TEXT,
+    ran TEXT NOT NULL,
+    free_before INTEGER,
+    free_after INTEGER,
+    reclaimed_bytes INTEGER NOT NULL,
+    details TEXT
+);
+CREATE TABLE IF NOT EXISTS load_decisions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    host TEXT NOT NULL,
+    decided TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    level TEXT NOT NULL,
+    action TEXT NOT NULL,
+    workers INTEGER,
+    waited INTEGER NOT NULL DEFAULT 0,
+    containers TEXT,
+    reasons TEXT,
+    sample TEXT
+);
+CREATE TABLE IF NOT EXISTS version_overrides (
+    container TEXT PRIMARY KEY,
+    version TEXT NOT NULL
+);
+"""
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = False
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def get_db():
+    """Return this thread's connection, creating the schema on first use"""
+    global _initialized
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        os.makedirs(os.path.dirname(DB_PATH) or '.', exist_ok=True)
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        _local.conn = conn
+    if not _initialized:
+        with _init_lock:
+            if not _initialized:
+                conn.executescript(SCHEMA)
+                _migrate_snapshot_table(conn)
+                _migrate_legacy_files(conn)
+                _initialized = True
+    return conn
+
+
+def _migrate_snapshot_table(conn):
+    """Move snapshots stored as full JSON per generation into the content-addressed tables"""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'snapshots'").fetchone() is None:
+        return
+    with conn:
+        rows = conn.execute('SELECT container, generation, image, image_id, config, created FROM snapshots').fetchall()
+        for row in rows:
+            conn.execute('INSERT OR IGNORE INTO snapshot_generations '
+                         '(container, generation, image, image_id, config_hash, created) VALUES (?, ?, ?, ?, ?, ?)',
+                         (row['container'], row['generation'], row['image'], row['image_id'],
+                          _put_blob(conn, json.loads(row['config'])), row['created']))
+        conn.execute('DROP TABLE snapshots')
+    logging.info(f"Moved {len(rows)} snapshot(s) to the content-addressed store")
+
+
+def _migrate_legacy_files(conn):
+    """Import state/<name>.json backups and version_overrides.json once"""
+    if conn.execute('SELECT 1 FROM snapshot_generations LIMIT 1').fetchone() is None and os.path.isdir(STATE_DIR):
+        for filename in sorted(os.listdir(STATE_DIR)):
+            if not filename.endswith('.json') or filename == 'pulls.json':
+                continue
+            try:
+                with open(os.path.join(STATE_DIR, filename), 'r') as f:
+                    config = json.load(f)
+                if not isinstance(config, dict) or 'Image' not in config:
+                    continue
+                conn.execute('INSERT INTO snapshot_generations (container, generation, image, config_hash, created) '
+                             'VALUES (?, 1, ?, ?, ?)',
+                             (filename[:-len('.json')], config.get('Image'), _put_blob(conn, config), _now()))
+            except Exception as e:
+                logging.warning(f"Could not import legacy backup {filename}: {e}")
+
+    if conn.execute('SELECT 1 FROM version_overrides LIMIT 1').fetchone() is None \
+            and os.path.exists(VERSION_OVERRIDES_PATH):
+        try:
+            with open(VERSION_OVERRIDES_PATH, 'r') as f:
+                overrides = json.load(f)
+            conn.executemany('INSERT OR REPLACE INTO version_overrides (container, version) VALUES (?, ?)',
+                             list(overrides.items()))
+        except Exception as e:
+            logging.warning(f"Could not import version overrides: {e}")
+    conn.commit()
+
+
+# Container snapshots
+
+def _canonical(config):
+    return json.dumps(config, sort_keys=True, separators=(',', ':')).encode()
+
+
+def _put_blob(conn, config):
+    """Store a config once under the hash of its canonical JSON; returns the hash"""
+    data = _canonical(config)
+    digest = hashlib.sha256(data).hexdigest()
+    if conn.execute('SELECT 1 FROM snapshot_blobs WHERE hash = ?', (digest,)).fetchone() is None:
+        conn.execute('INSERT INTO snapshot_blobs (hash, data, size, created) VALUES (?, ?, ?, ?)',
+                     (digest, zlib.compress(data), len(data), _now()))
+    return digest
+
+
+def save_snapshot(container, config, image_id=None, keep=10):
+    """Point a new generation of a container at its config and prune old ones; returns the generation.
+
+    When neither the config nor the image changed since the latest generation,
+    that generation is returned as is and nothing is written.
+    """
+    conn = get_db()
+    digest = hashlib.sha256(_canonical(config)).hexdigest()
+    latest = conn.execute('SELECT generation, config_hash, image_id FROM snapshot_generations WHERE container = ? '
+                          'ORDER BY generation DESC LIMIT 1', (container,)).fetchone()
+    if latest and latest['config_hash'] == digest and latest['image_id'] == image_id:
+        return latest['generation']
+    with conn:
+        _put_blob(conn, config)
+        generation = (latest['generation'] if latest else 0) + 1
+        conn.execute('INSERT INTO snapshot_generations (container, generation, image, image_id, config_hash, created) '
+                     'VALUES (?, ?, ?, ?, ?, ?)', (container, generation, config.get('Image'), image_id, digest, _now()))
+        if keep:
+            pruned = [r[0] for r in conn.execute('SELECT DISTINCT config_hash FROM snapshot_generations '
+                                                 'WHERE container = ? AND generation <= ?',
+                                                 (container, generation - keep))]
+            conn.execute('DELETE FROM snapshot_generations WHERE container = ? AND generation <= ?',
+                         (container, generation - keep))
+            # Drop the pruned blobs no generation of any container points at any more
+            conn.executemany('DELETE FROM snapshot_blobs WHERE hash = ? AND NOT EXISTS '
+                             '(SELECT 1 FROM snapshot_generations WHERE config_hash = ?)',
+                             [(h, h) for h in pruned])
+    return generation
+
+
+def get_snapshot(container, generation=None):
+    """Return a snapshot (latest by default) with its config decoded, or None"""
+    conn = get_db()
+    query = ('SELECT g.*, b.data FROM snapshot_generations g JOIN snapshot_blobs b ON b.hash = g.config_hash '
+             'WHERE g.container = ?')
+    if generation is None:
+        row = conn.execute(query + ' ORDER BY g.generation DESC LIMIT 1', (container,)).fetchone()
+    else:
+        row = conn.execute(query + ' AND g.generation = ?', (container, generation)).fetchone()
+    if row is None:
+        return None
+    snapshot = dict(row)
+    snapshot['config'] = json.loads(zlib.decompress(snapshot.pop('data')))
+    return snapshot
+
+
+def list_snapshots(container):
+    conn = get_db()
+    rows = conn.execute(
+        'SELECT g.container, g.generation, g.image, g.image_id, g.config_hash, b.size, g.created '
+        'FROM snapshot_generations g JOIN snapshot_blobs b ON b.hash = g.config_hash '
+        'WHERE g.container = ? ORDER BY g.generation DESC', (container,)).fetchall()
+    return [dict(r) for r in rows]
+
+
+def snapshot_stats():
+    """Generations, distinct configs and their raw vs stored size"""
+    conn = get_db()
+    generations = conn.execute('SELECT COUNT(*), COUNT(DISTINCT container) FROM snapshot_generations').fetchone()
+    blobs = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(LENGTH(data)), 0) '
+                         'FROM snapshot_blobs').fetchone()
+    logical = conn.execute('SELECT COALESCE(SUM(b.size), 0) FROM snapshot_generations g '
+                           'JOIN snapshot_blobs b ON b.hash = g.config_hash').fetchone()[0]
+    return {'containers': generations[1], 'generations': generations[0], 'blobs': blobs[0],
+            'config_bytes': logical, 'unique_bytes': blobs[1], 'stored_bytes': blobs[2]}
+
+
+# Image digests
+
+def record_digest(image, platform, digest, config_digest=None):
+    conn = get_db()
+    with conn:
+        conn.execute('INSERT OR REPLACE INTO image_digests (image, platform, digest, config_digest, checked) '
+                     'VALUES (?, ?, ?, ?, ?)', (image, platform, digest, config_digest, _now()))
+
+
+def get_digest(image, platform):
+    row = get_db().execute('SELECT * FROM image_digests WHERE image = ? AND platform = ?',
+                           (image, platform)).fetchone()
+    return dict(row) if row else None
+
+
+def save_resolved_manifest(digest, platform, manifest):
+    """Remember the platform manifest a tag's top-level digest resolved to; digests never change"""
+    conn = get_db()
+    with conn:
+        conn.execute('INSERT OR REPLACE INTO resolved_manifests (digest, platform, manifest, resolved) '
+                     'VALUES (?, ?, ?, ?)', (digest, platform, json.dumps(manifest), _now()))
+        conn.execute('DELETE FROM resolved_manifests WHERE rowid <= '
+                     '(SELECT MAX(rowid) FROM resolved_manifests) - 500')
+
+
+def get_resolved_manifest(digest, platform):
+    row = get_db().execute('SELECT manifest FROM resolved_manifests WHERE digest = ? AND platform = ?',
+                           (digest, platform)).fetchone()
+    return json.loads(row['manifest']) if row else None
+
+
+# Adaptive check schedule
+
+def get_check_schedule(container):
+    row = get_db().execute('SELECT * FROM check_schedule WHERE container = ?', (container,)).fetchone()
+    return dict(row) if row else None
+
+
+def save_check_schedule(container, image, digest, interval, unchanged_checks, last_changed, next_check, reason):
+    conn = get_db()
+    with conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO check_schedule (container, image, digest, interval, unchanged_checks, '
+            'last_checked, last_changed, next_check, reason) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (container, image, digest, interval, unchanged_checks, _now(), last_changed, next_check, reason))
+
+
+def last_check():
+    """When any container's image was last checked, or None before the first check"""
+    return get_db().execute('SELECT MAX(last_checked) FROM check_schedule').fetchone()[0]
+
+
+def list_check_schedules():
+    rows = get_db().execute('SELECT * FROM check_schedule ORDER BY next_check').fetchall()
+    return [dict(r) for r in rows]
+
+
+# Update history
+
+def record_update_start(container, image, status='started'):
+    conn = get_db()
+    with conn:
+        cursor = conn.execute('INSERT INTO updates (container, image, started, status) VALUES (?, ?, ?, ?)',
+                              (container, image, _now(), status))
+    return cursor.lastrowid
+
+
+def record_update_result(update_id, status, message=''):
+    conn = get_db()
+    with conn:
+        conn.execute('UPDATE updates SET finished = ?, status = ?, message = ? WHERE id = ?',
+                     (_now(), status, message, update_id))
+
+
+def list_updates(container=None, limit=50):
+    conn = get_db()
+    if container:
+        rows = conn.execute('SELECT * FROM updates WHERE container = ? ORDER BY started DESC, id DESC LIMIT ?',
+                            (container, limit)).fetchall()
+    else:
+        rows = conn.execute('SELECT * FROM updates ORDER BY started DESC, id DESC LIMIT ?', (limit,)).fetchall()
+    return [dict(r) for r in rows]
+
+
+# Update journal (write-ahead record of in-flight per-container phases)
+
+JOURNAL_FIELDS = ('host', 'name', 'image', 'image_id', 'remote_digest', 'generation', 'update_id', 'owner')
+
+
+def journal_write(container, phase, **fields):
+    """Record the phase a container's update is entering; fields not given keep their values"""
+    unknown = set(fields) - set(JOURNAL_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown journal fields: {', '.join(sorted(unknown))}")
+    now = _now()
+    columns = ['container', 'phase', 'started', 'updated'] + list(fields)
+    updates = ', '.join(['phase = excluded.phase', 'updated = excluded.updated'] +
+                        [f"{f} = excluded.{f}" for f in fields])
+    conn = get_db()
+    with conn:
+        conn.execute(f"INSERT INTO journal ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+                     f"ON CONFLICT(container) DO UPDATE SET {updates}",
+                     [container, phase, now, now] + list(fields.values()))
+
+
+def journal_get(container):
+    row = get_db().execute('SELECT * FROM journal WHERE container = ?', (container,)).fetchone()
+    return dict(row) if row else None
+
+
+def journal_claim(container, owner, new_owner):
+    """Hand an entry from owner to new_owner; False when another process changed its owner first"""
+    conn = get_db()
+    with conn:
+        cursor = conn.execute('UPDATE journal SET owner = ?, updated = ? WHERE container = ? AND owner = ?',
+                              (new_owner, _now(), container, owner))
+    return cursor.rowcount == 1
+
+
+def journal_list():
+    return [dict(r) for r in get_db().execute('SELECT * FROM journal ORDER BY started').fetchall()]
+
+
+def journal_clear(container):
+    conn = get_db()
+    with conn:
+        conn.execute('DELETE FROM journal WHERE container = ?', (container,))
+
+
+# Cleanup runs
+
+def record_cleanup(host, reason, reclaimed, free_before=None, free_after=None):
+    conn = get_db()
+    with conn:
+        conn.execute('INSERT INTO cleanups (host, reason, ran, free_before, free_after, reclaimed_bytes, details) '
+                     'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                     (host, reason, _now(), free_before, free_after, sum(reclaimed.values()), json.dumps(reclaimed)))
+        conn.execute('DELETE FROM cleanups WHERE id <= (SELECT MAX(id) FROM cleanups) - 500')
+
+
+def list_cleanups(host=None, limit=20):
+    conn = get_db()
+    if host:
+        rows = conn.execute('SELECT * FROM cleanups WHERE host = ? ORDER BY id DESC LIMIT ?', (host, limit)).fetchall()
+    else:
+        rows = conn.execute('SELECT * FROM cleanups ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+    return [dict(r, details=json.loads(r['details'] or '{}')) for r in rows]
+
+
+# Host load throttling decisions
+
+def record_load_decision(host, phase, level, action, workers=None, waited=0, containers=(), reasons=(), sample=None):
+    conn = get_db()
+    with conn:
+        conn.execute('INSERT INTO load_decisions (host, decided, phase, level, action, workers, waited, containers, '
+                     'reasons, sample) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                     (host, _now(), phase, level, action, workers, waited, json.dumps(list(containers)),
+                      json.dumps(list(reasons)), json.dumps(sample) if sample else None))
+        conn.execute('DELETE FROM load_decisions WHERE id <= (SELECT MAX(id) FROM load_decisions) - 500')
+
+
+def list_load_decisions(host=None, limit=20):
+    conn = get_db()
+    if host:
+        rows = conn.execute('SELECT * FROM load_decisions WHERE host = ? ORDER BY id DESC LIMIT ?',
+                            (host, limit)).fetchall()
+    else:
+        rows = conn.execute('SELECT * FROM load_decisions ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+    return [dict(r, containers=json.loads(r['containers'] or '[]'), reasons=json.loads(r['reasons'] or '[]'),
+                 sample=json.loads(r['sample']) if r['sample'] else None) for r in rows]
+
+
+def load_decision_counts(since):
+    """Decisions per (host, action) since a '%Y-%m-%d %H:%M:%S' timestamp, with deferred containers and wait time"""
+    rows = get_db().execute('SELECT host, action, COUNT(*) AS decisions, SUM(json_array_length(containers)) AS containers, '
+                            'SUM(waited) AS waited FROM load_decisions WHERE decided >= ? GROUP BY host, action',
+                            (since,)).fetchall()
+    return [dict(r) for r in rows]
+
+
+# Version overrides
+
+def get_version_overrides():
+    rows = get_db().execute('SELECT container, version FROM version_overrides').fetchall()
+    return {r['container']: r['version'] for r in rows}
+
+
+def set_version_override(container, version):
+    conn = get_db()
+    with conn:
+        conn.execute('INSERT OR REPLACE INTO version_overrides (container, version) VALUES (?, ?)',
+                     (container, version))
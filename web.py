@@ -1,34 +1,72 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, jsonify, request, Response, g, send_from_directory
+import gzip
+import hashlib
 import subprocess
 import json
+import logging
 import os
-import requests
 import re
+import signal
+import sys
+from collections import deque
 from datetime import datetime
+import time
+import discovery
+import disk
 import docker
+import fleet
+import hostload
+import jobs
+import lru
+import models
+import profiling
+import ratelimit
+try:
+    import brotli
+except ImportError:
+    brotli = None
+import registry
+import singleflight
+import store
+import webhooks
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 
 CONFIG_PATH = 'config.json'
-VERSION_OVERRIDES_PATH = 'version_overrides.json'
+PULL_PROGRESS_PATH = 'state/pulls.json'
+HUB_TAGS_CACHE_TTL = 300
+HUB_TAGS_CACHE_SIZE = 256
+COMPRESSED_CACHE_SIZE = 64
+CONTAINERS_CACHE_TTL = 15
+PLAN_CACHE_TTL = 120
+DOCKER_PROBE_TTL = 30
+DISK_CACHE_TTL = 60
+COMPRESS_MIN_SIZE = 1024
+STATIC_MAX_AGE = 31536000
+LOG_FILES = [('guardian', 'logs/guardian.log', 50), ('cron', 'logs/cron.log', 20)]
+
+# JSON snapshots served with ETags, rebuilt only when their key changes
+_snapshots = {}
+_compressed = lru.cache('compressed', COMPRESSED_CACHE_SIZE)
+_asset_hashes = {}
+
+# Docker Hub tag listings shared by every container and host
+_hub_tags_cache = lru.cache('hub_tags', HUB_TAGS_CACHE_SIZE, HUB_TAGS_CACHE_TTL)
 
 # Load version overrides
 def load_version_overrides():
     try:
-        if os.path.exists(VERSION_OVERRIDES_PATH):
-            with open(VERSION_OVERRIDES_PATH, 'r') as f:
-                return json.load(f)
+        return store.get_version_overrides()
     except Exception as e:
         print(f"Error loading version overrides: {e}")
     return {}
 
-# Save version overrides
-def save_version_overrides(overrides):
+# Save a version override
+def save_version_override(container_name, version):
     try:
-        with open(VERSION_OVERRIDES_PATH, 'w') as f:
-            json.dump(overrides, f, indent=2)
+        store.set_version_override(container_name, version)
     except Exception as e:
-        print(f"Error saving version overrides: {e}")
+        print(f"Error saving version override: {e}")
 
 # Initialize Docker client with multiple fallback methods
 docker_client = None
@@ -54,8 +92,15 @@ for method_info in docker_methods:
 if docker_client is None:
     print("All Docker client initialization methods failed. Using subprocess fallback.")
 
-def get_actual_image_tag(image_name):
-    """Get the actual image tag from image name, handling 'latest' tag resolution and version overrides"""
+def get_docker_client():
+    """Docker client for the host being queried (the local client outside fleet mode)"""
+    return fleet.get_host_client(fleet.current_host()) or docker_client
+
+def get_actual_image_tag(image_name, images_by_tag=None):
+    """Get the actual image tag from image name, handling 'latest' tag resolution and version overrides.
+
+    images_by_tag (from _image_index) saves an image lookup per container.
+    """
     try:
         # Check for version overrides first
         overrides = load_version_overrides()
@@ -71,11 +116,12 @@ def get_actual_image_tag(image_name):
             return image_name
         
         # For 'latest' tag, get the actual image ID and find the corresponding tag
-        if docker_client:
+        client = get_docker_client()
+        if client:
             try:
-                image = docker_client.images.get(image_name)
+                image = images_by_tag.get(image_name) if images_by_tag is not None else client.images.get(image_name)
                 # Get all tags for this image
-                if image.tags:
+                if image is not None and image.tags:
                     # Find the most specific tag (not 'latest')
                     for tag in image.tags:
                         if not tag.endswith(':latest'):
@@ -85,7 +131,9 @@ def get_actual_image_tag(image_name):
             except:
                 pass
         
-        # Fallback: Use subprocess to get actual image info
+        # Fallback: Use subprocess to get actual image info (local daemon only)
+        if fleet.is_remote(fleet.current_host()):
+            return image_name
         try:
             result = subprocess.run(['docker', 'images', '--format', '{{.Repository}}:{{.Tag}}\t{{.ID}}'], 
                                   capture_output=True, text=True, timeout=5)
@@ -105,6 +153,22 @@ def get_actual_image_tag(image_name):
         print(f"Error getting actual image tag for {image_name}: {e}")
         return image_name
 
+def get_hub_tags(api_url):
+    """Fetch a Docker Hub tag listing as HubTag records, cached so each repository is looked up once per TTL"""
+    cached = _hub_tags_cache.get(api_url)
+    if cached is not None:
+        return cached
+    return singleflight.group('hub_tags').do(api_url, lambda: _fetch_hub_tags(api_url))
+
+def _fetch_hub_tags(api_url):
+    response = ratelimit.get(api_url, timeout=10)
+    if response.status_code != 200:
+        return None
+    # Keep only the fields update checks read, not the raw listing
+    hub_tags = tuple(models.HubTag.from_result(result) for result in response.json().get('results', []))
+    _hub_tags_cache.put(api_url, hub_tags)
+    return hub_tags
+
 def check_image_updates(image_name):
     """Check for available updates for a Docker image"""
     try:
@@ -113,13 +177,13 @@ def check_image_updates(image_name):
             parts = image_name.split('/')
             if len(parts) == 2:
                 namespace, repo = parts
-                registry = 'docker.io'
+                registry_host = 'docker.io'
             elif len(parts) == 3:
-                registry, namespace, repo = parts
+                registry_host, namespace, repo = parts
             else:
                 return None
         else:
-            registry = 'docker.io'
+            registry_host = 'docker.io'
             namespace = 'library'
             repo = image_name
         
@@ -130,32 +194,37 @@ def check_image_updates(image_name):
             current_tag = 'latest'
         
         # For Docker Hub (docker.io)
-        if registry == 'docker.io':
+        if registry_host == 'docker.io':
             api_url = f"https://hub.docker.com/v2/repositories/{namespace}/{repo}/tags"
             
-            response = requests.get(api_url, timeout=10)
-            if response.status_code == 200:
-                data = response.json()
+            host_platform = get_host_platform()
+            hub_tags = get_hub_tags(api_url)
+            if hub_tags is not None:
                 tags = []
                 
-                for result in data.get('results', []):
-                    tag_name = result.get('name', '')
-                    if tag_name and not tag_name.startswith('sha256'):
-                        tag_info = {
-                            'name': tag_name,
-                            'last_updated': result.get('last_updated', ''),
-                            'size': result.get('full_size', 0),
-                            'is_latest': tag_name == 'latest'
-                        }
-                        tags.append(tag_info)
+                for hub_tag in hub_tags:
+                    if hub_tag.name and not hub_tag.name.startswith('sha256'):
+                        # Use the host platform's image so pushes of other architectures don't count as updates
+                        platform_image = next((img for img in hub_tag.images
+                                               if registry.matches_platform(img.as_platform(), host_platform)), None)
+                        if hub_tag.images and platform_image is None:
+                            continue
+                        tags.append(models.TagInfo(
+                            name=hub_tag.name,
+                            last_updated=(platform_image and platform_image.last_pushed) or hub_tag.last_updated,
+                            size=platform_image.size if platform_image and platform_image.size is not None
+                            else hub_tag.full_size,
+                            digest=platform_image.digest if platform_image else None,
+                            is_latest=hub_tag.name == 'latest'
+                        ))
                 
-                tags.sort(key=lambda x: x['last_updated'], reverse=True)
+                tags.sort(key=lambda x: x.last_updated or '', reverse=True)
                 
                 latest_tag = None
                 has_update = False
                 
                 if current_tag == 'latest':
-                    latest_tag_info = next((tag for tag in tags if tag['name'] == 'latest'), None)
+                    latest_tag_info = next((tag for tag in tags if tag.name == 'latest'), None)
                     if latest_tag_info:
                         latest_tag = 'latest'
                         has_update = False
@@ -163,27 +232,28 @@ def check_image_updates(image_name):
                         latest_tag = 'latest'
                         has_update = False
                 else:
-                    latest_tag_info = next((tag for tag in tags if tag['name'] == 'latest'), None)
+                    latest_tag_info = next((tag for tag in tags if tag.name == 'latest'), None)
                     if latest_tag_info:
                         latest_tag = 'latest'
-                        current_tag_info = next((tag for tag in tags if tag['name'] == current_tag), None)
+                        current_tag_info = next((tag for tag in tags if tag.name == current_tag), None)
                         if current_tag_info:
-                            has_update = latest_tag_info['last_updated'] > current_tag_info['last_updated']
+                            has_update = latest_tag_info.last_updated > current_tag_info.last_updated
                         else:
                             has_update = True
                     else:
-                        latest_tag = tags[0]['name'] if tags else current_tag
-                        current_tag_info = next((tag for tag in tags if tag['name'] == current_tag), None)
+                        latest_tag = tags[0].name if tags else current_tag
+                        current_tag_info = next((tag for tag in tags if tag.name == current_tag), None)
                         if current_tag_info:
-                            has_update = tags[0]['last_updated'] > current_tag_info['last_updated']
+                            has_update = tags[0].last_updated > current_tag_info.last_updated
                         else:
                             has_update = True
                 
                 return {
                     'current_tag': current_tag,
-                    'available_tags': tags[:10],
+                    'available_tags': [tag.to_dict() for tag in tags[:10]],
                     'has_update': has_update,
-                    'latest_tag': latest_tag
+                    'latest_tag': latest_tag,
+                    'platform': registry.platform_string(host_platform)
                 }
         
         return None
@@ -192,20 +262,37 @@ def check_image_updates(image_name):
         print(f"Error checking image updates for {image_name}: {e}")
         return None
 
-def get_container_update_info(container_name, image_name):
-    """Get update information for a specific container"""
+def get_container_update_info(container_name, image_name, image=None):
+    """Get update information for a specific container (image: its ImageRecord, when already known)"""
     try:
         # Get current image ID
         current_image_id = None
-        if docker_client:
+        full_image_id = None
+        repo_digests = []
+        client = get_docker_client()
+        if image is not None:
+            current_image_id = image.short_id
+            full_image_id = image.id
+            repo_digests = list(image.repo_digests)
+        elif client:
             try:
-                container = docker_client.containers.get(container_name)
+                container = client.containers.get(container_name)
                 current_image_id = container.image.short_id
+                full_image_id = container.image.id
+                repo_digests = container.image.attrs.get('RepoDigests', [])
             except:
                 pass
         
-        # Get update information
-        update_info = check_image_updates(image_name)
+        # Dashboard lookups give way to update cycles when the registry budget runs low
+        with ratelimit.priority(ratelimit.DASHBOARD):
+            update_info = check_image_updates(image_name)
+            
+            # Same tag re-pushed: compare the platform-specific digest with the running image
+            if update_info and not update_info['has_update'] and full_image_id:
+                remote = registry.resolve_platform_manifest(image_name, get_host_platform())
+                if remote and not registry.image_matches_remote(remote, full_image_id, repo_digests):
+                    update_info['has_update'] = True
+                    update_info['latest_tag'] = update_info['current_tag']
         
         return {
             'container_name': container_name,
@@ -229,6 +316,121 @@ def save_config(config):
     with open(CONFIG_PATH, 'w') as f:
         json.dump(config, f, indent=2)
 
+def get_host_platform():
+    """Get the platform used for update checks, honouring a global.platform override"""
+    host = fleet.current_host()
+    if fleet.is_remote(host):
+        return fleet.get_host_platform(host, get_docker_client())
+    return registry.get_host_platform(load_config().get('global', {}).get('platform'))
+
+def json_snapshot(name, key, build):
+    """Return (body, etag) for a named JSON snapshot, calling build() only when key changes"""
+    snapshot = _snapshots.get(name)
+    if snapshot is None or snapshot['key'] != key:
+        # Requests arriving while the same snapshot is being rebuilt wait for that build
+        snapshot = singleflight.group(f"snapshot:{name}").do(key, lambda: _build_snapshot(name, key, build))
+    return snapshot['body'], snapshot['etag']
+
+def _build_snapshot(name, key, build):
+    body = json.dumps(build(), sort_keys=True).encode()
+    snapshot = {'key': key, 'body': body, 'etag': hashlib.sha1(body).hexdigest()[:20]}
+    _snapshots[name] = snapshot
+    return snapshot
+
+def snapshot_response(name, key, build):
+    """Serve a JSON snapshot, answering 304 when the client already has it"""
+    body, etag = json_snapshot(name, key, build)
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def _file_key(path):
+    try:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+def asset_url(filename):
+    """Fingerprinted static URL so assets can be cached as immutable"""
+    path = os.path.join(app.static_folder, filename)
+    key = _file_key(path)
+    cached = _asset_hashes.get(filename)
+    if cached is None or cached[0] != key:
+        with open(path, 'rb') as f:
+            cached = (key, hashlib.md5(f.read()).hexdigest()[:10])
+        _asset_hashes[filename] = cached
+    return f"/static/{filename}?v={cached[1]}"
+
+app.jinja_env.globals['asset_url'] = asset_url
+
+# Route profiling settings, re-read only when config.json changes
+_profiling_settings = {'key': None, 'settings': None}
+
+def get_profiling_settings():
+    key = _file_key(CONFIG_PATH)
+    if _profiling_settings['key'] != key or key is None:
+        _profiling_settings['settings'] = profiling.settings(load_config())
+        _profiling_settings['key'] = key
+    return _profiling_settings['settings']
+
+@app.before_request
+def start_profile():
+    settings = get_profiling_settings()
+    if settings['enabled'] and request.path in settings['routes']:
+        g.profile = profiling.profile(f"{request.method} {request.path}", settings)
+        g.profile.__enter__()
+
+@app.teardown_request
+def finish_profile(error=None):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile.__exit__(None, None, None)
+
+@app.after_request
+def cache_and_compress(response):
+    # Fingerprinted assets never change under the same URL
+    if request.endpoint == 'static' and request.args.get('v'):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+    
+    if response.status_code != 200 or 'Content-Encoding' in response.headers:
+        return response
+    if response.direct_passthrough:
+        # Static files are streamed from disk; read them so they can be compressed too
+        if request.endpoint != 'static':
+            return response
+        response.direct_passthrough = False
+    if not (response.mimetype or '').startswith(('application/json', 'text/', 'application/javascript')):
+        return response
+    
+    accepted = request.accept_encodings
+    encoding = 'br' if brotli and accepted['br'] else 'gzip' if accepted['gzip'] else None
+    if encoding is None:
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+    
+    # Snapshot bodies are compressed once per ETag
+    etag = response.get_etag()[0]
+    cache_key = (etag, encoding) if etag else None
+    compressed = _compressed.get(cache_key) if cache_key else None
+    if compressed is None:
+        compressed = brotli.compress(body) if encoding == 'br' else gzip.compress(body, compresslevel=6)
+        if cache_key:
+            _compressed.put(cache_key, compressed)
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
 @app.route('/')
 def index():
     config = load_config()
@@ -237,8 +439,7 @@ def index():
 @app.route('/config')
 def get_config():
     try:
-        config = load_config()
-        return jsonify(config)
+        return snapshot_response('config', _file_key(CONFIG_PATH), load_config)
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)})
 
@@ -281,24 +482,70 @@ def update_config():
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)})
 
+def _run_container_job(host_name, container_name, target_tag):
+    import guardian
+    guardian.reset_pull_cycle()
+    # The tag is persisted by the job that applies it, so a rejected or failed request never changes config
+    config = load_config()
+    host = fleet.find_host(config, host_name)
+    container_config = next((c for c in (host or {}).get('containers', []) if c['name'] == container_name), None)
+    if container_config is None:
+        return False, f"Container {container_name} is no longer in config"
+    image_base = container_config['image'].split(':')[0] if ':' in container_config['image'] else \
+        container_config['image']
+    container_config['image'] = f"{image_base}:{target_tag}"
+    save_config(config)
+    with fleet.using_host(host):
+        if guardian.update_container(container_config):
+            return True, f"Successfully updated {container_name} to {target_tag}"
+    return False, f"Failed to update {container_name}"
+
+def _run_cycle_job():
+    import guardian
+    guardian.run_updates()
+    return True, "Update completed successfully"
+
+def _run_webhook_job(host, container_config):
+    import guardian
+    name = container_config['name']
+    config = guardian.load_config()
+    guardian.reset_pull_cycle()
+    with fleet.using_host(host):
+        if config.get('global', {}).get('dry_run', False):
+            entry = guardian.plan_container(container_config)
+            return True, f"Dry run: {name} would be {'updated' if entry['action'] == 'update' else entry['action']}"
+        if not guardian.in_maintenance_window(config):
+            # Pull now so the next cycle inside the window only has to restart
+            outcome = guardian.prefetch_container(container_config)
+            return outcome['status'] != 'failed', f"{name}: {outcome['status']}, restart deferred to maintenance window"
+        if guardian.update_container(container_config):
+            return True, f"Updated {name} after registry push"
+    return False, f"Failed to update {name}"
+
+def _job_response(job, coalesced):
+    return jsonify({
+        "status": "accepted",
+        "job_id": job['id'],
+        "coalesced": coalesced,
+        "message": f"Joined running job {job['id']}" if coalesced else f"Job {job['id']} queued"
+    }), 202
+
 @app.route('/run-now', methods=['POST'])
 def run_now():
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         container_name = data.get('name')
         target_tag = data.get('target_tag')
+        config = load_config()
+        jobs.configure(config.get('global', {}).get('job_workers', 2),
+                       config.get('global', {}).get('job_history', 100))
         
-        if not container_name:
-            return jsonify({"status": "error", "message": "Container name required"})
-        
-        if target_tag:
-            # Update specific container to target tag
-            import guardian
-            config = guardian.load_config()
-            
-            # Find the container in config
+        if container_name and target_tag:
+            # Find the container in config (on the requested host in fleet mode)
+            host = fleet.find_host(config, data['host']) if data.get('host') else \
+                fleet.find_container_host(config, container_name)
             container_config = None
-            for c in config.get('containers', []):
+            for c in (host or {}).get('containers', []):
                 if c['name'] == container_name:
                     container_config = c
                     break
@@ -306,61 +553,114 @@ def run_now():
             if not container_config:
                 return jsonify({"status": "error", "message": f"Container {container_name} not found in config"})
             
-            # Update the image to target tag
-            original_image = container_config['image']
-            image_base = original_image.split(':')[0] if ':' in original_image else original_image
-            container_config['image'] = f"{image_base}:{target_tag}"
-            
-            # Save updated config
-            guardian.save_config(config)
-            
-            # Run update for this specific container
-            result = guardian.update_container(container_config)
-            
-            if result:
-                return jsonify({"status": "success", "message": f"Successfully updated {container_name} to {target_tag}"})
-            else:
-                return jsonify({"status": "error", "message": f"Failed to update {container_name}"})
+            # Updates for the same container share one job, as long as they go to the same tag
+            job, coalesced = jobs.submit(f"container:{host['name']}/{container_name}", 'update',
+                                         _run_container_job, host['name'], container_name, target_tag,
+                                         target=container_name, variant=target_tag)
         else:
-            # Run the full update script
-            result = subprocess.run(['python3', 'guardian.py'], 
-                                  capture_output=True, text=True, timeout=300)
-            
-            if result.returncode == 0:
-                return jsonify({"status": "success", "message": "Update completed successfully"})
-            else:
-                return jsonify({"status": "error", "message": f"Update failed: {result.stderr}"})
+            # Run the full update cycle
+            job, coalesced = jobs.submit('cycle', 'cycle', _run_cycle_job)
+        
+        return _job_response(job, coalesced)
     
+    except jobs.QueueFull as e:
+        return jsonify({"status": "error", "message": f"Too many queued jobs: {e}"}), 429
+    except jobs.Conflict as e:
+        return jsonify({"status": "error", "message": f"Another update of {container_name} is in progress: {e}"}), 409
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)})
 
-@app.route('/containers')
-def get_containers():
-    """Get list of running Docker containers"""
+@app.route('/webhook', methods=['POST'])
+def receive_webhook():
+    """Registry push notification: queue updates for the auto-update containers using the pushed repo:tag"""
+    config = load_config()
+    secret = os.environ.get('GUARDIAN_WEBHOOK_SECRET') or config.get('global', {}).get('webhook_secret')
+    if not secret:
+        return jsonify({"status": "error", "message": "Webhooks are disabled; set webhook_secret"}), 403
+    body = request.get_data()
+    if not webhooks.verify(secret, body, request.headers, request.args.get('token')):
+        return jsonify({"status": "error", "message": "Invalid signature"}), 401
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return jsonify({"status": "error", "message": "Payload is not JSON"}), 400
+
+    import guardian
+    refs = webhooks.parse_pushes(payload)
+    managed = guardian.managed_config()
+    index_key = (_file_key(CONFIG_PATH), discovery.generation())
+    matches = [(host, c) for host, c in webhooks.find_containers(managed, index_key, refs)
+               if c.get('enabled', True) and c.get('auto_update', False)]
+    jobs.configure(config.get('global', {}).get('job_workers', 2),
+                   config.get('global', {}).get('job_history', 100))
+    queued = []
+    try:
+        for host, container_config in matches:
+            registry.forget_manifest(container_config['image'])
+            job, coalesced = jobs.submit(f"container:{host['name']}/{container_config['name']}", 'webhook',
+                                         _run_webhook_job, host, container_config,
+                                         target=container_config['name'])
+            queued.append({'name': container_config['name'], 'host': host['name'],
+                           'job_id': job['id'], 'coalesced': coalesced})
+    except jobs.QueueFull as e:
+        return jsonify({"status": "error", "message": f"Too many queued jobs: {e}", "jobs": queued}), 429
+
+    print(f"Webhook: {len(refs)} pushed ref(s), {len(queued)} update(s) queued")
+    return jsonify({
+        "status": "accepted",
+        "pushed": [f"{reg}/{repo}:{tag}" for reg, repo, tag in refs],
+        "jobs": queued
+    }), 202
+
+@app.route('/jobs')
+def get_jobs():
+    """List recent jobs, newest first"""
+    return jsonify({'jobs': jobs.list_jobs()})
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    """Get a job's status and per-phase progress"""
+    job = jobs.get_job(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": f"Job {job_id} not found"}), 404
+    return jsonify(job)
+
+def _image_index(client):
+    """Local images as compact records, by ID and by tag, from one image list call"""
+    by_id, by_tag = {}, {}
+    for summary in client.api.images():
+        image = models.ImageRecord.from_summary(summary)
+        by_id[image.id] = image
+        for tag in image.tags:
+            by_tag[tag] = image
+    return by_id, by_tag
+
+def list_containers():
+    """List running containers with update information on the current host"""
     containers = []
+    client = get_docker_client()
     
-    if docker_client:
+    if client:
         try:
-            for container in docker_client.containers.list():
-                ports = []
-                for port, port_bindings in container.ports.items():
-                    if port_bindings:
-                        for binding in port_bindings:
-                            ports.append(f"{binding['HostIp']}:{binding['HostPort']}->{port}")
+            # Summary lists instead of SDK objects: two API calls, no per-container inspect
+            images_by_id, images_by_tag = _image_index(client)
+            for summary in client.api.containers():
+                container = models.ContainerRecord.from_summary(summary)
+                image = images_by_id.get(container.image_id)
                 
                 # Get update information
-                image_name = container.image.tags[0] if container.image.tags else container.image.short_id
+                image_name = (image.tags[0] if image.tags else image.short_id) if image else container.image
                 # Get the actual image tag (resolve 'latest' to real version)
-                actual_image_name = get_actual_image_tag(image_name)
-                update_info = get_container_update_info(container.name, actual_image_name)
+                actual_image_name = get_actual_image_tag(image_name, images_by_tag)
+                update_info = get_container_update_info(container.name, actual_image_name, image)
                 
                 containers.append({
-                    'id': container.short_id,
+                    'id': container.id,
                     'name': container.name,
                     'image': actual_image_name,  # Show actual image tag instead of 'latest'
                     'status': container.status,
-                    'ports': ports,
-                    'created': container.attrs['Created'][:19],
+                    'ports': list(container.ports),
+                    'created': container.created,
                     'update_info': update_info
                 })
         except Exception as e:
@@ -368,7 +668,7 @@ def get_containers():
             # Fallback to subprocess
             pass
     
-    if not containers:
+    if not containers and not fleet.is_remote(fleet.current_host()):
         # Fallback to subprocess method
         try:
             result = subprocess.run(['docker', 'ps', '--format', 'json'], 
@@ -404,57 +704,319 @@ def get_containers():
         except Exception as e:
             print(f"Error getting containers via subprocess: {e}")
     
-    return jsonify({'containers': containers})
+    return containers
+
+@app.route('/containers')
+def get_containers():
+    """Get list of running Docker containers (cached briefly and served with an ETag)"""
+    config = load_config()
+    ttl = config.get('global', {}).get('containers_cache_ttl', CONTAINERS_CACHE_TTL)
+    key = (int(time.time() // ttl) if ttl else time.time(), _file_key(CONFIG_PATH))
+    return snapshot_response('containers', key, lambda: build_containers(config))
+
+@app.route('/plan')
+def get_plan():
+    """Dry-run plan: containers that would change, estimated downloads and rollout order"""
+    import guardian
+    try:
+        config = load_config()
+        ttl = config.get('global', {}).get('plan_cache_ttl', PLAN_CACHE_TTL)
+        key = (int(time.time() // ttl) if ttl else time.time(), _file_key(CONFIG_PATH))
+        return snapshot_response('plan', key, guardian.plan_updates)
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+def build_containers(config):
+    """Build the /containers payload, aggregated across hosts in fleet mode"""
+    if not fleet.is_fleet(config):
+        return {'containers': list_containers()}
+    
+    hosts = fleet.get_hosts(config)
+    results = fleet.for_each_host(hosts, lambda host: list_containers(),
+                                  workers=config.get('global', {}).get('fleet_workers', 8))
+    containers = []
+    host_status = []
+    for host in hosts:
+        result = results[host['name']]
+        if isinstance(result, Exception):
+            host_status.append({'name': host['name'], 'status': 'error', 'message': str(result)})
+            continue
+        host_status.append({'name': host['name'], 'status': 'ok', 'containers': len(result)})
+        for c in result:
+            c['host'] = host['name']
+            containers.append(c)
+    
+    return {'containers': containers, 'hosts': host_status}
+
+def docker_running():
+    """Probe the Docker CLI; the result is reused for DOCKER_PROBE_TTL seconds"""
+    cached = _snapshots.get('docker_probe')
+    if cached and time.time() - cached['at'] < DOCKER_PROBE_TTL:
+        return cached['running']
+    return singleflight.group('docker_probe').do('docker_probe', _probe_docker)
+
+def _probe_docker():
+    running = False
+    try:
+        result = subprocess.run(['docker', 'ps'], capture_output=True, text=True, timeout=5)
+        running = result.returncode == 0
+    except:
+        pass
+    _snapshots['docker_probe'] = {'at': time.time(), 'running': running}
+    return running
+
+def build_status(running, last_check):
+    logs = []
+    
+    # Read the tail of guardian.log and cron.log without loading the whole file
+    for name, path, tail in LOG_FILES:
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in deque((line for line in f if line.strip()), maxlen=tail):
+                    logs.append(models.LogEntry.from_line(name, line))
+    
+    return {
+        'logs': [entry.to_dict() for entry in logs],
+        'system_status': {'docker_running': running, 'last_check': last_check}
+    }
 
 @app.route('/status')
 def get_status():
-    """Get system status and logs"""
+    """Get system status and logs (rebuilt only when a log file, the Docker probe or the last check changes)"""
     try:
-        logs = []
-        
-        # Read guardian.log
-        if os.path.exists('logs/guardian.log'):
-            with open('logs/guardian.log', 'r') as f:
-                guardian_logs = f.readlines()
-                for line in guardian_logs[-50:]:  # Last 50 lines
-                    if line.strip():
-                        logs.append({
-                            'file': 'guardian',
-                            'content': line.strip(),
-                            'timestamp': line.split(' - ')[0] if ' - ' in line else ''
-                        })
-        
-        # Read cron.log
-        if os.path.exists('logs/cron.log'):
-            with open('logs/cron.log', 'r') as f:
-                cron_logs = f.readlines()
-                for line in cron_logs[-20:]:  # Last 20 lines
-                    if line.strip():
-                        logs.append({
-                            'file': 'cron',
-                            'content': line.strip(),
-                            'timestamp': line.split(' - ')[0] if ' - ' in line else ''
-                        })
-        
-        # Check Docker status
-        docker_running = False
-        try:
-            result = subprocess.run(['docker', 'ps'], capture_output=True, text=True, timeout=5)
-            docker_running = result.returncode == 0
-        except:
-            pass
-        
-        return jsonify({
-            'logs': logs,
-            'system_status': {'docker_running': docker_running, 'last_check': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-        })
+        running = docker_running()
+        # The last image check the update cycles recorded, not when this snapshot was built
+        last_check = store.last_check()
+        key = (tuple(_file_key(path) for _, path, _ in LOG_FILES), running, last_check)
+        return snapshot_response('status', key, lambda: build_status(running, last_check))
         
     except Exception as e:
         return jsonify({
             'logs': [{'file': 'error', 'content': f"Error getting status: {e}", 'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}],
-            'system_status': {'docker_running': False, 'last_check': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+            'system_status': {'docker_running': False, 'last_check': None}
         })
 
+def _rss_bytes():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def debug_enabled():
+    """Heap-walking debug endpoints are opt-in: GUARDIAN_DEBUG=1, global.debug or the --dev server"""
+    if app.debug or os.environ.get('GUARDIAN_DEBUG', '').strip().lower() in ('1', 'true', 'yes', 'on'):
+        return True
+    return bool(load_config().get('global', {}).get('debug', False))
+
+@app.route('/debug/memory')
+def get_memory():
+    """RSS, bounded cache sizes, snapshot sizes and live object counts of this process"""
+    import gc
+    import resource
+    from collections import Counter
+    if not debug_enabled():
+        return jsonify({"status": "error", "message": "Debug endpoints are disabled; set GUARDIAN_DEBUG=1"}), 403
+    try:
+        limit = max(1, min(int(request.args.get('limit', 20)), 200))
+    except ValueError:
+        return jsonify({"status": "error", "message": "limit must be an integer"}), 400
+    objects = Counter(type(o).__name__ for o in gc.get_objects())
+    records = ('ImageRecord', 'ContainerRecord', 'HubTag', 'PlatformImage', 'TagInfo', 'LogEntry')
+    return jsonify({
+        'rss_bytes': _rss_bytes(),
+        'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'caches': lru.stats(),
+        'snapshots': {name: len(snapshot['body']) for name, snapshot in list(_snapshots.items())
+                      if 'body' in snapshot},
+        'discovered': discovery.sizes(),
+        'jobs': len(jobs.list_jobs()),
+        'gc_objects': sum(objects.values()),
+        'records': {name: objects.get(name, 0) for name in records},
+        'top_types': dict(objects.most_common(limit)),
+    })
+
+@app.route('/debug/singleflight')
+def get_singleflight_stats():
+    """Executed vs coalesced counts for the shared lookups (snapshots, Hub tags, manifests, Docker probe)"""
+    return jsonify({'groups': singleflight.stats()})
+
+@app.route('/disk')
+def get_disk():
+    """Disk usage per host (filesystem and `docker system df`) and recent cleanup runs"""
+    try:
+        config = load_config()
+        key = (int(time.time() // DISK_CACHE_TTL), _file_key(CONFIG_PATH))
+        return snapshot_response('disk', key, lambda: build_disk(config))
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+def build_disk(config):
+    disk_settings = disk.settings(config)
+
+    def host_disk(host):
+        client = get_docker_client()
+        if client is None:
+            raise Exception("Docker API unavailable")
+        fs = disk.docker_filesystem(client, disk_settings)
+        return {
+            'filesystem': fs,
+            'min_free_bytes': disk.min_free(fs, disk_settings) if fs else None,
+            'under_pressure': disk.under_pressure(fs, disk_settings),
+            'docker': disk.docker_usage(client),
+            'cleanups': store.list_cleanups(host['name'], limit=10),
+        }
+
+    hosts = fleet.get_hosts(config)
+    results = fleet.for_each_host(hosts, host_disk, workers=config.get('global', {}).get('fleet_workers', 8))
+    return {'hosts': [dict({'host': name, 'error': str(r)} if isinstance(r, Exception) else r, host=name)
+                      for name, r in results.items()]}
+
+@app.route('/load')
+def get_load():
+    """Host load now, throttling decisions per host and action over the last day, and the latest decisions"""
+    try:
+        config = load_config()
+        settings = hostload.settings(config)
+        hosts = []
+        for host in fleet.get_hosts(config):
+            sample = None if fleet.is_remote(host) else hostload.sample()
+            level, reasons = hostload.assess(sample, settings)
+            hosts.append({'host': host['name'], 'sample': sample, 'level': level if sample else None,
+                          'reasons': reasons})
+        since = datetime.fromtimestamp(time.time() - 24 * 3600).strftime('%Y-%m-%d %H:%M:%S')
+        return jsonify({'settings': settings, 'hosts': hosts, 'last_24h': store.load_decision_counts(since),
+                        'decisions': store.list_load_decisions(limit=int(request.args.get('limit', 20)))})
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/ratelimit')
+def get_ratelimit():
+    """Registry request budget and circuit breaker state per registry host"""
+    return jsonify({'budgets': ratelimit.status()})
+
+@app.route('/schedule')
+def get_schedule():
+    """Adaptive check schedule: interval, next check and the reason for it, per container"""
+    import guardian
+    try:
+        settings = guardian.adaptive_check_settings(guardian.load_config())
+        now = datetime.now().strftime(guardian.TIME_FORMAT)
+        schedule = [dict(entry, due=entry['next_check'] <= now) for entry in store.list_check_schedules()]
+        return jsonify({'settings': settings, 'schedule': schedule})
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/discovery')
+def get_discovery():
+    """Containers discovered by label on each host (?refresh=1 re-syncs now)"""
+    import guardian
+    try:
+        config = guardian.load_config()
+        settings = discovery.settings(config)
+        if settings['enabled']:
+            guardian.managed_config(force_discovery=request.args.get('refresh') == '1')
+        hosts = []
+        for host in fleet.get_hosts(config):
+            idx = discovery.index(host['name'])
+            synced = datetime.fromtimestamp(idx.synced).strftime('%Y-%m-%d %H:%M:%S') if idx.synced else None
+            hosts.append({'host': host['name'], 'synced': synced, 'containers': idx.containers()})
+        return jsonify({'settings': settings, 'hosts': hosts})
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/journal')
+def get_journal():
+    """In-flight update phases from the write-ahead journal, flagging entries whose process is gone"""
+    import guardian
+    try:
+        entries = [dict(entry, orphaned=not guardian._owner_alive(entry['owner'])) for entry in store.journal_list()]
+        return jsonify({'journal': entries})
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/profiles')
+def get_profiles():
+    """Profiles written for update cycles and profiled routes, newest first"""
+    settings = get_profiling_settings()
+    return jsonify({'enabled': settings['enabled'], 'mode': settings['mode'], 'routes': settings['routes'],
+                    'profiles': profiling.list_profiles(settings['dir'])})
+
+@app.route('/profiles/<name>')
+def download_profile(name):
+    """Download a profile file, or ?format=text for its top functions"""
+    directory = os.path.abspath(get_profiling_settings()['dir'])
+    if not profiling.FILE_PATTERN.match(name) or not os.path.isfile(os.path.join(directory, name)):
+        return jsonify({"status": "error", "message": f"No profile named {name}"}), 404
+    if request.args.get('format') == 'text':
+        try:
+            limit = min(int(request.args.get('limit', 40)), 500)
+            return Response(profiling.summary(os.path.join(directory, name), limit), mimetype='text/plain')
+        except Exception as e:
+            return jsonify({"status": "error", "message": str(e)}), 500
+    return send_from_directory(directory, name, as_attachment=True)
+
+@app.route('/pulls')
+def get_pulls():
+    """Get per-image pull progress written by guardian"""
+    try:
+        if os.path.exists(PULL_PROGRESS_PATH):
+            with open(PULL_PROGRESS_PATH, 'r') as f:
+                return jsonify({'pulls': json.load(f)})
+    except Exception as e:
+        print(f"Error reading pull progress: {e}")
+    return jsonify({'pulls': {}})
+
+@app.route('/history')
+def get_history():
+    """Get recorded update attempts, optionally for one container"""
+    try:
+        limit = min(int(request.args.get('limit', 50)), 500)
+        return jsonify({'updates': store.list_updates(request.args.get('name'), limit)})
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
+
+@app.route('/snapshots')
+def get_snapshot_stats():
+    """Size of the snapshot store: generations, distinct configs and bytes before and after dedup/compression"""
+    try:
+        return jsonify(store.snapshot_stats())
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/snapshots/<path:name>')
+def get_snapshots(name):
+    """List stored config generations for a container"""
+    try:
+        return jsonify({'snapshots': store.list_snapshots(name)})
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
+
+@app.route('/rollback', methods=['POST'])
+def rollback():
+    """Recreate a container from a stored generation (latest by default)"""
+    try:
+        data = request.get_json()
+        container_name = data.get('name')
+        generation = data.get('generation')
+        
+        if not container_name:
+            return jsonify({"status": "error", "message": "Container name required"})
+        
+        import guardian
+        host = fleet.find_host(guardian.load_config(), data['host']) if data.get('host') else None
+        with fleet.using_host(host):
+            rolled_back = guardian.rollback_container(container_name, int(generation) if generation else None)
+        if rolled_back:
+            return jsonify({"status": "success", "message": f"Rolled back {container_name}"})
+        return jsonify({"status": "error", "message": f"Rollback failed for {container_name}"})
+    
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
+
 @app.route('/update-version', methods=['POST'])
 def update_version():
     """Update version override for a container"""
@@ -466,14 +1028,8 @@ def update_version():
         if not container_name or not version:
             return jsonify({"status": "error", "message": "Container name and version required"})
         
-        # Load existing overrides
-        overrides = load_version_overrides()
-        
-        # Update the override
-        overrides[container_name] = version
-        
-        # Save the overrides
-        save_version_overrides(overrides)
+        # Save the override
+        save_version_override(container_name, version)
         
         return jsonify({"status": "success", "message": f"Version override saved for {container_name}"})
     
@@ -505,5 +1061,49 @@ def clear_logs():
             'message': f'Failed to clear logs: {e}'
         })
 
+def serve():
+    """Production entry point: threaded WSGI server with graceful shutdown"""
+    from waitress import create_server
+    
+    host = os.environ.get('GUARDIAN_HOST', '0.0.0.0')
+    port = int(os.environ.get('GUARDIAN_PORT', 8082))
+    threads = int(os.environ.get('GUARDIAN_THREADS', 8))
+    shutdown_timeout = int(os.environ.get('GUARDIAN_SHUTDOWN_TIMEOUT', 300))
+    
+    import guardian
+    guardian.configure_logging()
+    config = load_config()
+    jobs.configure(config.get('global', {}).get('job_workers', 2),
+                   config.get('global', {}).get('job_history', 100))
+    
+    # Finish or roll back restarts a crashed process left half done; other jobs wait for it
+    jobs.submit('recovery', 'recovery', guardian.recover_journal, holds_others=True)
+    
+    server = create_server(app, host=host, port=port, threads=threads)
+    
+    def stop(signum, frame):
+        raise SystemExit(0)
+    signal.signal(signal.SIGTERM, stop)
+    
+    print(f"Serving Guardian on http://{host}:{port} with {threads} threads")
+    try:
+        server.run()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        # Stop accepting requests, then let running update jobs finish; queued ones are dropped
+        server.close()
+        print(f"Shutting down; waiting up to {shutdown_timeout}s for running jobs...")
+        if not jobs.shutdown(shutdown_timeout):
+            # Job threads would keep the interpreter alive; the journal finishes their updates on next start
+            print("Timed out waiting for jobs; exiting anyway")
+            logging.shutdown()
+            os._exit(1)
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8082, debug=True)
\ No newline at end of file
+    if '--dev' in sys.argv:
+        import guardian
+        guardian.configure_logging()
+        app.run(host='0.0.0.0', port=8082, debug=True)
+    else:
+        serve()
\ No newline at end of file
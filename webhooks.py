@@ -0,0 +1,72 @@
+# webhooks.py
+import hashlib
+import hmac
+import threading
+
+import fleet
+import registry
+
+SIGNATURE_HEADERS = ('X-Guardian-Signature-256', 'X-Hub-Signature-256')
+HUB_HOSTS = (registry.DOCKER_HUB, registry.DOCKER_HUB_REGISTRY, 'index.docker.io')
+
+_index_lock = threading.Lock()
+_index = {'key': None, 'refs': {}}
+
+
+def verify(secret, body, headers, token=None):
+    """Check an HMAC-SHA256 signature of the body ("sha256=<hex>").
+
+    Docker Hub cannot sign its webhooks, so a `token` query parameter equal
+    to the secret is accepted as well.
+    """
+    expected = 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    for header in SIGNATURE_HEADERS:
+        signature = headers.get(header)
+        if signature:
+            return hmac.compare_digest(signature, expected)
+    return bool(token) and hmac.compare_digest(token, secret)
+
+
+def parse_pushes(payload):
+    """Return normalized (registry, repository, tag) refs pushed according to a webhook payload.
+
+    Understands Docker Hub webhooks and registry (distribution) notification
+    envelopes; events without a tag, such as blob uploads, are ignored.
+    """
+    refs = []
+    if isinstance(payload.get('push_data'), dict):
+        repo = payload.get('repository', {}).get('repo_name')
+        tag = payload['push_data'].get('tag')
+        if repo and tag:
+            refs.append(registry.parse_image_ref(f"{repo}:{tag}"))
+    for event in payload.get('events', []):
+        if event.get('action') != 'push':
+            continue
+        target = event.get('target', {})
+        repo, tag = target.get('repository'), target.get('tag')
+        if not repo or not tag:
+            continue
+        host = event.get('request', {}).get('host')
+        if host in HUB_HOSTS:
+            host = None
+        refs.append(registry.parse_image_ref(f"{host}/{repo}:{tag}" if host else f"{repo}:{tag}"))
+    return list(dict.fromkeys(refs))
+
+
+def _build_index(config):
+    refs = {}
+    for host in fleet.get_hosts(config):
+        for container in host.get('containers', []):
+            if container.get('image'):
+                refs.setdefault(registry.parse_image_ref(container['image']), []).append((host, container))
+    return refs
+
+
+def find_containers(config, config_key, refs):
+    """Return [(host, container config)] using any of the refs; the index is rebuilt when config_key changes"""
+    with _index_lock:
+        if _index['key'] != config_key or config_key is None:
+            _index['refs'] = _build_index(config)
+            _index['key'] = config_key
+        index = _index['refs']
+    return [match for ref in refs for match in index.get(ref, [])]